@@ -12,16 +12,19 @@ if GRADIO_TEMP_DIR is None:
 
 from ktem.main import App  # noqa
 
-app = App()
-demo = app.make()
-demo.queue().launch(
-    favicon_path=app._favicon,
-    # inbrowser=True,
-    allowed_paths=[
-        "libs/ktem/ktem/assets",
-        GRADIO_TEMP_DIR,
-    ],
-    server_name="127.0.0.1",
-    server_port=8082,
-    root_path="/jvis",
-)
+# the file index may spawn loader processes, which import this module again
+if __name__ == "__main__":
+    app = App()
+    demo = app.make()
+    demo.queue().launch(
+        favicon_path=app._favicon,
+        # inbrowser=True,
+        allowed_paths=[
+            "libs/ktem/ktem/assets",
+            GRADIO_TEMP_DIR,
+            getattr(flowsettings, "KH_BLOB_STORE_PATH", GRADIO_TEMP_DIR),
+        ],
+        server_name="127.0.0.1",
+        server_port=8082,
+        root_path="/jvis",
+    )
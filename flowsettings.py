@@ -83,6 +83,12 @@ KH_FEATURE_USER_MANAGEMENT_PASSWORD = str(
 KH_ENABLE_ALEMBIC = False
 KH_DATABASE = f"sqlite:///{KH_USER_DATA_DIR / 'sql.db'}"
 KH_FILESTORAGE_PATH = str(KH_USER_DATA_DIR / "files")
+# the page thumbnails and figures are stored once per content in this directory,
+# the indexed documents only keep a "blob://" reference to them. The blobs are kept
+# when their files are deleted, see scripts/migrate/migrate_image_blobs.py --prune
+KH_BLOB_STORE_PATH = config(
+    "KH_BLOB_STORE_PATH", default=str(KH_USER_DATA_DIR / "blobs")
+)
 KH_WEB_SEARCH_BACKEND = (
     "kotaemon.indices.retrievers.tavily_web_search.WebSearch"
     # "kotaemon.indices.retrievers.jina_web_search.WebSearch"
@@ -91,6 +97,7 @@ KH_WEB_SEARCH_BACKEND = (
 KH_DOCSTORE = {
     # "__type__": "kotaemon.storages.ElasticsearchDocumentStore",
     # "__type__": "kotaemon.storages.SimpleFileDocumentStore",
+    # "__type__": "kotaemon.storages.SQLiteDocumentStore",
     "__type__": "kotaemon.storages.LanceDBDocumentStore",
     "path": str(KH_USER_DATA_DIR / "docstore"),
 }
@@ -99,6 +106,7 @@ KH_VECTORSTORE = {
     # "__type__": "kotaemon.storages.ChromaVectorStore",
     "__type__": "kotaemon.storages.MilvusVectorStore",
     # "__type__": "kotaemon.storages.QdrantVectorStore",
+    # "__type__": "kotaemon.storages.NumpyVectorStore",
     "path": str(KH_USER_DATA_DIR / "vectorstore"),
 }
 KH_LLMS = {}
@@ -254,6 +262,13 @@ KH_EMBEDDINGS["google"] = {
 #     "default": False,
 # }
 
+# cache the embeddings of all models on disk, keyed by model config and text hash
+KH_EMBEDDING_CACHE = config("KH_EMBEDDING_CACHE", default=False, cast=bool)
+KH_EMBEDDING_CACHE_PATH = KH_APP_DATA_DIR / "embedding_cache.db"
+KH_EMBEDDING_CACHE_SIZE_MB = config(
+    "KH_EMBEDDING_CACHE_SIZE_MB", default=1024, cast=int
+)
+
 # default reranking models
 KH_RERANKINGS["cohere"] = {
     "spec": {
@@ -271,6 +286,20 @@ KH_REASONINGS = [
     "ktem.reasoning.rewoo.RewooAgentPipeline",
 ]
 KH_REASONINGS_USE_MULTIMODAL = config("USE_MULTIMODAL", default=False, cast=bool)
+# the retrievers run concurrently, the results of a retriever still running this many
+# seconds after its start are dropped
+KH_RETRIEVER_TIMEOUT = config("KH_RETRIEVER_TIMEOUT", default=60, cast=float)
+# replay the answer of a similar question asked on the same files with the same
+# settings, until one of the files is re-indexed or deleted
+KH_ANSWER_CACHE = config("KH_ANSWER_CACHE", default=False, cast=bool)
+KH_ANSWER_CACHE_PATH = KH_APP_DATA_DIR / "answer_cache.db"
+KH_ANSWER_CACHE_SIMILARITY = config(
+    "KH_ANSWER_CACHE_SIMILARITY", default=0.95, cast=float
+)
+KH_ANSWER_CACHE_TTL = config("KH_ANSWER_CACHE_TTL", default=24 * 3600, cast=float)
+# the chat tokens streamed within this many seconds are sent to the UI together,
+# set to 0 to send every token
+KH_CHAT_STREAM_INTERVAL = config("KH_CHAT_STREAM_INTERVAL", default=0.1, cast=float)
 KH_VLM_ENDPOINT = "{0}/openai/deployments/{1}/chat/completions?api-version={2}".format(
     config("AZURE_OPENAI_ENDPOINT", default=""),
     config("OPENAI_VISION_DEPLOYMENT_NAME", default="gpt-4o"),
@@ -310,6 +339,13 @@ if USE_NANO_GRAPHRAG:
     GRAPHRAG_INDEX_TYPES.append("ktem.index.file.graph.NanoGraphRAGIndex")
 if USE_LIGHTRAG:
     GRAPHRAG_INDEX_TYPES.append("ktem.index.file.graph.LightRAGIndex")
+# number of loaded graphs kept in memory by the GraphRAG and nano-graphrag retrievers
+KH_GRAPHRAG_CACHE_SIZE = config("KH_GRAPHRAG_CACHE_SIZE", default=8, cast=int)
+# nano-graphrag and LightRAG insert this many documents (of 4 pages) concurrently,
+# with at most KH_GRAPH_LLM_CONCURRENCY LLM calls at once, and save a checkpoint
+# after each of these rounds to resume an interrupted build
+KH_GRAPH_INSERT_ROUND_SIZE = config("KH_GRAPH_INSERT_ROUND_SIZE", default=8, cast=int)
+KH_GRAPH_LLM_CONCURRENCY = config("KH_GRAPH_LLM_CONCURRENCY", default=8, cast=int)
 
 KH_INDEX_TYPES = [
     "ktem.index.file.FileIndex",
@@ -1,15 +1,12 @@
 import logging
 import re
-from functools import partial
 from typing import Optional
 
-import tiktoken
-
 from kotaemon.agents.base import BaseAgent, BaseLLM
 from kotaemon.agents.io import AgentAction, AgentFinish, AgentOutput, AgentType
 from kotaemon.agents.tools import BaseTool
 from kotaemon.base import Document, Param
-from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.indices.splitters import TokenSplitter, TokenTruncator
 from kotaemon.llms import PromptTemplate
 
 FINAL_ANSWER_ACTION = "Final Answer:"
@@ -43,7 +40,7 @@ class ReactAgent(BaseAgent):
         default=3000,
         help="Max context length for each tool output.",
     )
-    trim_func: TokenSplitter | None = None
+    trim_func: TokenSplitter | TokenTruncator | None = None
 
     def _compose_plugin_description(self) -> str:
         """
@@ -151,16 +148,7 @@ class ReactAgent(BaseAgent):
         evidence_trim_func = (
             self.trim_func
             if self.trim_func
-            else TokenSplitter(
-                chunk_size=self.max_context_length,
-                chunk_overlap=0,
-                separator=" ",
-                tokenizer=partial(
-                    tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-                    allowed_special=set(),
-                    disallowed_special="all",
-                ),
-            )
+            else TokenTruncator(max_tokens=self.max_context_length)
         )
         if isinstance(text, str):
             texts = evidence_trim_func([Document(text=text)])
@@ -1,10 +1,13 @@
 import logging
 import re
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial
-from typing import Any
+from math import inf
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Optional
 
-import tiktoken
+from decouple import config
 
 from kotaemon.agents.base import BaseAgent
 from kotaemon.agents.io import AgentOutput, AgentType, BaseScratchPad
@@ -12,12 +15,19 @@ from kotaemon.agents.tools import BaseTool
 from kotaemon.agents.utils import get_plugin_response_content
 from kotaemon.base import Document, Node, Param
 from kotaemon.indices.qa.citation import CitationPipeline
-from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.indices.splitters import TokenSplitter, TokenTruncator
 from kotaemon.llms import BaseLLM, PromptTemplate
 
 from .planner import Planner
 from .solver import Solver
 
+TOOL_CONCURRENCY = config("KH_AGENT_TOOL_CONCURRENCY", default=8, cast=int)
+# the tool calls of all the agents share these slots. A slot is held until the call
+# actually exits, including the calls abandoned after their timeout
+_tool_slots = threading.BoundedSemaphore(max(TOOL_CONCURRENCY, 1))
+# how often the calls waiting for a slot are checked, in seconds
+SLOT_POLL_INTERVAL = 0.1
+
 
 class RewooAgent(BaseAgent):
     """Distributive RewooAgent class inherited from BaseAgent.
@@ -43,7 +53,14 @@ class RewooAgent(BaseAgent):
         default=3000,
         help="Max context length for each tool output.",
     )
-    trim_func: TokenSplitter | None = None
+    trim_func: TokenSplitter | TokenTruncator | None = None
+    tool_timeout: Optional[float] = Param(
+        default=60.0,
+        help=(
+            "Time given to each tool call from its start, in seconds. The evidence "
+            "of the calls still running after it is dropped."
+        ),
+    )
 
     @Node.auto(depends_on=["planner_llm", "plugins", "prompt_template", "examples"])
     def planner(self):
@@ -150,6 +167,49 @@ class RewooAgent(BaseAgent):
 
         return evidences, level
 
+    def _resolve_tool_call(
+        self,
+        e: str,
+        planner_evidences: dict[str, str],
+        worker_evidences: dict[str, str],
+    ) -> Optional[tuple[str, str]]:
+        """
+        Get the tool and its input for a given evidence, the input variables being
+        replaced with the previous evidences. Return None if it is not a tool call.
+        """
+        tool_call = planner_evidences[e]
+        if "[" not in tool_call:
+            return None
+
+        tool, tool_input = tool_call.split("[", 1)
+        tool_input = tool_input[:-1]
+        # find variables in input and replace with previous evidences
+        for var in re.findall(r"#E\d+", tool_input):
+            if var in worker_evidences:
+                tool_input = tool_input.replace(
+                    var, worker_evidences.get(var, "") or ""
+                )
+        return tool, tool_input
+
+    def _call_tool(self, tool: str, tool_input: str, output=BaseScratchPad()):
+        """
+        Call a tool.
+        """
+        result = dict(plugin_cost=0, plugin_token=0, evidence="")
+        try:
+            selected_plugin = self._find_plugin(tool)
+            if selected_plugin is None:
+                raise ValueError("Invalid plugin detected")
+            tool_response = selected_plugin(tool_input)
+            result["evidence"] = get_plugin_response_content(tool_response)
+        except ValueError:
+            result["evidence"] = "No evidence found."
+        finally:
+            output.panel_print(
+                result["evidence"], f"[green] Function Response of [blue]{tool}: "
+            )
+        return result
+
     def _run_plugin(
         self,
         e: str,
@@ -161,35 +221,37 @@ class RewooAgent(BaseAgent):
         Run a plugin for a given evidence.
         This function should also cumulate the cost and tokens.
         """
-        result = dict(e=e, plugin_cost=0, plugin_token=0, evidence="")
-        tool_call = planner_evidences[e]
-        if "[" not in tool_call:
-            result["evidence"] = tool_call
-        else:
-            tool, tool_input = tool_call.split("[", 1)
-            tool_input = tool_input[:-1]
-            # find variables in input and replace with previous evidences
-            for var in re.findall(r"#E\d+", tool_input):
-                print("Tool input: ", tool_input)
-                print("Var: ", var)
-                print("Worker evidences: ", worker_evidences)
-                if var in worker_evidences:
-                    tool_input = tool_input.replace(
-                        var, worker_evidences.get(var, "") or ""
-                    )
+        tool_call = self._resolve_tool_call(e, planner_evidences, worker_evidences)
+        if tool_call is None:
+            return dict(
+                e=e, plugin_cost=0, plugin_token=0, evidence=planner_evidences[e]
+            )
+        return dict(e=e, **self._call_tool(*tool_call, output=output))
+
+    def _start_tool_call(
+        self,
+        future: Future,
+        tool_call: tuple[str, str],
+        output,
+        slots: threading.Semaphore,
+    ):
+        """
+        Run a tool call in its own daemon thread and set its result to `future`.
+        The caller holds one of the `slots`, released when the thread exits. A
+        call abandoned after its timeout keeps running without blocking the exit of
+        the process.
+        """
+
+        def target():
             try:
-                selected_plugin = self._find_plugin(tool)
-                if selected_plugin is None:
-                    raise ValueError("Invalid plugin detected")
-                tool_response = selected_plugin(tool_input)
-                result["evidence"] = get_plugin_response_content(tool_response)
-            except ValueError:
-                result["evidence"] = "No evidence found."
+                future.set_result(self._call_tool(*tool_call, output=output))
+            except BaseException as exc:
+                future.set_exception(exc)
             finally:
-                output.panel_print(
-                    result["evidence"], f"[green] Function Response of [blue]{tool}: "
-                )
-        return result
+                slots.release()
+
+        future.set_running_or_notify_cancel()
+        threading.Thread(target=target, name="rewoo-tool", daemon=True).start()
 
     def _get_worker_evidence(
         self,
@@ -201,41 +263,133 @@ class RewooAgent(BaseAgent):
         Parallel execution of plugins in DAG for speedup.
         This is one of core benefits of ReWOO agents.
 
+        Each #E starts as soon as the #Es it depends on are done, whatever their
+        level. The identical tool calls of the plan run once, at most
+        `KH_AGENT_TOOL_CONCURRENCY` at a time across all the agents, and the evidence
+        of a tool call still running `tool_timeout` seconds after its start is
+        dropped. A dropped call keeps its slot until it actually exits.
+
         Args:
             planner_evidences: A mapping from #E to tool call.
             evidences_level: A list of levels of evidences.
                 Calculated from DAG of plugin calls.
             output: Output object, defaults to BaseOutput().
         Returns:
-            A mapping from #E to tool call.
+            A mapping from #E to tool call, the plugin cost and tokens, and a
+            mapping from #E to its timing: start and duration in seconds since the
+            work started, and status (done, cached or timeout).
         """
         worker_evidences: dict[str, str] = dict()
+        timings: dict[str, dict] = dict()
         plugin_cost, plugin_token = 0.0, 0.0
-        with ThreadPoolExecutor() as pool:
-            for level in evidences_level:
-                results = []
-                for e in level:
-                    results.append(
-                        pool.submit(
-                            self._run_plugin,
-                            e,
-                            planner_evidences,
-                            worker_evidences,
-                            output,
-                        )
+
+        # the #Es each #E waits for, as parsed in `_parse_planner_evidences`
+        steps = [e for level in evidences_level for e in level]
+        order = {e: idx for idx, e in enumerate(planner_evidences)}
+        waiting = {e: set() for e in steps}
+        for e in steps:
+            for var in re.findall(r"#E\d+", planner_evidences[e]):
+                if var in waiting and order[var] < order[e]:
+                    waiting[e].add(var)
+
+        # the result of each tool call, or its future while it runs
+        calls: dict[tuple[str, str], dict | Future] = {}
+        running: dict[Future, tuple[tuple[str, str], list[str]]] = {}
+        # the calls waiting for a slot, and the deadline of the started ones
+        queued: deque[Future] = deque()
+        deadlines: dict[Future, float] = {}
+        started_at: dict[str, float] = {}
+        work_start = time.perf_counter()
+
+        def complete(e: str, evidence: str, status: str):
+            worker_evidences[e] = self._trim_evidence(evidence)
+            now = time.perf_counter()
+            timings[e] = {
+                "start": round(started_at[e] - work_start, 3),
+                "duration": round(now - started_at[e], 3),
+                "status": status,
+            }
+            for deps in waiting.values():
+                deps.discard(e)
+
+        # the calls release the slots they acquired, even if the limiter is replaced
+        slots = _tool_slots
+
+        def start_queued():
+            while queued and slots.acquire(blocking=False):
+                future = queued.popleft()
+                deadlines[future] = time.perf_counter() + (
+                    self.tool_timeout if self.tool_timeout is not None else inf
+                )
+                self._start_tool_call(future, running[future][0], output, slots)
+
+        def schedule():
+            ready = [e for e, deps in waiting.items() if not deps]
+            while ready:
+                for e in ready:
+                    waiting.pop(e)
+                    started_at[e] = time.perf_counter()
+                    tool_call = self._resolve_tool_call(
+                        e, planner_evidences, worker_evidences
                     )
-                if len(results) > 1:
-                    output.update_status(f"Running tasks {level} in parallel.")
-                else:
-                    output.update_status(f"Running task {level[0]}.")
-                for r in results:
-                    resp = r.result()
-                    plugin_cost += resp["plugin_cost"]
-                    plugin_token += resp["plugin_token"]
-                    worker_evidences[resp["e"]] = self._trim_evidence(resp["evidence"])
-                output.done()
+                    if tool_call is None:
+                        complete(e, planner_evidences[e], "done")
+                    elif isinstance(calls.get(tool_call), dict):
+                        complete(e, calls[tool_call]["evidence"], "cached")
+                    elif tool_call in calls:
+                        running[calls[tool_call]][1].append(e)
+                    else:
+                        output.update_status(f"Running task {e}.")
+                        future = Future()
+                        calls[tool_call] = future
+                        running[future] = (tool_call, [e])
+                        queued.append(future)
+                ready = [e for e, deps in waiting.items() if not deps]
+            start_queued()
+
+        schedule()
+        while running:
+            timeout = max(min(deadlines.values(), default=inf) - time.perf_counter(), 0)
+            if queued:
+                # the slots are freed by the calls of the other agents too
+                timeout = min(timeout, SLOT_POLL_INTERVAL)
+            done, _ = wait(
+                running,
+                timeout=None if timeout == inf else timeout,
+                return_when=FIRST_COMPLETED,
+            )
+            now = time.perf_counter()
+            expired = [
+                future
+                for future in deadlines
+                if future not in done and deadlines[future] <= now
+            ]
+
+            for future in done:
+                tool_call, es = running.pop(future)
+                deadlines.pop(future)
+                resp = future.result()
+                plugin_cost += resp["plugin_cost"]
+                plugin_token += resp["plugin_token"]
+                calls[tool_call] = resp
+                for idx, e in enumerate(es):
+                    complete(e, resp["evidence"], "cached" if idx else "done")
+
+            for future in expired:
+                tool_call, es = running.pop(future)
+                deadlines.pop(future)
+                logging.warning(
+                    f"Tool call {tool_call[0]}[{tool_call[1]}] timed out after "
+                    f"{self.tool_timeout}s, its evidence is dropped"
+                )
+                calls[tool_call] = dict(evidence="No evidence found.")
+                for e in es:
+                    complete(e, "No evidence found.", "timeout")
+
+            output.done()
+            schedule()
 
-        return worker_evidences, plugin_cost, plugin_token
+        return worker_evidences, plugin_cost, plugin_token, timings
 
     def _find_plugin(self, name: str):
         for p in self.plugins:
@@ -246,16 +400,7 @@ class RewooAgent(BaseAgent):
         evidence_trim_func = (
             self.trim_func
             if self.trim_func
-            else TokenSplitter(
-                chunk_size=self.max_context_length,
-                chunk_overlap=0,
-                separator=" ",
-                tokenizer=partial(
-                    tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-                    allowed_special=set(),
-                    disallowed_special="all",
-                ),
-            )
+            else TokenTruncator(max_tokens=self.max_context_length)
         )
         if evidence:
             texts = evidence_trim_func([Document(text=evidence)])
@@ -281,9 +426,12 @@ class RewooAgent(BaseAgent):
         )
 
         # Work
-        worker_evidences, plugin_cost, plugin_token = self._get_worker_evidence(
-            planner_evidences, evidence_level
-        )
+        (
+            worker_evidences,
+            plugin_cost,
+            plugin_token,
+            timings,
+        ) = self._get_worker_evidence(planner_evidences, evidence_level)
         worker_log = ""
         for plan in plan_to_es:
             worker_log += f"{plan}: {plans[plan]}\n"
@@ -306,7 +454,11 @@ class RewooAgent(BaseAgent):
             total_tokens=total_token,
             total_cost=total_cost,
             citation=citation,
-            metadata={"citation": citation, "worker_log": worker_log},
+            metadata={
+                "citation": citation,
+                "worker_log": worker_log,
+                "timings": timings,
+            },
         )
 
     def stream(self, instruction: str, use_citation: bool = False):
@@ -335,9 +487,12 @@ class RewooAgent(BaseAgent):
         )
 
         # Work
-        worker_evidences, plugin_cost, plugin_token = self._get_worker_evidence(
-            planner_evidences, evidence_level
-        )
+        (
+            worker_evidences,
+            plugin_cost,
+            plugin_token,
+            timings,
+        ) = self._get_worker_evidence(planner_evidences, evidence_level)
         worker_log = ""
         for plan in plan_to_es:
             worker_log += f"{plan}: {plans[plan]}\n"
@@ -352,7 +507,14 @@ class RewooAgent(BaseAgent):
                 text="",
                 agent_type=self.agent_type,
                 status="thinking",
-                intermediate_steps=[{"worker_log": current_progress}],
+                intermediate_steps=[
+                    {
+                        "worker_log": current_progress,
+                        "timings": {
+                            e: timings[e] for e in plan_to_es[plan] if e in timings
+                        },
+                    }
+                ],
             )
 
         # Solve
@@ -380,5 +542,9 @@ class RewooAgent(BaseAgent):
             total_tokens=total_token,
             total_cost=total_cost,
             citation=citation,
-            metadata={"citation": citation, "worker_log": worker_log},
+            metadata={
+                "citation": citation,
+                "worker_log": worker_log,
+                "timings": timings,
+            },
         )
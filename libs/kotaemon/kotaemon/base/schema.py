@@ -15,6 +15,7 @@ if TYPE_CHECKING:
     )
 
 IO_Type = TypeVar("IO_Type", "Document", str)
+DocumentChannel = Literal["chat", "chat_end", "info", "index", "debug", "plot"]
 SAMPLE_TEXT = "A sample Document from kotaemon"
 
 
@@ -31,6 +32,7 @@ class Document(BaseDocument):
         source: id of the source of the Document. Optional.
         channel: the channel to show the document. Optional.:
             - chat: show in chat message
+            - chat_end: the chat message is complete, no content
             - info: show in information panel
             - index: show in index panel
             - debug: show in debug panel
@@ -38,7 +40,7 @@ class Document(BaseDocument):
 
     content: Any = None
     source: Optional[str] = None
-    channel: Optional[Literal["chat", "info", "index", "debug", "plot"]] = None
+    channel: Optional[DocumentChannel] = None
 
     def __init__(self, content: Optional[Any] = None, *args, **kwargs):
         if content is None:
@@ -162,6 +162,31 @@ def makedoc(module, output, separation_level):
     print(f"Documentation exported to {output}")
 
 
+@main.command()
+@click.argument("src", required=True)
+@click.option(
+    "--dst",
+    default=None,
+    required=False,
+    help="Directory of the SQLite docstore. Defaults to SRC",
+)
+def migrate_docstore(src, dst):
+    """Migrate a SimpleFileDocumentStore directory SRC to SQLiteDocumentStore
+
+    Example:
+
+        \b
+        # Migrate the docstore of the app, then set KH_DOCSTORE to
+        # kotaemon.storages.SQLiteDocumentStore in flowsettings.py
+        $ kotaemon migrate-docstore ktem_app_data/user_data/docstore
+    """
+    from kotaemon.storages.docstores.sqlite import migrate_simple_file_docstore
+
+    migrated = migrate_simple_file_docstore(src, dst)
+    for collection_name, count in migrated.items():
+        print(f"Migrated {count} documents of collection {collection_name}")
+
+
 @main.command()
 @click.option(
     "--template",
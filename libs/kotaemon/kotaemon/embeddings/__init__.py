@@ -1,4 +1,9 @@
 from .base import BaseEmbeddings
+from .cache import (
+    BaseEmbeddingCache,
+    CachedEmbeddings,
+    DiskEmbeddingCache,
+)
 from .endpoint_based import EndpointEmbeddings
 from .fastembed import FastEmbedEmbeddings
 from .langchain_based import (
@@ -23,4 +28,7 @@ __all__ = [
     "OpenAIEmbeddings",
     "AzureOpenAIEmbeddings",
     "FastEmbedEmbeddings",
+    "CachedEmbeddings",
+    "BaseEmbeddingCache",
+    "DiskEmbeddingCache",
 ]
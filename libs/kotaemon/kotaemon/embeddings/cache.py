@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from array import array
+from pathlib import Path
+from typing import Optional
+
+from kotaemon.base import Document, DocumentWithEmbedding, Param
+
+from .base import BaseEmbeddings
+
+# params that do not change the produced vectors, or that should never be persisted
+_NON_IDENTITY_PARAMS = {
+    "timeout",
+    "request_timeout",
+    "max_retries",
+    "batch_size",
+    "max_concurrency",
+    "parallel",
+    "user_agent",
+    "organization",
+}
+_SECRET_MARKERS = ("key", "token", "secret", "credential", "password")
+
+
+def get_model_id(embedding: BaseEmbeddings) -> str:
+    """Derive a stable identity of an embedding model from its configuration
+
+    The identity covers the class and the params that affect the produced vectors
+    (model name, endpoint, dimensions...). Secrets and purely operational params
+    (timeouts, retries, batch size) are left out.
+    """
+    spec = embedding.dump()
+    if "__type__" in spec:
+        type_ = spec["__type__"]
+        params = {k: v for k, v in spec.items() if k != "__type__"}
+    else:
+        type_ = spec.get("function", embedding.__class__.__qualname__)
+        params = spec.get("params", {})
+
+    identity = {
+        key: value
+        for key, value in params.items()
+        if key not in _NON_IDENTITY_PARAMS
+        and not any(marker in key.lower() for marker in _SECRET_MARKERS)
+        and (value is None or isinstance(value, (str, int, float, bool)))
+    }
+    return f"{type_}:{json.dumps(identity, sort_keys=True)}"
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+def to_float32(vector) -> list[float]:
+    """Round the vector to the float32 precision the vectors are cached with"""
+    return array("f", vector).tolist()
+
+
+class BaseEmbeddingCache(ABC):
+    """Store embedding vectors keyed by (model id, text hash)
+
+    Implementations should be safe to share between threads, and keep the `hits`
+    and `misses` counters up to date on each `get`.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def get(self, model: str, text_hashes: list[str]) -> dict[str, list[float]]:
+        """Return the cached vectors of the found hashes, as {text_hash: vector}"""
+        ...
+
+    @abstractmethod
+    def set(self, model: str, vectors: dict[str, list[float]]):
+        """Store the vectors, given as {text_hash: vector}"""
+        ...
+
+    @abstractmethod
+    def clear(self, model: Optional[str] = None):
+        """Remove all cached vectors, or only those of `model`"""
+        ...
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class DiskEmbeddingCache(BaseEmbeddingCache):
+    """SQLite-backed embedding cache with LRU eviction by total size
+
+    The vectors are stored as float32.
+
+    Args:
+        path: path to the sqlite file, created if not exist
+        max_size: maximum total size of the stored vectors, in bytes. When exceeded,
+            the least recently used vectors are evicted down to `evict_ratio` of it.
+            Set to 0 for unbounded cache.
+        evict_ratio: fraction of `max_size` to keep after an eviction
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_size: int = 1024 * 1024 * 1024,
+        evict_ratio: float = 0.9,
+    ):
+        super().__init__()
+        self.path = Path(path)
+        self.max_size = max_size
+        self.evict_ratio = evict_ratio
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._size: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # a forked child must not reuse the connection of its parent
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            str(self.path), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        if version < 1:
+            # the vectors were stored as float64 before version 1
+            conn.execute("DROP TABLE IF EXISTS embeddings")
+            conn.execute("PRAGMA user_version = 1")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access "
+            "ON embeddings (last_access)"
+        )
+        self._conn, self._pid, self._size = conn, os.getpid(), None
+        return conn
+
+    def get(self, model: str, text_hashes: list[str]) -> dict[str, list[float]]:
+        if not text_hashes:
+            return {}
+
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            conn = self._connect()
+            unique = list(dict.fromkeys(text_hashes))
+            for start in range(0, len(unique), 500):
+                batch = unique[start : start + 500]
+                rows = conn.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({', '.join('?' * len(batch))})",
+                    [model, *batch],
+                )
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_access = ? "
+                    "WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found],
+                )
+
+            n_hits = sum(1 for text_hash in text_hashes if text_hash in found)
+            self.hits += n_hits
+            self.misses += len(text_hashes) - n_hits
+
+        return found
+
+    def set(self, model: str, vectors: dict[str, list[float]]):
+        if not vectors:
+            return
+
+        now = time.time()
+        rows = []
+        for text_hash, vector in vectors.items():
+            blob = array("f", vector).tobytes()
+            rows.append((model, text_hash, blob, len(blob), now))
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings "
+                    "(model, text_hash, vector, size, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            if self._size is not None:
+                self._size += sum(row[3] for row in rows)
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        if not self.max_size:
+            return
+
+        if self._size is None or self._size > self.max_size:
+            # the running size is an estimate (other processes and replaced rows),
+            # so refresh it from the table before deciding to evict
+            (size,) = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+            self._size = size
+
+        if self._size <= self.max_size:
+            return
+
+        target = int(self.max_size * self.evict_ratio)
+        to_free = self._size - target
+        freed, cutoff = 0, None
+        rows = conn.execute(
+            "SELECT size, last_access FROM embeddings ORDER BY last_access"
+        )
+        for size, last_access in rows:
+            freed += size
+            cutoff = last_access
+            if freed >= to_free:
+                break
+
+        if cutoff is not None:
+            conn.execute("DELETE FROM embeddings WHERE last_access <= ?", (cutoff,))
+            (self._size,) = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+
+    def clear(self, model: Optional[str] = None):
+        with self._lock:
+            conn = self._connect()
+            if model is None:
+                conn.execute("DELETE FROM embeddings")
+            else:
+                conn.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+            self._size = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+            ).fetchone()
+        return {**super().stats(), "entries": entries, "size": size}
+
+    def __persist_flow__(self):
+        return {
+            "path": str(self.path),
+            "max_size": self.max_size,
+            "evict_ratio": self.evict_ratio,
+        }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"], state["_conn"], state["_pid"] = None, None, None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class CachedEmbeddings(BaseEmbeddings):
+    """Wrap an embedding model so that already-embedded texts are served from cache
+
+    Only the texts missing from the cache are sent to the wrapped model, once per
+    unique text, and the new vectors are stored back into the cache.
+
+    Example:
+        embedding = CachedEmbeddings(
+            embedding=OpenAIEmbeddings(model="text-embedding-3-small"),
+            cache=DiskEmbeddingCache("embeddings.db"),
+        )
+    """
+
+    embedding: BaseEmbeddings = Param(help="The embedding model to cache")
+    cache: BaseEmbeddingCache = Param(help="The cache to store the embeddings")
+    model_id: str = Param(
+        None,
+        help=(
+            "Identity of the embedding model in the cache. If not set, derived "
+            "from the configuration of the wrapped model"
+        ),
+    )
+
+    @Param.auto(depends_on=["embedding", "model_id"])
+    def model_id_(self) -> str:
+        return self.model_id or get_model_id(self.embedding)
+
+    def _lookup(
+        self, text
+    ) -> tuple[list[Document], list[str], dict[str, list[float]], list[Document]]:
+        docs = self.prepare_input(text)
+        hashes = [hash_text(doc.text) for doc in docs]
+        found = self.cache.get(self.model_id_, hashes)
+
+        # embed each missing text only once, even if it repeats in the batch
+        missing: dict[str, Document] = {}
+        for doc, text_hash in zip(docs, hashes):
+            if text_hash not in found and text_hash not in missing:
+                missing[text_hash] = doc
+
+        return docs, hashes, found, list(missing.values())
+
+    def _merge(
+        self,
+        docs: list[Document],
+        hashes: list[str],
+        found: dict[str, list[float]],
+        missing: list[Document],
+        outputs: list[DocumentWithEmbedding],
+    ) -> list[DocumentWithEmbedding]:
+        if len(outputs) != len(missing):
+            raise ValueError(
+                f"Expected {len(missing)} embeddings from {self.embedding}, "
+                f"got {len(outputs)}"
+            )
+
+        # a miss gives the same vector as the next hits
+        new = {
+            hash_text(doc.text): to_float32(output.embedding)
+            for doc, output in zip(missing, outputs)
+        }
+        self.cache.set(self.model_id_, new)
+        found = {**found, **new}
+
+        return [
+            DocumentWithEmbedding(content=doc, embedding=found[text_hash])
+            for doc, text_hash in zip(docs, hashes)
+        ]
+
+    def invoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        docs, hashes, found, missing = self._lookup(text)
+        outputs = self.embedding(missing, *args, **kwargs) if missing else []
+        return self._merge(docs, hashes, found, missing, outputs)
+
+    async def ainvoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        docs, hashes, found, missing = self._lookup(text)
+        outputs = (
+            await self.embedding.ainvoke(missing, *args, **kwargs) if missing else []
+        )
+        return self._merge(docs, hashes, found, missing, outputs)
@@ -13,6 +13,7 @@ from tenacity import (
 from theflow.utils.modules import import_dotted_string
 
 from kotaemon.base import Param
+from kotaemon.llms.chats.openai import openai_clients
 
 from .base import BaseEmbeddings, Document, DocumentWithEmbedding
 
@@ -129,8 +130,10 @@ class BaseOpenAIEmbeddings(BaseEmbeddings):
     ) -> list[DocumentWithEmbedding]:
         input_ = self.prepare_input(text)
         client = self.prepare_client(async_version=True)
-        resp = await self.openai_response(
-            client, input=[_.text if _.text else " " for _ in input_], **kwargs
+        resp = (
+            await self.openai_response(
+                client, input=[_.text if _.text else " " for _ in input_], **kwargs
+            )
         ).dict()
         output_ = sorted(resp["data"], key=lambda x: x["index"])
         return [
@@ -169,11 +172,11 @@ class OpenAIEmbeddings(BaseOpenAIEmbeddings):
         if async_version:
             from openai import AsyncOpenAI
 
-            return AsyncOpenAI(**params)
+            return openai_clients.get(AsyncOpenAI, async_version=True, **params)
 
         from openai import OpenAI
 
-        return OpenAI(**params)
+        return openai_clients.get(OpenAI, **params)
 
     @retry(
         retry=retry_if_not_exception_type(
@@ -232,11 +235,11 @@ class AzureOpenAIEmbeddings(BaseOpenAIEmbeddings):
         if async_version:
             from openai import AsyncAzureOpenAI
 
-            return AsyncAzureOpenAI(**params)
+            return openai_clients.get(AsyncAzureOpenAI, async_version=True, **params)
 
         from openai import AzureOpenAI
 
-        return AzureOpenAI(**params)
+        return openai_clients.get(AzureOpenAI, **params)
 
     @retry(
         retry=retry_if_not_exception_type(
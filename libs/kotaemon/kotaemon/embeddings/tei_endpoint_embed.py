@@ -1,11 +1,177 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Optional
+
 import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
 
 from kotaemon.base import Document, DocumentWithEmbedding, Param
 
 from .base import BaseEmbeddings
 
-session = requests.session()
+# statuses of an overloaded server, the request is retried after a pause
+RETRY_STATUSES = {429, 503}
+
+
+class TeiClient:
+    """Pooled HTTP client for TEI (Text-Embedding-Inference) servers
+
+    Sync requests share a keep-alive `requests` session, async requests a keep-alive
+    `aiohttp` session per event loop. The batches of a call are sent concurrently,
+    with at most `max_concurrency` requests in flight.
+
+    When the server answers 429 or 503, the request is retried after the
+    `Retry-After` delay (or an exponential backoff), and the other requests to the
+    same endpoint wait for the same delay before being sent.
+
+    Args:
+        pool_size: maximum number of kept-alive connections per host
+        timeout: timeout of each request, in seconds
+        backoff: first retry delay when the server gives no `Retry-After`, in
+            seconds. It doubles on each retry of the same request.
+    """
+
+    def __init__(self, pool_size: int = 16, timeout: float = 60, backoff: float = 0.5):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.backoff = backoff
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._async_sessions: dict[
+            asyncio.AbstractEventLoop,
+            tuple[aiohttp.ClientSession, AsyncGenerator[None, None]],
+        ] = {}
+
+        self._lock = threading.Lock()
+        self._resume_at: dict[str, float] = {}
+
+    def _retry_delay(self, retry_after: Optional[str], attempt: int) -> float:
+        try:
+            return max(float(retry_after), 0.0)  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            return self.backoff * 2**attempt
+
+    def _pause(self, url: str, delay: float):
+        """Hold the requests to `url` for `delay` seconds"""
+        with self._lock:
+            self._resume_at[url] = max(
+                self._resume_at.get(url, 0.0), time.monotonic() + delay
+            )
+
+    def _wait_time(self, url: str) -> float:
+        with self._lock:
+            return self._resume_at.get(url, 0.0) - time.monotonic()
+
+    def post(self, url: str, payload: dict, max_retries: int = 5) -> Any:
+        for attempt in range(max_retries + 1):
+            wait = self._wait_time(url)
+            if wait > 0:
+                time.sleep(wait)
+
+            resp = self._session.post(url, json=payload, timeout=self.timeout)
+            if resp.status_code in RETRY_STATUSES and attempt < max_retries:
+                delay = self._retry_delay(resp.headers.get("Retry-After"), attempt)
+                self._pause(url, delay)
+                continue
+
+            resp.raise_for_status()
+            return resp.json()
+
+    def post_batches(
+        self,
+        url: str,
+        payloads: list[dict],
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+    ) -> list[Any]:
+        """Send the payloads concurrently, returning the responses in order"""
+        if len(payloads) <= 1 or max_concurrency <= 1:
+            return [self.post(url, payload, max_retries) for payload in payloads]
+
+        with ThreadPoolExecutor(
+            max_workers=min(max_concurrency, len(payloads)),
+            thread_name_prefix="tei-client",
+        ) as executor:
+            return list(
+                executor.map(lambda p: self.post(url, p, max_retries), payloads)
+            )
+
+    async def _keep_session(
+        self, loop: asyncio.AbstractEventLoop, session: aiohttp.ClientSession
+    ) -> AsyncGenerator[None, None]:
+        try:
+            yield
+        finally:
+            self._async_sessions.pop(loop, None)
+            await session.close()
+
+    async def _get_async_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if loop in self._async_sessions:
+            return self._async_sessions[loop][0]
+
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        # the session lives as long as the loop: like any started async generator,
+        # the keeper is closed on loop shutdown (e.g. at the end of `asyncio.run`)
+        keeper = self._keep_session(loop, session)
+        await keeper.__anext__()
+        self._async_sessions[loop] = (session, keeper)
+        return session
+
+    async def apost(self, url: str, payload: dict, max_retries: int = 5) -> Any:
+        session = await self._get_async_session()
+        for attempt in range(max_retries + 1):
+            wait = self._wait_time(url)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            async with session.post(url, json=payload) as resp:
+                if resp.status in RETRY_STATUSES and attempt < max_retries:
+                    delay = self._retry_delay(resp.headers.get("Retry-After"), attempt)
+                    self._pause(url, delay)
+                    continue
+
+                resp.raise_for_status()
+                return await resp.json()
+
+    async def apost_batches(
+        self,
+        url: str,
+        payloads: list[dict],
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+    ) -> list[Any]:
+        """Send the payloads concurrently, returning the responses in order"""
+        semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+        async def post(payload: dict) -> Any:
+            async with semaphore:
+                return await self.apost(url, payload, max_retries)
+
+        return await asyncio.gather(*[post(payload) for payload in payloads])
+
+    async def aclose(self):
+        """Close the async session of the running event loop"""
+        item = self._async_sessions.get(asyncio.get_running_loop())
+        if item is not None:
+            await item[1].aclose()
+
+
+tei_client = TeiClient()
+
+
+def make_batches(items: list, batch_size: int) -> list[list]:
+    batch_size = max(batch_size, 1)
+    return [items[idx : idx + batch_size] for idx in range(0, len(items), batch_size)]
 
 
 class TeiEndpointEmbeddings(BaseEmbeddings):
@@ -20,6 +186,9 @@ class TeiEndpointEmbeddings(BaseEmbeddings):
         normalize (bool): Whether to normalize embeddings to unit length.
         truncate (bool): Whether to truncate embeddings
             to a fixed/default length.
+        batch_size (int): Number of texts sent in each request.
+        max_concurrency (int): Maximum number of requests in flight.
+        max_retries (int): Number of retries when the server is overloaded.
     """
 
     endpoint_url: str = Param(None, help="TEI embedding service api base URL")
@@ -31,46 +200,53 @@ class TeiEndpointEmbeddings(BaseEmbeddings):
         True,
         help="Truncate embeddings to a fixed/default length",
     )
+    batch_size: int = Param(
+        32,
+        help=(
+            "Number of texts sent in each request, at most the `--max-client-batch-"
+            "size` of the TEI server"
+        ),
+    )
+    max_concurrency: int = Param(4, help="Maximum number of requests in flight")
+    max_retries: int = Param(
+        5, help="Number of retries when the server answers 429 or 503"
+    )
 
-    async def client_(self, inputs: list[str]):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url=self.endpoint_url,
-                json={
-                    "inputs": inputs,
-                    "normalize": self.normalize,
-                    "truncate": self.truncate,
-                },
-            ) as resp:
-                embeddings = await resp.json()
-        return embeddings
+    def _payloads(self, batches: list[list[str]]) -> list[dict]:
+        return [
+            {"inputs": batch, "normalize": self.normalize, "truncate": self.truncate}
+            for batch in batches
+        ]
 
-    async def ainvoke(
-        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    def _outputs(
+        self, batches: list[list[str]], responses: list[list[list[float]]]
     ) -> list[DocumentWithEmbedding]:
-        if not isinstance(text, list):
-            text = [text]
-        text = self.prepare_input(text)
-
         outputs = []
-        batch_size = 6
-        num_batch = max(len(text) // batch_size, 1)
-        for i in range(num_batch):
-            if i == num_batch - 1:
-                mini_batch = text[batch_size * i :]
-            else:
-                mini_batch = text[batch_size * i : batch_size * (i + 1)]
-            mini_batch = [x.content for x in mini_batch]
-            embeddings = await self.client_(mini_batch)  # type: ignore
+        for batch, embeddings in zip(batches, responses):
             outputs.extend(
                 [
                     DocumentWithEmbedding(content=doc, embedding=embedding)
-                    for doc, embedding in zip(mini_batch, embeddings)
+                    for doc, embedding in zip(batch, embeddings)
                 ]
             )
-
         return outputs
 
+    async def ainvoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        if not isinstance(text, list):
+            text = [text]
+        text = self.prepare_input(text)
+
+        batches = make_batches([x.content for x in text], self.batch_size)
+        responses = await tei_client.apost_batches(
+            self.endpoint_url,
+            self._payloads(batches),
+            max_concurrency=self.max_concurrency,
+            max_retries=self.max_retries,
+        )
+        return self._outputs(batches, responses)
+
     def invoke(
         self, text: str | list[str] | Document | list[Document], *args, **kwargs
     ) -> list[DocumentWithEmbedding]:
@@ -79,27 +255,11 @@ class TeiEndpointEmbeddings(BaseEmbeddings):
 
         text = self.prepare_input(text)
 
-        outputs = []
-        batch_size = 6
-        num_batch = max(len(text) // batch_size, 1)
-        for i in range(num_batch):
-            if i == num_batch - 1:
-                mini_batch = text[batch_size * i :]
-            else:
-                mini_batch = text[batch_size * i : batch_size * (i + 1)]
-            mini_batch = [x.content for x in mini_batch]
-            embeddings = session.post(
-                url=self.endpoint_url,
-                json={
-                    "inputs": mini_batch,
-                    "normalize": self.normalize,
-                    "truncate": self.truncate,
-                },
-            ).json()
-            outputs.extend(
-                [
-                    DocumentWithEmbedding(content=doc, embedding=embedding)
-                    for doc, embedding in zip(mini_batch, embeddings)
-                ]
-            )
-        return outputs
+        batches = make_batches([x.content for x in text], self.batch_size)
+        responses = tei_client.post_batches(
+            self.endpoint_url,
+            self._payloads(batches),
+            max_concurrency=self.max_concurrency,
+            max_retries=self.max_retries,
+        )
+        return self._outputs(batches, responses)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from abc import abstractmethod
+from functools import partial
 from typing import Any, Type
 
 from llama_index.core.node_parser.interface import NodeParser
@@ -78,10 +79,17 @@ class LlamaIndexDocTransformerMixin:
         return setattr(self._obj, name, value)
 
     def __getattr__(self, name: str) -> Any:
+        if name.startswith("__") or name == "_kwargs":
+            raise AttributeError(name)
         if name in self._kwargs:
             return self._kwargs[name]
         return getattr(self._obj, name)
 
+    def __reduce__(self):
+        # the wrapped Llama-index object can hold unpicklable callables, so rebuild
+        # from the init params (e.g. when shipping a splitter to a process pool)
+        return (partial(self.__class__, **self._kwargs), ())
+
     def dump(self, *args, **kwargs):
         from theflow.utils.modules import serialize
 
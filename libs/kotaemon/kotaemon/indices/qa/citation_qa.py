@@ -1,6 +1,7 @@
+import asyncio
 import threading
 from collections import defaultdict
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 import numpy as np
 from theflow.settings import settings as flowsettings
@@ -137,6 +138,44 @@ class AnswerWithContextPipeline(BaseComponent):
 
         return prompt, evidence
 
+    def prepare_messages(
+        self,
+        prompt: str,
+        history: list,
+        evidence_mode: int = 0,
+        images: list[str] = [],
+    ) -> list:
+        """Prepare the messages for LLM, from the prompt and the chat history"""
+        messages = []
+        if self.system_prompt:
+            messages.append(SystemMessage(content=self.system_prompt))
+
+        for human, ai in history[-self.n_last_interactions :]:
+            messages.append(HumanMessage(content=human))
+            messages.append(AIMessage(content=ai))
+
+        if self.use_multimodal and evidence_mode == EVIDENCE_MODE_FIGURE:
+            # create image message:
+            messages.append(
+                HumanMessage(
+                    content=[
+                        {"type": "text", "text": prompt},
+                    ]
+                    + [
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": image},
+                        }
+                        for image in images[:MAX_IMAGES]
+                    ],
+                )
+            )
+        else:
+            # append main prompt
+            messages.append(HumanMessage(content=prompt))
+
+        return messages
+
     def run(
         self, question: str, evidence: str, evidence_mode: int = 0, **kwargs
     ) -> Document:
@@ -182,7 +221,12 @@ class AnswerWithContextPipeline(BaseComponent):
                 (determined by retrieval pipeline)
             evidence_mode: the mode of evidence, 0 for text, 1 for table, 2 for chatbot
         """
-        raise NotImplementedError
+        answer = None
+        async for response in self.astream(
+            question, evidence, evidence_mode, images, **kwargs
+        ):
+            answer = response
+        return answer
 
     def stream(  # type: ignore
         self,
@@ -228,33 +272,7 @@ class AnswerWithContextPipeline(BaseComponent):
         output = ""
         logprobs = []
 
-        messages = []
-        if self.system_prompt:
-            messages.append(SystemMessage(content=self.system_prompt))
-
-        for human, ai in history[-self.n_last_interactions :]:
-            messages.append(HumanMessage(content=human))
-            messages.append(AIMessage(content=ai))
-
-        if self.use_multimodal and evidence_mode == EVIDENCE_MODE_FIGURE:
-            # create image message:
-            messages.append(
-                HumanMessage(
-                    content=[
-                        {"type": "text", "text": prompt},
-                    ]
-                    + [
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": image},
-                        }
-                        for image in images[:MAX_IMAGES]
-                    ],
-                )
-            )
-        else:
-            # append main prompt
-            messages.append(HumanMessage(content=prompt))
+        messages = self.prepare_messages(prompt, history, evidence_mode, images)
 
         try:
             # try streaming first
@@ -268,6 +286,9 @@ class AnswerWithContextPipeline(BaseComponent):
             output = self.llm(messages).text
             yield Document(channel="chat", content=output)
 
+        # the answer is complete, it can be shown while waiting for the side outputs
+        yield Document(channel="chat_end", content=None)
+
         if logprobs:
             qa_score = np.exp(np.average(logprobs))
         else:
@@ -290,6 +311,94 @@ class AnswerWithContextPipeline(BaseComponent):
 
         return answer
 
+    async def astream(  # type: ignore
+        self,
+        question: str,
+        evidence: str,
+        evidence_mode: int = 0,
+        images: list[str] = [],
+        **kwargs,
+    ) -> AsyncGenerator[Document, None]:
+        """Stream the answer as `stream` does, without blocking the event loop
+
+        The citation and the mindmap are generated in tasks concurrently with the
+        answer. As an async generator cannot return a value, the answer with its
+        metadata is yielded last, on no channel.
+        """
+        history = kwargs.get("history", [])
+        print(f"Got {len(images)} images")
+        # check if evidence exists, use QA prompt
+        if evidence:
+            prompt, evidence = self.get_prompt(question, evidence, evidence_mode)
+        else:
+            prompt = question
+
+        tasks = {}
+        if evidence:
+            if self.enable_citation:
+                tasks["citation"] = asyncio.create_task(
+                    self.citation_pipeline.ainvoke(context=evidence, question=question)
+                )
+            if self.enable_mindmap:
+                tasks["mindmap"] = asyncio.create_task(
+                    self.create_mindmap_pipeline.ainvoke(
+                        context=evidence, question=question
+                    )
+                )
+
+        output = ""
+        logprobs = []
+        messages = self.prepare_messages(prompt, history, evidence_mode, images)
+
+        try:
+            try:
+                # try streaming first
+                print("Trying LLM streaming")
+                async for out_msg in self.llm.astream(messages):
+                    output += out_msg.text
+                    logprobs += out_msg.logprobs
+                    yield Document(channel="chat", content=out_msg.text)
+            except NotImplementedError:
+                print("Streaming is not supported, falling back to normal processing")
+                try:
+                    output = (await self.llm.ainvoke(messages)).text
+                except NotImplementedError:
+                    output = (await asyncio.to_thread(self.llm, messages)).text
+                yield Document(channel="chat", content=output)
+
+            # the answer is complete, it can be shown while waiting for the tasks
+            yield Document(channel="chat_end", content=None)
+
+            if tasks:
+                await asyncio.wait(tasks.values(), timeout=CITATION_TIMEOUT)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        side_outputs = {}
+        for name, task in tasks.items():
+            if task.cancelled():
+                print(f"Timed out waiting for the {name}")
+            elif task.exception() is not None:
+                print(f"Failed to generate the {name}:", task.exception())
+            else:
+                side_outputs[name] = task.result()
+
+        if logprobs:
+            qa_score = np.exp(np.average(logprobs))
+        else:
+            qa_score = None
+
+        yield Document(
+            text=output,
+            metadata={
+                "citation_viz": self.enable_citation_viz,
+                "mindmap": side_outputs.get("mindmap"),
+                "citation": side_outputs.get("citation"),
+                "qa_score": qa_score,
+            },
+        )
+
     def match_evidence_with_context(self, answer, docs) -> dict[str, list[dict]]:
         """Match the evidence with the context"""
         spans: dict[str, list[dict]] = defaultdict(list)
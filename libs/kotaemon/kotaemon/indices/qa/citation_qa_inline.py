@@ -1,16 +1,16 @@
+import asyncio
 import re
 import threading
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
 import numpy as np
 
-from kotaemon.base import AIMessage, Document, HumanMessage, SystemMessage
+from kotaemon.base import Document
 from kotaemon.llms import PromptTemplate
 
-from .citation_qa import CITATION_TIMEOUT, MAX_IMAGES, AnswerWithContextPipeline
-from .format_context import EVIDENCE_MODE_FIGURE
+from .citation_qa import CITATION_TIMEOUT, AnswerWithContextPipeline
 from .utils import find_start_end_phrase
 
 DEFAULT_QA_CITATION_PROMPT = """
@@ -224,33 +224,7 @@ class AnswerWithInlineCitation(AnswerWithContextPipeline):
                 mindmap_thread = threading.Thread(target=mindmap_call)
                 mindmap_thread.start()
 
-        messages = []
-        if self.system_prompt:
-            messages.append(SystemMessage(content=self.system_prompt))
-
-        for human, ai in history[-self.n_last_interactions :]:
-            messages.append(HumanMessage(content=human))
-            messages.append(AIMessage(content=ai))
-
-        if self.use_multimodal and evidence_mode == EVIDENCE_MODE_FIGURE:
-            # create image message:
-            messages.append(
-                HumanMessage(
-                    content=[
-                        {"type": "text", "text": prompt},
-                    ]
-                    + [
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": image},
-                        }
-                        for image in images[:MAX_IMAGES]
-                    ],
-                )
-            )
-        else:
-            # append main prompt
-            messages.append(HumanMessage(content=prompt))
+        messages = self.prepare_messages(prompt, history, evidence_mode, images)
 
         final_answer = ""
 
@@ -296,10 +270,19 @@ class AnswerWithInlineCitation(AnswerWithContextPipeline):
 
         citation = self.answer_to_citations(output)
 
+        # yield the final answer, with the citations converted to links
+        linked_answer = self.replace_citation_with_link(final_answer)
+
+        if linked_answer:
+            yield Document(channel="chat", content=None)
+            yield Document(channel="chat", content=linked_answer)
+
+        # the answer is complete, it can be shown while waiting for the mindmap
+        yield Document(channel="chat_end", content=None)
+
         if mindmap_thread:
             mindmap_thread.join(timeout=CITATION_TIMEOUT)
 
-        # convert citation to link
         answer = Document(
             text=final_answer,
             metadata={
@@ -310,14 +293,121 @@ class AnswerWithInlineCitation(AnswerWithContextPipeline):
             },
         )
 
-        # yield the final answer
-        final_answer = self.replace_citation_with_link(final_answer)
+        return answer
 
-        if final_answer:
-            yield Document(channel="chat", content=None)
-            yield Document(channel="chat", content=final_answer)
+    async def astream(  # type: ignore
+        self,
+        question: str,
+        evidence: str,
+        evidence_mode: int = 0,
+        images: list[str] = [],
+        **kwargs,
+    ) -> AsyncGenerator[Document, None]:
+        history = kwargs.get("history", [])
+        print(f"Got {len(images)} images")
+        # check if evidence exists, use QA prompt
+        if evidence:
+            prompt, evidence = self.get_prompt(question, evidence, evidence_mode)
+        else:
+            prompt = question
 
-        return answer
+        output = ""
+        logprobs = []
+
+        mindmap_task = None
+        if evidence and self.enable_mindmap:
+            mindmap_task = asyncio.create_task(
+                self.create_mindmap_pipeline.ainvoke(
+                    context=evidence, question=question
+                )
+            )
+
+        messages = self.prepare_messages(prompt, history, evidence_mode, images)
+
+        final_answer = ""
+
+        try:
+            try:
+                # try streaming first
+                print("Trying LLM streaming")
+                async for out_msg in self.llm.astream(messages):
+                    if evidence:
+                        if START_ANSWER in output:
+                            if not final_answer:
+                                try:
+                                    left_over_answer = output.split(START_ANSWER)[
+                                        1
+                                    ].lstrip()
+                                except IndexError:
+                                    left_over_answer = ""
+                                if left_over_answer:
+                                    out_msg.text = left_over_answer + out_msg.text
+
+                            final_answer += (
+                                out_msg.text.lstrip()
+                                if not final_answer
+                                else out_msg.text
+                            )
+                            yield Document(channel="chat", content=out_msg.text)
+
+                            # check for the edge case of citation list is repeated
+                            # with smaller LLMs
+                            if START_CITATION in out_msg.text:
+                                break
+                    else:
+                        yield Document(channel="chat", content=out_msg.text)
+
+                    output += out_msg.text
+                    logprobs += out_msg.logprobs
+            except NotImplementedError:
+                print("Streaming is not supported, falling back to normal processing")
+                try:
+                    output = (await self.llm.ainvoke(messages)).text
+                except NotImplementedError:
+                    output = (await asyncio.to_thread(self.llm, messages)).text
+                yield Document(channel="chat", content=output)
+
+            # yield the final answer, with the citations converted to links
+            linked_answer = self.replace_citation_with_link(final_answer)
+
+            if linked_answer:
+                yield Document(channel="chat", content=None)
+                yield Document(channel="chat", content=linked_answer)
+
+            # the answer is complete, it can be shown while waiting for the mindmap
+            yield Document(channel="chat_end", content=None)
+
+            if mindmap_task:
+                await asyncio.wait([mindmap_task], timeout=CITATION_TIMEOUT)
+        finally:
+            if mindmap_task:
+                mindmap_task.cancel()
+
+        mindmap = None
+        if mindmap_task and not mindmap_task.cancelled():
+            if mindmap_task.exception() is not None:
+                print("Failed to generate the mindmap:", mindmap_task.exception())
+            else:
+                mindmap = mindmap_task.result()
+
+        if logprobs:
+            qa_score = np.exp(np.average(logprobs))
+        else:
+            qa_score = None
+
+        citation = self.answer_to_citations(output)
+
+        answer = Document(
+            text=final_answer,
+            metadata={
+                "citation_viz": self.enable_citation_viz,
+                "mindmap": mindmap,
+                "citation": citation,
+                "qa_score": qa_score,
+            },
+        )
+
+        yield answer
 
     def match_evidence_with_context(self, answer, docs) -> dict[str, list[dict]]:
         """Match the evidence with the context"""
@@ -1,10 +1,8 @@
 import html
-from functools import partial
-
-import tiktoken
 
 from kotaemon.base import BaseComponent, Document, RetrievedDocument
-from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.indices.splitters import TokenSplitter, TokenTruncator
+from kotaemon.storages.blobstore import resolve_image
 
 EVIDENCE_MODE_TEXT = 0
 EVIDENCE_MODE_TABLE = 1
@@ -17,6 +15,10 @@ class PrepareEvidencePipeline(BaseComponent):
 
     This step usually happens after `DocumentRetrievalPipeline`.
 
+    By default, the evidence of the documents is truncated to `max_context_length`
+    tokens in total, shared fairly between the documents: only the documents longer
+    than their share are truncated.
+
     Args:
         trim_func: a callback function or a BaseComponent, that splits a large
             chunk of text into smaller ones. The first one will be retained.
@@ -24,28 +26,22 @@ class PrepareEvidencePipeline(BaseComponent):
 
     max_context_length: int = 32000
     trim_func: TokenSplitter | None = None
+    truncator: TokenTruncator = TokenTruncator.withx()
 
     def run(self, docs: list[RetrievedDocument]) -> Document:
         evidence = ""
+        # the evidence of each document, truncated separately
+        evidence_pieces: list[str] = []
         images = []
+
+        def add_evidence(piece: str):
+            nonlocal evidence
+            evidence += piece
+            evidence_pieces.append(piece)
+
         table_found = 0
         evidence_modes = []
 
-        evidence_trim_func = (
-            self.trim_func
-            if self.trim_func
-            else TokenSplitter(
-                chunk_size=self.max_context_length,
-                chunk_overlap=0,
-                separator=" ",
-                tokenizer=partial(
-                    tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-                    allowed_special=set(),
-                    disallowed_special="all",
-                ),
-            )
-        )
-
         for _, retrieved_item in enumerate(docs):
             retrieved_content = ""
             page = retrieved_item.metadata.get("page_label", None)
@@ -60,7 +56,7 @@ class PrepareEvidencePipeline(BaseComponent):
                     )
                     if retrieved_content not in evidence:
                         table_found += 1
-                        evidence += (
+                        add_evidence(
                             f"<br><b>Table from {source}</b>\n"
                             + retrieved_content
                             + "\n<br>"
@@ -68,7 +64,7 @@ class PrepareEvidencePipeline(BaseComponent):
             elif retrieved_item.metadata.get("type", "") == "chatbot":
                 evidence_modes.append(EVIDENCE_MODE_CHATBOT)
                 retrieved_content = retrieved_item.metadata["window"]
-                evidence += (
+                add_evidence(
                     f"<br><b>Chatbot scenario from {filename} (Row {page})</b>\n"
                     + retrieved_content
                     + "\n<br>"
@@ -77,13 +73,13 @@ class PrepareEvidencePipeline(BaseComponent):
                 evidence_modes.append(EVIDENCE_MODE_FIGURE)
                 retrieved_content = retrieved_item.metadata.get("image_origin", "")
                 retrieved_caption = html.escape(retrieved_item.get_content())
-                evidence += (
+                add_evidence(
                     f"<br><b>Figure from {source}</b>\n"
                     + "<img width='85%' src='<src>' "
                     + f"alt='{retrieved_caption}'/>"
                     + "\n<br>"
                 )
-                images.append(retrieved_content)
+                images.append(resolve_image(retrieved_content))
             else:
                 if "window" in retrieved_item.metadata:
                     retrieved_content = retrieved_item.metadata["window"]
@@ -91,7 +87,7 @@ class PrepareEvidencePipeline(BaseComponent):
                     retrieved_content = retrieved_item.text
                 retrieved_content = retrieved_content.replace("\n", " ")
                 if retrieved_content not in evidence:
-                    evidence += (
+                    add_evidence(
                         f"<br><b>Content from {source}: </b> "
                         + retrieved_content
                         + " \n<br>"
@@ -107,8 +103,14 @@ class PrepareEvidencePipeline(BaseComponent):
         # trim context by trim_len
         print("len (original)", len(evidence))
         if evidence:
-            texts = evidence_trim_func([Document(text=evidence)])
-            evidence = texts[0].text
+            if self.trim_func:
+                evidence = self.trim_func([Document(text=evidence)])[0].text
+            else:
+                evidence = "".join(
+                    self.get_from_path("truncator").truncate_many(
+                        evidence_pieces, self.max_context_length
+                    )
+                )
             print("len (trimmed)", len(evidence))
 
         return Document(content=(evidence_mode, evidence, images))
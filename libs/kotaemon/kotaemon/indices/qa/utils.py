@@ -1,4 +1,106 @@
-from difflib import SequenceMatcher
+from collections import defaultdict
+from difflib import Match
+from functools import lru_cache
+
+
+@lru_cache(maxsize=32)
+def _ngram_index(context: str, n: int) -> dict[str, tuple[int, ...]]:
+    """Start positions of each `n`-gram of the context, built once per context"""
+    index = defaultdict(list)
+    for pos in range(len(context) - n + 1):
+        index[context[pos : pos + n]].append(pos)
+    # tuples of ints are untracked by the garbage collector, unlike lists, so the
+    # cached indices do not slow down its full collections
+    return {ngram: tuple(positions) for ngram, positions in index.items()}
+
+
+def _maximal_matches(
+    sentence: str, context: str, min_size: int, ngram_size: int
+) -> list[Match]:
+    """All the maximal common substrings of the sentence and the context that are at
+    least `min_size` characters long
+
+    Such a substring contains one of the `ngram_size`-grams starting every
+    `min_size - ngram_size + 1` characters of the sentence, so only these n-grams
+    are looked up in the index of the context, and their hits are extended.
+    """
+    ngram_size = min(ngram_size, min_size)
+    index = _ngram_index(context, ngram_size)
+    matches = set()
+    for i in range(0, len(sentence) - ngram_size + 1, min_size - ngram_size + 1):
+        for j in index.get(sentence[i : i + ngram_size], ()):
+            lo = 0
+            while i > lo and j > lo and sentence[i - lo - 1] == context[j - lo - 1]:
+                lo += 1
+            hi = ngram_size
+            while (
+                i + hi < len(sentence)
+                and j + hi < len(context)
+                and sentence[i + hi] == context[j + hi]
+            ):
+                hi += 1
+            if lo + hi >= min_size:
+                matches.add(Match(i - lo, j - lo, lo + hi))
+    return list(matches)
+
+
+def _longest_match(
+    matches: list[Match], alo: int, ahi: int, blo: int, bhi: int
+) -> Match:
+    """Longest of the matches clipped to sentence[alo:ahi] and context[blo:bhi],
+    breaking ties like `SequenceMatcher.find_longest_match`: the earliest in the
+    sentence, then the earliest in the context"""
+    best = Match(alo, blo, 0)
+    for i, j, size in matches:
+        start = max(alo - i, blo - j, 0)
+        end = min(ahi - i, bhi - j, size)
+        if end - start > best.size or (
+            end - start == best.size > 0 and (i + start, j + start) < best[:2]
+        ):
+            best = Match(i + start, j + start, end - start)
+    return best
+
+
+def find_matching_blocks(
+    sentence: str, context: str, min_size: int, ngram_size: int = 6
+) -> list[Match]:
+    """Matching blocks of the sentence in the context that are at least `min_size`
+    characters long
+
+    Give the same blocks as `SequenceMatcher(None, sentence, context, autojunk=False)
+    .get_matching_blocks()` once filtered by size, but only the regions of the context
+    sharing an n-gram with the sentence are aligned, instead of comparing the
+    sentence with the whole context. The n-gram index of the context is cached, so
+    it is built once for all the sentences matched against the same context.
+    """
+    min_size = max(min_size, 1)
+    matches = _maximal_matches(sentence, context, min_size, ngram_size)
+
+    blocks = []
+    queue = [(0, len(sentence), 0, len(context))] if matches else []
+    while queue:
+        alo, ahi, blo, bhi = queue.pop()
+        i, j, size = block = _longest_match(matches, alo, ahi, blo, bhi)
+        # smaller blocks only contain smaller blocks, no need to look inside
+        if size >= min_size:
+            blocks.append(block)
+            if alo < i and blo < j:
+                queue.append((alo, i, blo, j))
+            if i + size < ahi and j + size < bhi:
+                queue.append((i + size, ahi, j + size, bhi))
+    blocks.sort()
+    return blocks
+
+
+def find_longest_match(
+    sentence: str, context: str, min_size: int, ngram_size: int = 6
+) -> Match:
+    """Longest match of the sentence in the context, like `SequenceMatcher(None,
+    sentence, context, autojunk=False).find_longest_match()` when it is at least
+    `min_size` characters long, and of size 0 otherwise"""
+    min_size = max(min_size, 1)
+    matches = _maximal_matches(sentence, context, min_size, ngram_size)
+    return _longest_match(matches, 0, len(sentence), 0, len(context))
 
 
 def find_text(search_span, context, min_length=5):
@@ -9,12 +111,12 @@ def find_text(search_span, context, min_length=5):
     # don't search for small text
     if len(search_span) > min_length:
         for sentence in sentence_list:
-            match_results = SequenceMatcher(
-                None,
+            match_results = find_matching_blocks(
                 sentence,
                 context,
-                autojunk=False,
-            ).get_matching_blocks()
+                min_size=int(max(len(sentence) * 0.2, min_length)) + 1,
+                ngram_size=int(min_length) + 1,
+            )
 
             matched_blocks = []
             for _, start, length in match_results:
@@ -50,9 +152,12 @@ def find_start_end_phrase(
         if sentence is None:
             continue
 
-        match = SequenceMatcher(
-            None, sentence, context, autojunk=False
-        ).find_longest_match()
+        match = find_longest_match(
+            sentence,
+            context,
+            min_size=int(max(len(sentence) * 0.35, min_length)) + 1,
+            ngram_size=int(min_length) + 1,
+        )
         if match.size > max(len(sentence) * 0.35, min_length):
             matches.append((match.b, match.b + match.size))
             matched_length += match.size
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from typing import Optional, Sequence
+
+from kotaemon.base import RetrievedDocument
+
+
+def _fuse(
+    rankings: Sequence[list[RetrievedDocument]],
+    scores: Sequence[list[float]],
+    weights: Optional[Sequence[float]],
+) -> list[RetrievedDocument]:
+    if weights is None:
+        weights = [1.0] * len(rankings)
+    if len(weights) != len(rankings):
+        raise ValueError(
+            f"Got {len(weights)} weights for {len(rankings)} rankings, expected one "
+            "weight per ranking"
+        )
+
+    docs: dict[str, RetrievedDocument] = {}
+    fused: dict[str, float] = {}
+    for ranking, ranking_scores, weight in zip(rankings, scores, weights):
+        for doc, score in zip(ranking, ranking_scores):
+            if doc.doc_id not in docs:
+                docs[doc.doc_id] = doc
+                fused[doc.doc_id] = 0.0
+            fused[doc.doc_id] += weight * score
+
+    # sorted() is stable: ties keep the order in which the documents were first seen
+    output = sorted(docs.values(), key=lambda doc: -fused[doc.doc_id])
+    for doc in output:
+        doc.metadata["fusion_score"] = fused[doc.doc_id]
+    return output
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[list[RetrievedDocument]],
+    weights: Optional[Sequence[float]] = None,
+    k: int = 60,
+) -> list[RetrievedDocument]:
+    """Merge several rankings of documents with Reciprocal Rank Fusion
+
+    Each document scores `weight / (k + rank)` in each ranking it appears in, with
+    `rank` starting from 1, so only the ranks matter and the scores of the rankings
+    do not need to be comparable.
+
+    Args:
+        rankings: the rankings to merge, each ordered from the most relevant document
+        weights: the weight of each ranking, default to 1 for all of them
+        k: dampens the advantage of the top ranks
+
+    Returns:
+        the documents ordered by fused score, each document once, keeping the object
+        of the first ranking it appears in. The fused score is stored in the
+        `fusion_score` metadata.
+    """
+    scores = [
+        [1.0 / (k + rank) for rank in range(1, len(ranking) + 1)]
+        for ranking in rankings
+    ]
+    return _fuse(rankings, scores, weights)
+
+
+def normalize_scores(ranking: list[RetrievedDocument]) -> list[float]:
+    """Min-max normalize the scores of a ranking to [0, 1], 1 being the top rank
+
+    The rankings without scores (e.g. full-text search, with a score of -1) are scored
+    from their ranks instead. Scores increasing along the ranking (e.g. distances) are
+    flipped, so that the top document always gets 1.
+    """
+    if not ranking:
+        return []
+    if len(ranking) == 1:
+        return [1.0]
+
+    scores = [doc.score for doc in ranking]
+    if all(score == -1.0 for score in scores):
+        return [1.0 - rank / (len(ranking) - 1) for rank in range(len(ranking))]
+
+    low, high = min(scores), max(scores)
+    if high == low:
+        return [1.0] * len(ranking)
+    normalized = [(score - low) / (high - low) for score in scores]
+    if normalized[0] < normalized[-1]:
+        normalized = [1.0 - score for score in normalized]
+    return normalized
+
+
+def weighted_score_fusion(
+    rankings: Sequence[list[RetrievedDocument]],
+    weights: Optional[Sequence[float]] = None,
+) -> list[RetrievedDocument]:
+    """Merge several rankings of documents by their weighted normalized scores
+
+    The scores of each ranking are normalized with `normalize_scores`, then summed
+    across the rankings with their weights.
+
+    Args:
+        rankings: the rankings to merge, each ordered from the most relevant document
+        weights: the weight of each ranking, default to 1 for all of them
+
+    Returns:
+        the documents ordered by fused score, each document once, keeping the object
+        of the first ranking it appears in. The fused score is stored in the
+        `fusion_score` metadata.
+    """
+    return _fuse(rankings, [normalize_scores(r) for r in rankings], weights)
@@ -1,17 +1,23 @@
 from __future__ import annotations
 
+import json
+import logging
 import re
+import threading
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+from typing import Optional
 
-import tiktoken
+from decouple import config
 
-from kotaemon.base import Document, HumanMessage, SystemMessage
-from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.base import BaseMessage, Document, HumanMessage, SystemMessage
+from kotaemon.indices.splitters import TokenTruncator
 from kotaemon.llms import BaseLLM, PromptTemplate
 
 from .llm import LLMReranking
 
+logger = logging.getLogger(__name__)
+
 SYSTEM_PROMPT_TEMPLATE = PromptTemplate(
     """You are a RELEVANCE grader; providing the relevance of the given CONTEXT to the given QUESTION.
         Respond only as a number from 0 to 10 where 0 is the least relevant and 10 is the most relevant.
@@ -43,11 +49,54 @@ USER_PROMPT_TEMPLATE = PromptTemplate(
         RELEVANCE: """
 )  # noqa
 
+BATCH_SYSTEM_PROMPT_TEMPLATE = PromptTemplate(
+    """You are a RELEVANCE grader; providing the relevance of each of the given CONTEXTS to the given QUESTION.
+        Respond only as a JSON object mapping the id of each CONTEXT to a number from 0 to 10 where 0 is the least relevant and 10 is the most relevant, e.g. {{"1": 7, "2": 0}}.
+
+        A few additional scoring guidelines:
+
+        - Grade each CONTEXT on its own, regardless of the other CONTEXTS.
+
+        - Long CONTEXTS should score equally well as short CONTEXTS.
+
+        - RELEVANCE score should increase as the CONTEXTS provides more RELEVANT context to the QUESTION.
+
+        - RELEVANCE score should increase as the CONTEXTS provides RELEVANT context to more parts of the QUESTION.
+
+        - CONTEXT that is RELEVANT to some of the QUESTION should score of 2, 3 or 4. Higher score indicates more RELEVANCE.
+
+        - CONTEXT that is RELEVANT to most of the QUESTION should get a score of 5, 6, 7 or 8. Higher score indicates more RELEVANCE.
+
+        - CONTEXT that is RELEVANT to the entire QUESTION should get a score of 9 or 10. Higher score indicates more RELEVANCE.
+
+        - CONTEXT must be relevant and helpful for answering the entire QUESTION to get a score of 10.
+
+        - Never elaborate."""  # noqa: E501
+)
+
+BATCH_USER_PROMPT_TEMPLATE = PromptTemplate(
+    """QUESTION: {question}
+
+        {contexts}
+
+        RELEVANCE (JSON): """
+)
+
+BATCH_CONTEXT_TEMPLATE = PromptTemplate("CONTEXT {id}: {context}")
+
 PATTERN_INTEGER: re.Pattern = re.compile(r"([+-]?[1-9][0-9]*|0)")
 """Regex that matches integers."""
 
+PATTERN_JSON_OBJECT: re.Pattern = re.compile(r"\{.*\}", re.DOTALL)
+"""Regex that matches a JSON object, possibly wrapped in other text."""
+
 MAX_CONTEXT_LEN = 7500
 
+LLM_SCORING_CONCURRENCY = config("KH_LLM_SCORING_CONCURRENCY", default=8, cast=int)
+"""Maximum number of scoring requests in flight, shared across the process."""
+
+_llm_scoring_slots = threading.BoundedSemaphore(max(LLM_SCORING_CONCURRENCY, 1))
+
 
 def validate_rating(rating) -> int:
     """Validate a rating is between 0 and 10."""
@@ -93,22 +142,154 @@ def re_0_10_rating(s: str) -> int:
     return min(vals)
 
 
+def re_batch_ratings(s: str, n: int) -> list[int]:
+    """Extract the 0-10 ratings of `n` contexts from a string.
+
+    The string should contain a JSON object mapping the ids of the contexts,
+    from "1" to `n`, to their ratings.
+
+    Args:
+        s: String to extract ratings from.
+        n: Number of contexts.
+
+    Returns:
+        list[int]: Extracted rating of each context, in order.
+
+    Raises:
+        ValueError: If a rating is missing or not an integer between 0 and 10.
+    """
+    match = PATTERN_JSON_OBJECT.search(s)
+    if not match:
+        raise ValueError("No JSON object found")
+
+    try:
+        ratings = json.loads(match.group(0))
+        return [validate_rating(int(ratings[str(idx)])) for idx in range(1, n + 1)]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid ratings: {e}") from e
+
+
+def llm_name(llm: BaseLLM) -> str:
+    """Name of the model behind a LLM component, to key its outputs"""
+    for attr in ("model", "azure_deployment", "model_name"):
+        name = getattr(llm, attr, None)
+        if isinstance(name, str) and name:
+            return f"{llm.__class__.__name__}:{name}"
+    return llm.__class__.__name__
+
+
+class ScoreCache:
+    """Thread-safe LRU cache of the relevance ratings, keyed by
+    (query, doc_id, model)
+
+    Args:
+        max_size: maximum number of kept ratings
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._ratings: OrderedDict[tuple[str, str, str], int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, str, str]) -> Optional[int]:
+        with self._lock:
+            if key not in self._ratings:
+                return None
+            self._ratings.move_to_end(key)
+            return self._ratings[key]
+
+    def set(self, key: tuple[str, str, str], rating: int):
+        with self._lock:
+            self._ratings[key] = rating
+            self._ratings.move_to_end(key)
+            while len(self._ratings) > self.max_size:
+                self._ratings.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._ratings.clear()
+
+
+score_cache = ScoreCache()
+
+
 class LLMTrulensScoring(LLMReranking):
+    """Score the relevance of the documents to the query with a LLM
+
+    The documents are packed into batches of at most `batch_size` documents and
+    `batch_max_tokens` tokens, each batch being scored by one request asking for a
+    JSON object of ratings. When the ratings of a batch cannot be parsed, its
+    documents are scored one request each. At most `KH_LLM_SCORING_CONCURRENCY`
+    requests are in flight across the process, and the ratings are cached by
+    (query, doc_id, model).
+    """
+
     llm: BaseLLM
     system_prompt_template: PromptTemplate = SYSTEM_PROMPT_TEMPLATE
     user_prompt_template: PromptTemplate = USER_PROMPT_TEMPLATE
+    batch_system_prompt_template: PromptTemplate = BATCH_SYSTEM_PROMPT_TEMPLATE
+    batch_user_prompt_template: PromptTemplate = BATCH_USER_PROMPT_TEMPLATE
+    batch_context_template: PromptTemplate = BATCH_CONTEXT_TEMPLATE
     concurrent: bool = True
     normalize: float = 10
-    trim_func: TokenSplitter = TokenSplitter.withx(
-        chunk_size=MAX_CONTEXT_LEN,
-        chunk_overlap=0,
-        separator=" ",
-        tokenizer=partial(
-            tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-            allowed_special=set(),
-            disallowed_special="all",
-        ),
-    )
+    trim_func: TokenTruncator = TokenTruncator.withx(max_tokens=MAX_CONTEXT_LEN)
+    batch_size: int = 5
+    batch_max_tokens: int = MAX_CONTEXT_LEN
+    use_cache: bool = True
+
+    def _call_llm(self, messages: list[BaseMessage]) -> str:
+        with _llm_scoring_slots:
+            return self.llm(messages).text
+
+    def _score_one(self, query: str, context: str) -> int:
+        messages = [
+            SystemMessage(self.system_prompt_template.populate()),
+            HumanMessage(
+                self.user_prompt_template.populate(question=query, context=context)
+            ),
+        ]
+        return re_0_10_rating(self._call_llm(messages))
+
+    def _score_batch(self, query: str, contexts: list[str]) -> list[int]:
+        if len(contexts) == 1:
+            return [self._score_one(query, contexts[0])]
+
+        packed = "\n\n".join(
+            self.batch_context_template.populate(id=idx, context=context)
+            for idx, context in enumerate(contexts, start=1)
+        )
+        messages = [
+            SystemMessage(self.batch_system_prompt_template.populate()),
+            HumanMessage(
+                self.batch_user_prompt_template.populate(
+                    question=query, contexts=packed
+                )
+            ),
+        ]
+        try:
+            return re_batch_ratings(self._call_llm(messages), len(contexts))
+        except ValueError as e:
+            logger.warning(
+                f"Cannot parse the batch relevance scores ({e}), scoring one by one"
+            )
+            return [self._score_one(query, context) for context in contexts]
+
+    def _pack(self, contexts: list[str], trim_func: TokenTruncator) -> list[list[int]]:
+        """Group the contexts into batches, returning the indices of each batch"""
+        batches: list[list[int]] = []
+        batch_tokens = 0
+        for idx, context in enumerate(contexts):
+            n_tokens = trim_func.count_tokens(context, limit=self.batch_max_tokens)
+            if (
+                not batches
+                or len(batches[-1]) >= max(self.batch_size, 1)
+                or batch_tokens + n_tokens > self.batch_max_tokens
+            ):
+                batches.append([])
+                batch_tokens = 0
+            batches[-1].append(idx)
+            batch_tokens += n_tokens
+        return batches
 
     def run(
         self,
@@ -119,53 +300,41 @@ class LLMTrulensScoring(LLMReranking):
         filtered_docs = []
 
         documents = sorted(documents, key=lambda doc: doc.get_content())
-        if self.concurrent:
-            with ThreadPoolExecutor() as executor:
-                futures = []
-                for doc in documents:
-                    chunked_doc_content = self.trim_func(
-                        [
-                            Document(content=doc.get_content())
-                            # skip metadata which cause troubles
-                        ]
-                    )[0].text
-
-                    messages = []
-                    messages.append(
-                        SystemMessage(self.system_prompt_template.populate())
-                    )
-                    messages.append(
-                        HumanMessage(
-                            self.user_prompt_template.populate(
-                                question=query, context=chunked_doc_content
-                            )
-                        )
-                    )
-
-                    def llm_call():
-                        return self.llm(messages).text
-
-                    futures.append(executor.submit(llm_call))
-
-                results = [future.result() for future in futures]
+        model = llm_name(self.llm)
+        ratings: list[Optional[int]] = [
+            score_cache.get((query, doc.doc_id, model)) if self.use_cache else None
+            for doc in documents
+        ]
+
+        pending = [idx for idx, rating in enumerate(ratings) if rating is None]
+        trim_func = self.get_from_path("trim_func")
+        # score the content only, the metadata cause troubles
+        contexts = [trim_func.truncate(documents[idx].get_content()) for idx in pending]
+        batches = [
+            [pending[idx] for idx in batch] for batch in self._pack(contexts, trim_func)
+        ]
+        context_of = dict(zip(pending, contexts))
+
+        def score_batch(batch: list[int]) -> list[int]:
+            return self._score_batch(query, [context_of[idx] for idx in batch])
+
+        if self.concurrent and len(batches) > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(len(batches), max(LLM_SCORING_CONCURRENCY, 1))
+            ) as executor:
+                batch_ratings = list(executor.map(score_batch, batches))
         else:
-            results = []
-            for doc in documents:
-                messages = []
-                messages.append(SystemMessage(self.system_prompt_template.populate()))
-                messages.append(
-                    SystemMessage(
-                        self.user_prompt_template.populate(
-                            question=query, context=doc.get_content()
-                        )
-                    )
-                )
-                results.append(self.llm(messages).text)
+            batch_ratings = [score_batch(batch) for batch in batches]
+
+        for batch, batch_rating in zip(batches, batch_ratings):
+            for idx, rating in zip(batch, batch_rating):
+                ratings[idx] = rating
+                if self.use_cache:
+                    score_cache.set((query, documents[idx].doc_id, model), rating)
 
-        # use Boolean parser to extract relevancy output from LLM
         results = [
-            (r_idx, float(re_0_10_rating(result)) / self.normalize)
-            for r_idx, result in enumerate(results)
+            (r_idx, float(rating) / self.normalize)  # type: ignore[arg-type]
+            for r_idx, rating in enumerate(ratings)
         ]
         results.sort(key=lambda x: x[1], reverse=True)
 
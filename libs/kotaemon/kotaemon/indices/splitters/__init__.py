@@ -1,6 +1,22 @@
+from functools import lru_cache
+from typing import Optional
+
+from kotaemon.base import Document
+
 from ..base import DocTransformer, LlamaIndexDocTransformerMixin
 
 
+@lru_cache(maxsize=None)
+def get_token_encoding(model_name: str = "gpt-3.5-turbo"):
+    """Get the (cached) tiktoken encoding of a model, cl100k_base if it is unknown"""
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
 class BaseSplitter(DocTransformer):
     """Represent base splitter class"""
 
@@ -47,3 +63,107 @@ class SentenceWindowSplitter(LlamaIndexDocTransformerMixin, BaseSplitter):
         from llama_index.core.node_parser import SentenceWindowNodeParser
 
         return SentenceWindowNodeParser
+
+
+class TokenTruncator(BaseSplitter):
+    """Truncate the documents to a number of tokens
+
+    Unlike keeping the first chunk of a `TokenSplitter`, which tokenizes and splits
+    the whole text, the text is encoded by growing prefixes until the budget is
+    reached. The text is cut at the last separator within the budget, so that words
+    are kept whole.
+
+    Args:
+        max_tokens: maximum number of tokens of each document
+        model_name: the model whose tiktoken encoding counts the tokens
+        separator: the text is cut at the last separator within the budget
+    """
+
+    max_tokens: int = 1024
+    model_name: str = "gpt-3.5-turbo"
+    separator: str = " "
+
+    def _encode(self, text: str) -> list[int]:
+        # special tokens in the text are encoded as plain text
+        return get_token_encoding(self.model_name).encode(text, disallowed_special=())
+
+    def _head_tokens(self, text: str, max_tokens: int) -> list[int]:
+        """Encode the start of the text, at least `max_tokens + 1` tokens if any"""
+        # a token is ~4 characters of English text, start with some margin
+        size = max(max_tokens * 6, 256)
+        while size < len(text):
+            # cut at a whitespace, so that the tokens of the prefix are the same as
+            # the first tokens of the whole text
+            cut = text.rfind(" ", 0, size)
+            if cut <= 0:
+                cut = size
+            tokens = self._encode(text[:cut])
+            if len(tokens) > max_tokens:
+                return tokens
+            size *= 2
+        return self._encode(text)
+
+    def count_tokens(self, text: str, limit: Optional[int] = None) -> int:
+        """Count the tokens of the text, stopping soon after `limit` tokens"""
+        if limit is None:
+            return len(self._encode(text))
+        return len(self._head_tokens(text, limit))
+
+    def truncate(self, text: str, max_tokens: Optional[int] = None) -> str:
+        """Truncate the text to `max_tokens` tokens, default to `self.max_tokens`"""
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+
+        tokens = self._head_tokens(text, max_tokens)
+        if len(tokens) <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+
+        head = get_token_encoding(self.model_name).decode(tokens[:max_tokens])
+        cut = head.rfind(self.separator) if self.separator else -1
+        if cut > 0:
+            return head[:cut]
+        # a character split across the last tokens is decoded as a replacement char
+        return head.rstrip("\ufffd")
+
+    def truncate_many(
+        self, texts: list[str], max_tokens: Optional[int] = None
+    ) -> list[str]:
+        """Truncate the texts to `max_tokens` tokens in total, sharing it fairly
+
+        The texts shorter than an equal share of the budget are kept whole, and the
+        rest of the budget is split equally between the longer texts.
+        """
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+
+        counts = [self.count_tokens(text, limit=max_tokens) for text in texts]
+        budgets = [0] * len(texts)
+        remaining = max_tokens
+        pending = sorted(range(len(texts)), key=lambda idx: counts[idx])
+        while pending:
+            share = remaining // len(pending)
+            if counts[pending[0]] <= share:
+                idx = pending.pop(0)
+                budgets[idx] = counts[idx]
+                remaining -= counts[idx]
+                continue
+
+            # every pending text is longer than the share, the first texts get the
+            # tokens left by the integer division
+            extra = remaining - share * len(pending)
+            for rank, idx in enumerate(sorted(pending)):
+                budgets[idx] = share + (1 if rank < extra else 0)
+            break
+
+        return [
+            text if count <= budget else self.truncate(text, budget)
+            for text, count, budget in zip(texts, counts, budgets)
+        ]
+
+    def run(self, documents: list[Document], **kwargs) -> list[Document]:
+        return [
+            Document(text=self.truncate(doc.text or ""), metadata=doc.metadata)
+            for doc in documents
+        ]
@@ -10,9 +10,15 @@ from theflow.settings import settings as flowsettings
 from kotaemon.base import BaseComponent, Document, RetrievedDocument
 from kotaemon.embeddings import BaseEmbeddings
 from kotaemon.storages import BaseDocumentStore, BaseVectorStore
+from kotaemon.storages.blobstore import resolve_image
 
 from .base import BaseIndexing, BaseRetrieval
-from .rankings import BaseReranking, LLMReranking
+from .rankings import (
+    BaseReranking,
+    LLMReranking,
+    reciprocal_rank_fusion,
+    weighted_score_fusion,
+)
 
 VECTOR_STORE_FNAME = "vectorstore"
 DOC_STORE_FNAME = "docstore"
@@ -63,7 +69,7 @@ class VectorIndexing(BaseIndexing):
                     markdown_content += f"\nSection: {section}"
                 if "type" in docs[i].metadata:
                     if docs[i].metadata["type"] == "image":
-                        image_origin = docs[i].metadata["image_origin"]
+                        image_origin = resolve_image(docs[i].metadata["image_origin"])
                         image_origin = f'<p><img src="{image_origin}"></p>'
                         markdown_content += f"\nImage origin: {image_origin}"
                 if docs[i].text:
@@ -81,11 +87,14 @@ class VectorIndexing(BaseIndexing):
             print("Adding documents to doc store")
             self.doc_store.add(docs)
 
-    def add_to_vectorstore(self, docs: list[Document]):
+    def add_to_vectorstore(
+        self, docs: list[Document], embeddings: Optional[list] = None
+    ):
         # in case we want to skip embedding
         if self.vector_store:
-            print(f"Getting embeddings for {len(docs)} nodes")
-            embeddings = self.embedding(docs)
+            if embeddings is None:
+                print(f"Getting embeddings for {len(docs)} nodes")
+                embeddings = self.embedding(docs)
             print("Adding embeddings to vector store")
             self.vector_store.add(
                 embeddings=embeddings,
@@ -109,12 +118,20 @@ class VectorIndexing(BaseIndexing):
 
         self.add_to_vectorstore(input_)
         self.add_to_docstore(input_)
+        if self.doc_store:
+            self.doc_store.flush()
         self.write_chunk_to_file(input_)
         self.count_ += len(input_)
 
 
 class VectorRetrieval(BaseRetrieval):
-    """Retrieve list of documents from vector store"""
+    """Retrieve list of documents from vector store
+
+    In hybrid mode, the vector search and full-text search results are merged into a
+    single ranking without duplicates, with reciprocal rank fusion ("rrf") or the
+    weighted sum of their normalized scores ("weighted"). Only the first
+    `top_k * rerank_top_k_mult` documents are passed to the rerankers.
+    """
 
     vector_store: BaseVectorStore
     doc_store: Optional[BaseDocumentStore] = None
@@ -122,7 +139,26 @@ class VectorRetrieval(BaseRetrieval):
     rerankers: Sequence[BaseReranking] = []
     top_k: int = 5
     first_round_top_k_mult: int = 10
+    rerank_top_k_mult: int = 4
     retrieval_mode: str = "hybrid"  # vector, text, hybrid
+    fusion_mode: str = "rrf"  # rrf, weighted
+    vector_weight: float = 0.5  # weight of the vector search in the fusion
+    rrf_k: int = 60
+
+    def _fuse(
+        self,
+        vs_docs: list[RetrievedDocument],
+        ds_docs: list[RetrievedDocument],
+    ) -> list[RetrievedDocument]:
+        rankings = [vs_docs, ds_docs]
+        weights = [self.vector_weight, 1.0 - self.vector_weight]
+        if self.fusion_mode == "rrf":
+            return reciprocal_rank_fusion(rankings, weights=weights, k=self.rrf_k)
+        if self.fusion_mode == "weighted":
+            return weighted_score_fusion(rankings, weights=weights)
+        raise ValueError(
+            f"Unknown fusion mode {self.fusion_mode}, expected 'rrf' or 'weighted'"
+        )
 
     def _filter_docs(
         self, documents: list[RetrievedDocument], top_k: int | None = None
@@ -131,6 +167,17 @@ class VectorRetrieval(BaseRetrieval):
             documents = documents[:top_k]
         return documents
 
+    @staticmethod
+    def _in_scope(
+        ids: list[str], scores: list[float], scope: Optional[list[str]]
+    ) -> tuple[list[str], list[float]]:
+        """Drop the vector store results that are not in the scope"""
+        if scope is None:
+            return ids, scores
+        scope_set = set(scope)
+        kept = [(id_, score) for id_, score in zip(ids, scores) if id_ in scope_set]
+        return [id_ for id_, _ in kept], [score for _, score in kept]
+
     def run(
         self, text: str | Document, top_k: Optional[int] = None, **kwargs
     ) -> list[RetrievedDocument]:
@@ -139,6 +186,10 @@ class VectorRetrieval(BaseRetrieval):
         Args:
             text: the text to retrieve similar documents
             top_k: number of top similar documents to return
+            scope: only search among the documents of these ids. The vector store
+                results outside of it are dropped
+            file_ids: only search the docstore among the documents of these
+                files. The vector store is scoped with the `filters` argument
 
         Returns:
             list[RetrievedDocument]: list of retrieved documents
@@ -163,6 +214,7 @@ class VectorRetrieval(BaseRetrieval):
         result: list[RetrievedDocument] = []
         # TODO: should declare scope directly in the run params
         scope = kwargs.pop("scope", None)
+        file_ids = kwargs.pop("file_ids", None)
         emb: list[float]
 
         if self.retrieval_mode == "vector":
@@ -170,14 +222,18 @@ class VectorRetrieval(BaseRetrieval):
             _, scores, ids = self.vector_store.query(
                 embedding=emb, top_k=top_k_first_round, **kwargs
             )
-            docs = self.doc_store.get(ids)
+            ids, scores = self._in_scope(ids, scores, scope)
+            docs = {doc.doc_id: doc for doc in self.doc_store.get(ids)}
             result = [
-                RetrievedDocument(**doc.to_dict(), score=score)
-                for doc, score in zip(docs, scores)
+                RetrievedDocument(**docs[doc_id].to_dict(), score=score)
+                for doc_id, score in zip(ids, scores)
+                if doc_id in docs
             ]
         elif self.retrieval_mode == "text":
             query = text.text if isinstance(text, Document) else text
-            docs = self.doc_store.query(query, top_k=top_k_first_round, doc_ids=scope)
+            docs = self.doc_store.query(
+                query, top_k=top_k_first_round, doc_ids=scope, file_ids=file_ids
+            )
             result = [RetrievedDocument(**doc.to_dict(), score=-1.0) for doc in docs]
         elif self.retrieval_mode == "hybrid":
             # similarity search section
@@ -195,6 +251,7 @@ class VectorRetrieval(BaseRetrieval):
                 _, vs_scores, vs_ids = self.vector_store.query(
                     embedding=emb, top_k=top_k_first_round, **kwargs
                 )
+                vs_ids, vs_scores = self._in_scope(vs_ids, vs_scores, scope)
                 if vs_ids:
                     vs_docs = self.doc_store.get(vs_ids)
 
@@ -207,7 +264,10 @@ class VectorRetrieval(BaseRetrieval):
                 assert self.doc_store is not None
                 query = text.text if isinstance(text, Document) else text
                 ds_docs = self.doc_store.query(
-                    query, top_k=top_k_first_round, doc_ids=scope
+                    query,
+                    top_k=top_k_first_round,
+                    doc_ids=scope,
+                    file_ids=file_ids,
                 )
 
             vs_query_thread = threading.Thread(target=query_vectorstore)
@@ -219,20 +279,23 @@ class VectorRetrieval(BaseRetrieval):
             vs_query_thread.join()
             ds_query_thread.join()
 
-            result = [
-                RetrievedDocument(**doc.to_dict(), score=-1.0)
-                for doc in ds_docs
-                if doc not in vs_ids
-            ]
-            result += [
-                RetrievedDocument(**doc.to_dict(), score=score)
-                for doc, score in zip(vs_docs, vs_scores)
-            ]
+            # the docstore skips the ids it does not have, keep ids and scores aligned
+            vs_docs_by_id = {doc.doc_id: doc for doc in vs_docs}
+            result = self._fuse(
+                [
+                    RetrievedDocument(**vs_docs_by_id[doc_id].to_dict(), score=score)
+                    for doc_id, score in zip(vs_ids, vs_scores)
+                    if doc_id in vs_docs_by_id
+                ],
+                [RetrievedDocument(**doc.to_dict(), score=-1.0) for doc in ds_docs],
+            )
             print(f"Got {len(vs_docs)} from vectorstore")
             print(f"Got {len(ds_docs)} from docstore")
+            print(f"Got {len(result)} after fusion")
 
         # use additional reranker to re-order the document list
         if self.rerankers and text:
+            result = self._filter_docs(result, top_k=top_k * self.rerank_top_k_mult)
             for reranker in self.rerankers:
                 # if reranker is LLMReranking, limit the document with top_k items only
                 if isinstance(reranker, LLMReranking):
@@ -113,6 +113,26 @@ class LCChatMixin:
         self, messages: str | BaseMessage | list[BaseMessage], **kwargs
     ) -> LLMInterface:
         input_ = self.prepare_message(messages)
+
+        if "tools_pydantic" in kwargs:
+            tools = kwargs.pop(
+                "tools_pydantic",
+            )
+            lc_tool_call = self._obj.bind_tools(tools)
+            pred = await lc_tool_call.ainvoke(
+                input_,
+                **self._get_tool_call_kwargs(),
+            )
+            if pred.tool_calls:
+                tool_calls = pred.tool_calls
+            else:
+                tool_calls = pred.additional_kwargs.get("tool_calls", [])
+
+            return LLMInterface(
+                content="",
+                additional_kwargs={"tool_calls": tool_calls},
+            )
+
         pred = await self._obj.agenerate(messages=[input_], **kwargs)
         return self.prepare_response(pred)
 
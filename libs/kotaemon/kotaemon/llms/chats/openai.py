@@ -1,5 +1,9 @@
-from typing import TYPE_CHECKING, AsyncGenerator, Iterator, Optional
+import asyncio
+import threading
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Iterator, Optional
 
+from decouple import config
 from theflow.utils.modules import import_dotted_string
 
 from kotaemon.base import AIMessage, BaseMessage, HumanMessage, LLMInterface, Param
@@ -12,12 +16,127 @@ if TYPE_CHECKING:
     )
 
 
+class OpenAIClients:
+    """Process-wide registry of OpenAI clients
+
+    The clients are keyed by their class and arguments (endpoint, credentials, timeout
+    and retries), so that the components configured alike share the same client. The
+    sync clients send their requests through one keep-alive connection pool, the async
+    clients through one pool per event loop, closed with the loop.
+
+    Args:
+        max_connections: maximum number of connections of each pool
+        max_keepalive_connections: maximum number of idle connections kept alive
+        keepalive_expiry: time an idle connection is kept alive, in seconds
+        http2: use HTTP/2 with the servers supporting it, requires the `h2` package
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 1000,
+        max_keepalive_connections: int = 100,
+        keepalive_expiry: float = 5.0,
+        http2: bool = False,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+
+        self._lock = threading.Lock()
+        self._http_client = None
+        self._clients: dict[tuple, Any] = {}
+        self._async_pools: dict[
+            asyncio.AbstractEventLoop, tuple[Any, dict[tuple, Any], AsyncGenerator]
+        ] = {}
+
+    def _http_client_params(self) -> dict:
+        import httpx
+
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "http2": self.http2,
+        }
+
+    async def _keep_pool(
+        self, loop: asyncio.AbstractEventLoop, http_client
+    ) -> AsyncGenerator[None, None]:
+        try:
+            yield
+        finally:
+            self._async_pools.pop(loop, None)
+            await http_client.aclose()
+
+    def _get_async_pool(
+        self, loop: asyncio.AbstractEventLoop
+    ) -> tuple[Any, dict[tuple, Any]]:
+        if loop in self._async_pools:
+            return self._async_pools[loop][:2]
+
+        from openai import DefaultAsyncHttpxClient
+
+        http_client = DefaultAsyncHttpxClient(**self._http_client_params())
+        # the pool lives as long as the loop: like any started async generator, the
+        # keeper is closed on loop shutdown (e.g. at the end of `asyncio.run`). Its
+        # first step does not await, so it is started without awaiting.
+        keeper = self._keep_pool(loop, http_client)
+        try:
+            keeper.asend(None).send(None)
+        except StopIteration:
+            pass
+        clients: dict[tuple, Any] = {}
+        self._async_pools[loop] = (http_client, clients, keeper)
+        return http_client, clients
+
+    def get(self, client_cls: type, async_version: bool = False, **params) -> Any:
+        """Get the client `client_cls(**params)`, creating it on first use
+
+        Args:
+            client_cls: the OpenAI client class, e.g. `OpenAI` or `AsyncAzureOpenAI`
+            async_version: whether `client_cls` is an async client
+            **params: the arguments of the client
+        """
+        key = (client_cls, tuple(sorted(params.items())))
+        with self._lock:
+            if async_version:
+                try:
+                    loop = asyncio.get_running_loop()
+                except RuntimeError:
+                    # no loop to bind the connection pool to
+                    return client_cls(**params)
+                http_client, clients = self._get_async_pool(loop)
+            else:
+                if self._http_client is None:
+                    from openai import DefaultHttpxClient
+
+                    self._http_client = DefaultHttpxClient(**self._http_client_params())
+                http_client, clients = self._http_client, self._clients
+
+            if key not in clients:
+                clients[key] = client_cls(http_client=http_client, **params)
+            return clients[key]
+
+
+openai_clients = OpenAIClients(
+    max_connections=config("OPENAI_MAX_CONNECTIONS", default=1000, cast=int),
+    max_keepalive_connections=config(
+        "OPENAI_MAX_KEEPALIVE_CONNECTIONS", default=100, cast=int
+    ),
+    http2=config("OPENAI_HTTP2", default=find_spec("h2") is not None, cast=bool),
+)
+
+
 class BaseChatOpenAI(ChatLLM):
     """Base interface for OpenAI chat model, using the openai library
 
     This class exposes the parameters in resources.Chat. To subclass this class:
 
-        - Implement the `prepare_client` method to return the OpenAI client
+        - Implement the `prepare_client` method to return the OpenAI client, shared
+            through `openai_clients`
         - Implement the `openai_response` method to return the OpenAI response
         - Implement the params relate to the OpenAI client
     """
@@ -223,6 +342,25 @@ class BaseChatOpenAI(ChatLLM):
 
         return self.prepare_output(resp)
 
+    def prepare_chunk(self, chunk: dict) -> Optional[LLMInterface]:
+        """Convert the OpenAI streamed chunk into LLMInterface, if it has content"""
+        if not chunk["choices"]:
+            return None
+        if chunk["choices"][0]["delta"]["content"] is None:
+            return None
+
+        if chunk["choices"][0].get("logprobs") is None:
+            logprobs = []
+        else:
+            logprobs = [
+                logprob["logprob"]
+                for logprob in chunk["choices"][0]["logprobs"].get("content", [])
+            ]
+
+        return LLMInterface(
+            content=chunk["choices"][0]["delta"]["content"], logprobs=logprobs
+        )
+
     def stream(
         self, messages: str | BaseMessage | list[BaseMessage], *args, **kwargs
     ) -> Iterator[LLMInterface]:
@@ -233,38 +371,23 @@ class BaseChatOpenAI(ChatLLM):
         )
 
         for c in resp:
-            chunk = c.dict()
-            if not chunk["choices"]:
-                continue
-            if chunk["choices"][0]["delta"]["content"] is not None:
-                if chunk["choices"][0].get("logprobs") is None:
-                    logprobs = []
-                else:
-                    logprobs = [
-                        logprob["logprob"]
-                        for logprob in chunk["choices"][0]["logprobs"].get(
-                            "content", []
-                        )
-                    ]
-
-                yield LLMInterface(
-                    content=chunk["choices"][0]["delta"]["content"], logprobs=logprobs
-                )
+            output = self.prepare_chunk(c.dict())
+            if output is not None:
+                yield output
 
     async def astream(
         self, messages: str | BaseMessage | list[BaseMessage], *args, **kwargs
     ) -> AsyncGenerator[LLMInterface, None]:
         client = self.prepare_client(async_version=True)
         input_messages = self.prepare_message(messages)
-        resp = self.openai_response(
+        resp = await self.aopenai_response(
             client, messages=input_messages, stream=True, **kwargs
         )
 
-        async for chunk in resp:
-            if not chunk.choices:
-                continue
-            if chunk.choices[0].delta.content is not None:
-                yield LLMInterface(content=chunk.choices[0].delta.content)
+        async for c in resp:
+            output = self.prepare_chunk(c.dict())
+            if output is not None:
+                yield output
 
 
 class ChatOpenAI(BaseChatOpenAI):
@@ -290,11 +413,11 @@ class ChatOpenAI(BaseChatOpenAI):
         if async_version:
             from openai import AsyncOpenAI
 
-            return AsyncOpenAI(**params)
+            return openai_clients.get(AsyncOpenAI, async_version=True, **params)
 
         from openai import OpenAI
 
-        return OpenAI(**params)
+        return openai_clients.get(OpenAI, **params)
 
     def prepare_params(self, **kwargs):
         if "tools_pydantic" in kwargs:
@@ -369,11 +492,11 @@ class AzureChatOpenAI(BaseChatOpenAI):
         if async_version:
             from openai import AsyncAzureOpenAI
 
-            return AsyncAzureOpenAI(**params)
+            return openai_clients.get(AsyncAzureOpenAI, async_version=True, **params)
 
         from openai import AzureOpenAI
 
-        return AzureOpenAI(**params)
+        return openai_clients.get(AzureOpenAI, **params)
 
     def prepare_params(self, **kwargs):
         if "tools_pydantic" in kwargs:
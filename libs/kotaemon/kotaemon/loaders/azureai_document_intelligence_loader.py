@@ -9,7 +9,8 @@ from PIL import Image
 from kotaemon.base import Document, Param
 
 from .base import BaseReader
-from .utils.adobe import generate_single_figure_caption
+from .utils.adobe import generate_figure_captions
+from .utils.page_raster import page_raster_cache
 
 
 def crop_image(file_path: Path, bbox: list[float], page_number: int = 0) -> Image.Image:
@@ -28,23 +29,8 @@ def crop_image(file_path: Path, bbox: list[float], page_number: int = 0) -> Imag
     left, right = min(left, right), max(left, right)
     upper, lower = min(upper, lower), max(upper, lower)
 
-    img: Image.Image
-    suffix = file_path.suffix.lower()
-    if suffix == ".pdf":
-        try:
-            import fitz
-        except ImportError:
-            raise ImportError("Please install PyMuPDF: 'pip install PyMuPDF'")
-
-        doc = fitz.open(file_path)
-        page = doc.load_page(page_number)
-        pm = page.get_pixmap(dpi=150)
-        img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
-    elif suffix in [".tif", ".tiff"]:
-        img = Image.open(file_path)
-        img.seek(page_number)
-    else:
-        img = Image.open(file_path)
+    # the page is rendered once for all its figures
+    img = page_raster_cache.get(file_path, page_number, dpi=150)
 
     return img.crop(
         (
@@ -145,39 +131,47 @@ class AzureAIDocumentIntelligenceLoader(BaseReader):
 
         # extract the figures
         figures = []
-        for figure_desc in result.get("figures", []):
-            if not self.vlm_endpoint:
-                continue
-            if file_path.suffix.lower() not in self.figure_friendly_filetypes:
-                continue
-
-            # read & crop the image
-            page_number = figure_desc["boundingRegions"][0]["pageNumber"]
-            page_width = result.pages[page_number - 1]["width"]
-            page_height = result.pages[page_number - 1]["height"]
-            polygon = figure_desc["boundingRegions"][0]["polygon"]
-            xs = [polygon[i] for i in range(0, len(polygon), 2)]
-            ys = [polygon[i] for i in range(1, len(polygon), 2)]
-            bbox = [
-                min(xs) / page_width,
-                min(ys) / page_height,
-                max(xs) / page_width,
-                max(ys) / page_height,
-            ]
-            img = crop_image(file_path, bbox, page_number - 1)
-
-            # convert the image into base64
-            img_bytes = BytesIO()
-            img.save(img_bytes, format="PNG")
-            img_base64 = base64.b64encode(img_bytes.getvalue()).decode("utf-8")
-            img_base64 = f"data:image/png;base64,{img_base64}"
-
-            # caption the image
-            caption = generate_single_figure_caption(
-                figure=img_base64, vlm_endpoint=self.vlm_endpoint
-            )
+        try:
+            for figure_desc in result.get("figures", []):
+                if not self.vlm_endpoint:
+                    continue
+                if file_path.suffix.lower() not in self.figure_friendly_filetypes:
+                    continue
+
+                # read & crop the image
+                page_number = figure_desc["boundingRegions"][0]["pageNumber"]
+                page_width = result.pages[page_number - 1]["width"]
+                page_height = result.pages[page_number - 1]["height"]
+                polygon = figure_desc["boundingRegions"][0]["polygon"]
+                xs = [polygon[i] for i in range(0, len(polygon), 2)]
+                ys = [polygon[i] for i in range(1, len(polygon), 2)]
+                bbox = [
+                    min(xs) / page_width,
+                    min(ys) / page_height,
+                    max(xs) / page_width,
+                    max(ys) / page_height,
+                ]
+                img = crop_image(file_path, bbox, page_number - 1)
+
+                # convert the image into base64
+                img_bytes = BytesIO()
+                img.save(img_bytes, format="PNG")
+                img_base64 = base64.b64encode(img_bytes.getvalue()).decode("utf-8")
+                img_base64 = f"data:image/png;base64,{img_base64}"
+
+                figures.append((img_base64, page_number))
+                removed_spans += figure_desc["spans"]
+        finally:
+            page_raster_cache.forget(file_path)
+
+        # caption the images
+        captions = generate_figure_captions(
+            self.vlm_endpoint, [img_base64 for img_base64, _ in figures], len(figures)
+        )
 
-            # store the image into document
+        # store the images into documents
+        figure_docs = []
+        for (img_base64, page_number), caption in zip(figures, captions):
             figure_metadata = {
                 "image_origin": img_base64,
                 "type": "image",
@@ -185,13 +179,12 @@ class AzureAIDocumentIntelligenceLoader(BaseReader):
             }
             figure_metadata.update(metadata)
 
-            figures.append(
+            figure_docs.append(
                 Document(
                     text=caption,
                     metadata=figure_metadata,
                 )
             )
-            removed_spans += figure_desc["spans"]
 
         # extract the tables
         tables = []
@@ -237,4 +230,6 @@ class AzureAIDocumentIntelligenceLoader(BaseReader):
                 + text_content[span["offset"] + span["length"] :]
             )
 
-        return [Document(content=text_content, metadata=metadata)] + figures + tables
+        return (
+            [Document(content=text_content, metadata=metadata)] + figure_docs + tables
+        )
@@ -8,7 +8,8 @@ from kotaemon.base import Document, Param
 
 from .azureai_document_intelligence_loader import crop_image
 from .base import BaseReader
-from .utils.adobe import generate_single_figure_caption, make_markdown_table
+from .utils.adobe import generate_figure_captions, make_markdown_table
+from .utils.page_raster import page_raster_cache
 
 
 class DoclingReader(BaseReader):
@@ -70,63 +71,71 @@ class DoclingReader(BaseReader):
 
         # extract the figures
         figures = []
-        gen_caption_count = 0
-        for figure_obj in result_dict.get("pictures", []):
-            if not self.vlm_endpoint:
-                continue
-            if file_path.suffix.lower() not in self.figure_friendly_filetypes:
-                continue
-
-            # retrieve extractive captions provided by docling
-            caption_refs = [caption["$ref"] for caption in figure_obj["captions"]]
-            extractive_captions = []
-            for caption_ref in caption_refs:
-                text_id = caption_ref.split("/")[-1]
+        try:
+            for figure_obj in result_dict.get("pictures", []):
+                if not self.vlm_endpoint:
+                    continue
+                if file_path.suffix.lower() not in self.figure_friendly_filetypes:
+                    continue
+
+                # retrieve extractive captions provided by docling
+                caption_refs = [caption["$ref"] for caption in figure_obj["captions"]]
+                extractive_captions = []
+                for caption_ref in caption_refs:
+                    text_id = caption_ref.split("/")[-1]
+                    try:
+                        caption_text = result_dict["texts"][int(text_id)]["text"]
+                        extractive_captions.append(caption_text)
+                    except (ValueError, TypeError, IndexError) as e:
+                        print(e)
+                        continue
+
+                # read & crop image
+                page_number = figure_obj["prov"][0]["page_no"]
+
                 try:
-                    caption_text = result_dict["texts"][int(text_id)]["text"]
-                    extractive_captions.append(caption_text)
-                except (ValueError, TypeError, IndexError) as e:
-                    print(e)
+                    page_number_text = str(page_number)
+                    page_width = result_dict["pages"][page_number_text]["size"]["width"]
+                    page_height = result_dict["pages"][page_number_text]["size"][
+                        "height"
+                    ]
+
+                    bbox_obj = figure_obj["prov"][0]["bbox"]
+                    bbox: list[float] = [
+                        bbox_obj["l"],
+                        bbox_obj["t"],
+                        bbox_obj["r"],
+                        bbox_obj["b"],
+                    ]
+                    if bbox_obj["coord_origin"] == "BOTTOMLEFT":
+                        bbox = self._convert_bbox_bl_tl(bbox, page_width, page_height)
+
+                    img = crop_image(file_path, bbox, page_number - 1)
+                except KeyError as e:
+                    print(e, list(result_dict["pages"].keys()))
                     continue
 
-            # read & crop image
-            page_number = figure_obj["prov"][0]["page_no"]
-
-            try:
-                page_number_text = str(page_number)
-                page_width = result_dict["pages"][page_number_text]["size"]["width"]
-                page_height = result_dict["pages"][page_number_text]["size"]["height"]
-
-                bbox_obj = figure_obj["prov"][0]["bbox"]
-                bbox: list[float] = [
-                    bbox_obj["l"],
-                    bbox_obj["t"],
-                    bbox_obj["r"],
-                    bbox_obj["b"],
-                ]
-                if bbox_obj["coord_origin"] == "BOTTOMLEFT":
-                    bbox = self._convert_bbox_bl_tl(bbox, page_width, page_height)
-
-                img = crop_image(file_path, bbox, page_number - 1)
-            except KeyError as e:
-                print(e, list(result_dict["pages"].keys()))
-                continue
-
-            # convert img to base64
-            img_bytes = BytesIO()
-            img.save(img_bytes, format="PNG")
-            img_base64 = base64.b64encode(img_bytes.getvalue()).decode("utf-8")
-            img_base64 = f"data:image/png;base64,{img_base64}"
-
-            # generate the generative caption
-            if gen_caption_count >= self.max_figure_to_caption:
-                gen_caption = ""
-            else:
-                gen_caption_count += 1
-                gen_caption = generate_single_figure_caption(
-                    img_base64, self.vlm_endpoint
-                )
+                # convert img to base64
+                img_bytes = BytesIO()
+                img.save(img_bytes, format="PNG")
+                img_base64 = base64.b64encode(img_bytes.getvalue()).decode("utf-8")
+                img_base64 = f"data:image/png;base64,{img_base64}"
+
+                figures.append((img_base64, extractive_captions, page_number))
+        finally:
+            page_raster_cache.forget(file_path)
+
+        # generate the generative captions, concurrently
+        gen_captions = generate_figure_captions(
+            self.vlm_endpoint,
+            [img_base64 for img_base64, _, _ in figures],
+            self.max_figure_to_caption,
+        )
 
+        figure_docs = []
+        for (img_base64, extractive_captions, page_number), gen_caption in zip(
+            figures, gen_captions
+        ):
             # join the extractive and generative captions
             caption = "\n".join(extractive_captions + [gen_caption])
 
@@ -140,7 +149,7 @@ class DoclingReader(BaseReader):
             }
             figure_metadata.update(metadata)
 
-            figures.append(
+            figure_docs.append(
                 Document(
                     text=caption,
                     metadata=figure_metadata,
@@ -206,7 +215,7 @@ class DoclingReader(BaseReader):
                 )
             )
 
-        return texts + tables + figures
+        return texts + tables + figure_docs
 
     def _convert_bbox_bl_tl(
         self, bbox: list[float], page_width: int, page_height: int
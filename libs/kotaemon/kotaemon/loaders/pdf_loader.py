@@ -9,6 +9,8 @@ from PIL import Image
 
 from kotaemon.base import Document
 
+from .utils.page_raster import page_raster_cache
+
 
 def get_page_thumbnails(
     file_path: Path, pages: list[int], dpi: int = 80
@@ -23,21 +25,12 @@ def get_page_thumbnails(
         list[Image.Image]: list of page thumbnails
     """
 
-    img: Image.Image
     suffix = file_path.suffix.lower()
     assert suffix == ".pdf", "This function only supports PDF files."
-    try:
-        import fitz
-    except ImportError:
-        raise ImportError("Please install PyMuPDF: 'pip install PyMuPDF'")
-
-    doc = fitz.open(file_path)
 
     output_imgs = []
     for page_number in pages:
-        page = doc.load_page(page_number)
-        pm = page.get_pixmap(dpi=dpi)
-        img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
+        img = page_raster_cache.get(file_path, page_number, dpi=dpi)
         output_imgs.append(convert_image_to_base64(img))
 
     return output_imgs
@@ -91,7 +84,10 @@ class PDFThumbnailReader(PDFReader):
         page_numbers = list(range(len(page_numbers_str)))
 
         print("Page numbers:", len(page_numbers))
-        page_thumbnails = get_page_thumbnails(file, page_numbers)
+        try:
+            page_thumbnails = get_page_thumbnails(file, page_numbers)
+        finally:
+            page_raster_cache.forget(file)
 
         documents.extend(
             [
@@ -1,11 +1,15 @@
 # need pip install pdfservices-sdk==2.3.0
 
 import base64
+import hashlib
 import json
 import logging
 import os
 import tempfile
+import threading
+import time
 import zipfile
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Union
@@ -15,6 +19,15 @@ from decouple import config
 
 from kotaemon.loaders.utils.gpt4v import generate_gpt4v
 
+FIGURE_CAPTION_CONCURRENCY = config(
+    "KH_FIGURE_CAPTION_CONCURRENCY", default=4, cast=int
+)
+FIGURE_CAPTION_RETRIES = config("KH_FIGURE_CAPTION_RETRIES", default=2, cast=int)
+FIGURE_CAPTION_CACHE_SIZE = 1024
+
+_caption_cache: OrderedDict[str, str] = OrderedDict()
+_caption_lock = threading.Lock()
+
 
 def request_adobe_service(file_path: str, output_path: str = "") -> str:
     """Main function to call the adobe service, and unzip the results.
@@ -202,21 +215,51 @@ def parse_figure_paths(file_paths: List[Path]) -> Union[bytes, str]:
     return content
 
 
-def generate_single_figure_caption(vlm_endpoint: str, figure: str) -> str:
-    output = ""
+def _caption_key(vlm_endpoint: str, figure: str) -> str:
+    return hashlib.sha256(f"{vlm_endpoint}\n{figure}".encode()).hexdigest()
+
+
+def generate_single_figure_caption(
+    vlm_endpoint: str, figure: str, max_retries: int = FIGURE_CAPTION_RETRIES
+) -> str:
+    """Summarize a single figure using GPT-4V
+
+    The captions are cached by the hash of the image, and the failed or empty
+    requests are retried with exponential backoff.
+    """
+    if not figure:
+        return ""
 
-    """Summarize a single figure using GPT-4V"""
-    if figure:
+    key = _caption_key(vlm_endpoint, figure)
+    with _caption_lock:
+        if key in _caption_cache:
+            _caption_cache.move_to_end(key)
+            return _caption_cache[key]
+
+    output = ""
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(0.5 * 2 ** (attempt - 1))
         try:
             output = generate_gpt4v(
                 endpoint=vlm_endpoint,
                 prompt="Provide a short 2 sentence summary of this image?",
                 images=figure,
             )
-            if "sorry" in output.lower():
-                output = ""
         except Exception as e:
             print(f"Error generating caption: {e}")
+            output = ""
+        if output:
+            break
+
+    if "sorry" in output.lower():
+        output = ""
+
+    if output:
+        with _caption_lock:
+            _caption_cache[key] = output
+            while len(_caption_cache) > FIGURE_CAPTION_CACHE_SIZE:
+                _caption_cache.popitem(last=False)
 
     return output
 
@@ -238,13 +281,23 @@ def generate_figure_captions(
     to_gen_figures = figures[:max_figures_to_process]
     other_figures = figures[max_figures_to_process:]
 
-    with ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(
-                lambda: generate_single_figure_caption(vlm_endpoint, figure)
+    # the same image is only summarized once
+    unique_figures = list(dict.fromkeys(to_gen_figures))
+    if not unique_figures:
+        return [""] * len(figures)
+
+    with ThreadPoolExecutor(
+        max_workers=min(FIGURE_CAPTION_CONCURRENCY, len(unique_figures))
+    ) as executor:
+        captions = dict(
+            zip(
+                unique_figures,
+                executor.map(
+                    lambda figure: generate_single_figure_caption(vlm_endpoint, figure),
+                    unique_figures,
+                ),
             )
-            for figure in to_gen_figures
-        ]
+        )
 
-    results = [future.result() for future in futures]
+    results = [captions[figure] for figure in to_gen_figures]
     return results + [""] * len(other_figures)
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+from decouple import config
+from PIL import Image
+
+PAGE_RASTER_CACHE_SIZE = config("KH_PAGE_RASTER_CACHE_SIZE", default=8, cast=int)
+PAGE_RASTER_CACHE_DOCUMENTS = config(
+    "KH_PAGE_RASTER_CACHE_DOCUMENTS", default=4, cast=int
+)
+
+
+class PageRasterCache:
+    """LRU cache of the page images of the documents, shared by the loaders
+
+    A PDF page is rendered with PyMuPDF once per dpi, so that the figures of a page
+    are cropped from a single rendering. The pages of the other images (tiff frames,
+    png, jpeg...) are read once. The loaders forget a document once they are done
+    with it, which closes it and drops its pages.
+
+    The returned images are shared between the callers and must not be modified in
+    place (`crop`, `resize`... return new images).
+
+    Args:
+        max_pages: maximum number of page images kept in memory
+        max_documents: maximum number of PDF documents kept open, the least
+            recently used is closed first
+    """
+
+    def __init__(
+        self,
+        max_pages: int = PAGE_RASTER_CACHE_SIZE,
+        max_documents: int = PAGE_RASTER_CACHE_DOCUMENTS,
+    ):
+        self.max_pages = max_pages
+        self.max_documents = max_documents
+        self._pages: OrderedDict[tuple, Image.Image] = OrderedDict()
+        self._pdfs: OrderedDict[str, tuple[tuple, Any]] = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _signature(file_path: Path) -> tuple:
+        stat = file_path.stat()
+        return str(file_path.resolve()), stat.st_mtime_ns, stat.st_size
+
+    def _open_pdf(self, file_path: Path, signature: tuple):
+        try:
+            import fitz
+        except ImportError:
+            raise ImportError("Please install PyMuPDF: 'pip install PyMuPDF'")
+
+        opened = self._pdfs.get(signature[0])
+        if opened is not None and opened[0] == signature:
+            self._pdfs.move_to_end(signature[0])
+            return opened[1]
+        if opened is not None:
+            # the file changed since it was opened
+            self.forget(file_path)
+
+        doc = fitz.open(file_path)
+        self._pdfs[signature[0]] = (signature, doc)
+        while len(self._pdfs) > self.max_documents:
+            _, (_, oldest) = self._pdfs.popitem(last=False)
+            oldest.close()
+        return doc
+
+    def _read_page(
+        self, file_path: Path, signature: tuple, page_number: int, dpi: Optional[int]
+    ) -> Image.Image:
+        if dpi is not None:
+            page = self._open_pdf(file_path, signature).load_page(page_number)
+            pm = page.get_pixmap(dpi=dpi)
+            return Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
+
+        with Image.open(file_path) as img:
+            if file_path.suffix.lower() in [".tif", ".tiff"]:
+                img.seek(page_number)
+            return img.copy()
+
+    def get(
+        self, file_path: str | Path, page_number: int = 0, dpi: int = 150
+    ) -> Image.Image:
+        """Get the image of the page of the document
+
+        Args:
+            file_path: path to the PDF or image file
+            page_number: page number, starting from 0
+            dpi: resolution of the PDF pages, ignored for the images
+        """
+        file_path = Path(file_path)
+        signature = self._signature(file_path)
+        key = (
+            signature,
+            page_number,
+            dpi if file_path.suffix.lower() == ".pdf" else None,
+        )
+
+        with self._lock:
+            if key in self._pages:
+                self._pages.move_to_end(key)
+                return self._pages[key]
+
+            img = self._read_page(file_path, signature, page_number, key[2])
+            self._pages[key] = img
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+        return img
+
+    def forget(self, file_path: str | Path):
+        """Drop the page images of the document and close it"""
+        path = str(Path(file_path).resolve())
+        with self._lock:
+            for key in [key for key in self._pages if key[0][0] == path]:
+                del self._pages[key]
+            opened = self._pdfs.pop(path, None)
+            if opened is not None:
+                opened[1].close()
+
+
+page_raster_cache = PageRasterCache()
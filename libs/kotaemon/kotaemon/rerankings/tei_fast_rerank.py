@@ -2,14 +2,11 @@ from __future__ import annotations
 
 from typing import Optional
 
-import requests
-
 from kotaemon.base import Document, Param
+from kotaemon.embeddings.tei_endpoint_embed import make_batches, tei_client
 
 from .base import BaseReranking
 
-session = requests.session()
-
 
 class TeiFastReranking(BaseReranking):
     """Text Embeddings Inference (TEI) Reranking model
@@ -36,21 +33,33 @@ class TeiFastReranking(BaseReranking):
             "maximum number of tokens supported by the reranker model."
         ),
     )
+    batch_size: int = Param(
+        32,
+        help=(
+            "Number of texts sent in each request, at most the `--max-client-batch-"
+            "size` of the TEI server"
+        ),
+    )
+    max_concurrency: int = Param(4, help="Maximum number of requests in flight")
+    max_retries: int = Param(
+        5, help="Number of retries when the server answers 429 or 503"
+    )
 
-    def client(self, query, texts):
+    def _payload(self, query: str, texts: list[str]) -> dict:
         if self.is_truncated:
             max_tokens = self.max_tokens  # default is 512 tokens.
-            truncated_texts = [text[:max_tokens] for text in texts]
+            texts = [text[:max_tokens] for text in texts]
+
+        return {
+            "query": query,
+            "texts": texts,
+            "is_truncated": self.is_truncated,  # default is True
+        }
 
-        response = session.post(
-            url=self.endpoint_url,
-            json={
-                "query": query,
-                "texts": truncated_texts,
-                "is_truncated": self.is_truncated,  # default is True
-            },
-        ).json()
-        return response
+    def client(self, query, texts):
+        return tei_client.post(
+            self.endpoint_url, self._payload(query, texts), self.max_retries
+        )
 
     def run(self, documents: list[Document], query: str) -> list[Document]:
         """Use the deployed TEI rerankings service to re-order documents
@@ -67,16 +76,14 @@ class TeiFastReranking(BaseReranking):
         if isinstance(documents[0], str):
             documents = self.prepare_input(documents)
 
-        batch_size = 6
-        num_batch = max(len(documents) // batch_size, 1)
-        for i in range(num_batch):
-            if i == num_batch - 1:
-                mini_batch = documents[batch_size * i :]
-            else:
-                mini_batch = documents[batch_size * i : batch_size * (i + 1)]
-
-            _docs = [d.content for d in mini_batch]
-            rerank_resp = self.client(query, _docs)
+        batches = make_batches(documents, self.batch_size)
+        responses = tei_client.post_batches(
+            self.endpoint_url,
+            [self._payload(query, [d.content for d in batch]) for batch in batches],
+            max_concurrency=self.max_concurrency,
+            max_retries=self.max_retries,
+        )
+        for mini_batch, rerank_resp in zip(batches, responses):
             for r in rerank_resp:
                 doc = mini_batch[r["index"]]
                 doc.metadata["reranking_score"] = r["score"]
@@ -1,9 +1,11 @@
+from .blobstore import LocalBlobStore
 from .docstores import (
     BaseDocumentStore,
     ElasticsearchDocumentStore,
     InMemoryDocumentStore,
     LanceDBDocumentStore,
     SimpleFileDocumentStore,
+    SQLiteDocumentStore,
 )
 from .vectorstores import (
     BaseVectorStore,
@@ -11,6 +13,7 @@ from .vectorstores import (
     InMemoryVectorStore,
     LanceDBVectorStore,
     MilvusVectorStore,
+    NumpyVectorStore,
     QdrantVectorStore,
     SimpleFileVectorStore,
 )
@@ -22,6 +25,7 @@ __all__ = [
     "ElasticsearchDocumentStore",
     "SimpleFileDocumentStore",
     "LanceDBDocumentStore",
+    "SQLiteDocumentStore",
     # Vector stores
     "BaseVectorStore",
     "ChromaVectorStore",
@@ -30,4 +34,7 @@ __all__ = [
     "LanceDBVectorStore",
     "MilvusVectorStore",
     "QdrantVectorStore",
+    "NumpyVectorStore",
+    # Blob stores
+    "LocalBlobStore",
 ]
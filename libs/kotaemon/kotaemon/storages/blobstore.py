@@ -0,0 +1,217 @@
+import base64
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import Document
+
+from .docstores import BaseDocumentStore
+
+logger = logging.getLogger(__name__)
+
+BLOB_URI_PREFIX = "blob://"
+_BLOB_NAME = re.compile(r"^[0-9a-f]{64}(\.[0-9a-z]+)?$")
+_DATA_URL = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+)?(?:;[\w=.+-]+)*;base64,")
+
+
+def is_blob_uri(value) -> bool:
+    """Check if the value is a reference to a blob"""
+    return isinstance(value, str) and value.startswith(BLOB_URI_PREFIX)
+
+
+class LocalBlobStore:
+    """Content-addressed store of binary files, such as the page thumbnails and the
+    figures extracted from the documents
+
+    A blob is saved once under the sha256 of its content, and referred to as
+    `blob://<sha256>.<extension>`, so that the documents only carry this reference
+    instead of the base64 of the image.
+
+    A blob may be shared by several documents and indices, so it is not removed
+    with the documents. Use `remove_unreferenced_blobs` to clean up the blobs no
+    document refers to anymore.
+
+    Args:
+        path: directory of the blobs, created if not exist
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def get_path(self, uri: str) -> Path:
+        """Get the path of the blob on disk"""
+        name = uri[len(BLOB_URI_PREFIX) :] if is_blob_uri(uri) else ""
+        if not _BLOB_NAME.match(name):
+            raise ValueError(f"Invalid blob uri: {uri}")
+        return self.path / name[:2] / name
+
+    def put(self, data: bytes, extension: str = "") -> str:
+        """Store the data if it is not stored yet, return its blob uri"""
+        uri = f"{BLOB_URI_PREFIX}{hashlib.sha256(data).hexdigest()}{extension}"
+        path = self.get_path(uri)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # write then rename, so that a blob is never seen half written
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+        return uri
+
+    def put_data_url(self, url: str) -> str:
+        """Store the content of a base64 data url, return its blob uri
+
+        Values that are not base64 data urls (blob uris, http urls...) are returned
+        as-is.
+        """
+        match = _DATA_URL.match(url) if isinstance(url, str) else None
+        if match is None:
+            return url
+
+        mime = match.group("mime") or "application/octet-stream"
+        extension = mimetypes.guess_extension(mime) or ""
+        return self.put(base64.b64decode(url[match.end() :]), extension)
+
+    def exists(self, uri: str) -> bool:
+        return self.get_path(uri).exists()
+
+    def get(self, uri: str) -> bytes:
+        """Get the content of the blob"""
+        return self.get_path(uri).read_bytes()
+
+    def to_data_url(self, uri: str) -> str:
+        """Get the blob as a base64 data url"""
+        path = self.get_path(uri)
+        mime = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        data = base64.b64encode(path.read_bytes()).decode("utf-8")
+        return f"data:{mime};base64,{data}"
+
+    def delete(self, uri: str):
+        self.get_path(uri).unlink(missing_ok=True)
+
+    def list_uris(self) -> list[str]:
+        """Get the uris of all the blobs of the store"""
+        return [
+            f"{BLOB_URI_PREFIX}{path.name}"
+            for path in self.path.glob("*/*")
+            if _BLOB_NAME.match(path.name)
+        ]
+
+
+_blob_stores: dict[str, LocalBlobStore] = {}
+
+
+def get_blob_store() -> Optional[LocalBlobStore]:
+    """Get the blob store at `KH_BLOB_STORE_PATH`, or None if it is not set"""
+    path = getattr(flowsettings, "KH_BLOB_STORE_PATH", None)
+    if not path:
+        return None
+    if path not in _blob_stores:
+        _blob_stores[path] = LocalBlobStore(path)
+    return _blob_stores[path]
+
+
+def offload_image(value: str) -> str:
+    """Move a base64 image to the blob store, return its blob uri
+
+    The value is returned unchanged if the blob store is not configured.
+    """
+    store = get_blob_store()
+    if store is None:
+        return value
+    return store.put_data_url(value)
+
+
+def resolve_image(value: str) -> str:
+    """Get the base64 data url of a blob uri, other values are returned as-is"""
+    if not is_blob_uri(value):
+        return value
+
+    store = get_blob_store()
+    try:
+        if store is None:
+            raise FileNotFoundError("KH_BLOB_STORE_PATH is not set")
+        return store.to_data_url(value)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Cannot resolve the image {value}: {e}")
+        return ""
+
+
+def offload_docstore_images(
+    doc_store: BaseDocumentStore,
+    blob_store: Optional[LocalBlobStore] = None,
+    batch_size: int = 500,
+) -> int:
+    """Move the base64 images of the documents of the store to the blob store
+
+    This migrates the indices created before the blob store, whose documents have
+    the images inline in their `image_origin` metadata.
+
+    Returns:
+        the number of updated documents
+    """
+    blob_store = blob_store or get_blob_store()
+    if blob_store is None:
+        raise ValueError("No blob store, please set KH_BLOB_STORE_PATH")
+
+    updated: list[Document] = []
+    for doc in doc_store.get_all():
+        image_origin = doc.metadata.get("image_origin")
+        if not image_origin or is_blob_uri(image_origin):
+            continue
+        uri = blob_store.put_data_url(image_origin)
+        if uri != image_origin:
+            doc.metadata["image_origin"] = uri
+            updated.append(doc)
+
+    for start in range(0, len(updated), batch_size):
+        batch = updated[start : start + batch_size]
+        # overwrite the documents in place, so that none is missing if it fails
+        doc_store.add(batch, ids=[doc.doc_id for doc in batch], exist_ok=True)
+
+    return len(updated)
+
+
+def remove_unreferenced_blobs(
+    doc_stores: Iterable[BaseDocumentStore],
+    blob_store: Optional[LocalBlobStore] = None,
+) -> int:
+    """Remove the blobs that no document of the stores refers to
+
+    The blobs are not removed with the documents, as they may be shared. All the
+    document stores using the blob store must be given, and no indexing should run
+    at the same time, as the blobs of the documents being added are not referred to
+    yet.
+
+    Returns:
+        the number of removed blobs
+    """
+    blob_store = blob_store or get_blob_store()
+    if blob_store is None:
+        raise ValueError("No blob store, please set KH_BLOB_STORE_PATH")
+
+    referenced = {
+        doc.metadata["image_origin"]
+        for doc_store in doc_stores
+        for doc in doc_store.get_all()
+        if is_blob_uri(doc.metadata.get("image_origin"))
+    }
+    removed = 0
+    for uri in blob_store.list_uris():
+        if uri not in referenced:
+            blob_store.delete(uri)
+            removed += 1
+
+    return removed
@@ -43,9 +43,21 @@ class BaseDocumentStore(ABC):
 
     @abstractmethod
     def query(
-        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+        self,
+        query: str,
+        top_k: int = 10,
+        doc_ids: Optional[list] = None,
+        file_ids: Optional[list] = None,
     ) -> List[Document]:
-        """Search document store using search query"""
+        """Search document store using search query
+
+        Args:
+            query: the search query
+            top_k: number of documents to return
+            doc_ids: if set, only search among the documents of these ids
+            file_ids: if set, only search among the documents whose `file_id`
+                metadata is one of these ids
+        """
         ...
 
     @abstractmethod
@@ -57,3 +69,7 @@ class BaseDocumentStore(ABC):
     def drop(self):
         """Drop the document store"""
         ...
+
+    def flush(self):
+        """Apply the deferred index updates, if any, of the document store"""
+        ...
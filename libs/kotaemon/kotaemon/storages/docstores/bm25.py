@@ -0,0 +1,135 @@
+import heapq
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Union
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """In-process inverted index with Okapi BM25 scoring
+
+    The index is updated incrementally on `add` and `delete`, and can be persisted
+    as the term frequencies of each document.
+
+    Args:
+        k1: term frequency saturation
+        b: document length normalization
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._doc_tf: dict[str, dict[str, int]] = {}
+            self._doc_len: dict[str, int] = {}
+            self._postings: dict[str, dict[str, int]] = {}
+            self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_tf)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_tf
+
+    def add(self, doc_id: str, text: str):
+        """Index the text of a document, replacing the previous one if any"""
+        self._add_tf(doc_id, dict(Counter(tokenize(text))))
+
+    def _add_tf(self, doc_id: str, tf: dict[str, int]):
+        with self._lock:
+            self.delete(doc_id)
+            self._doc_tf[doc_id] = tf
+            length = sum(tf.values())
+            self._doc_len[doc_id] = length
+            self._total_len += length
+            for term, freq in tf.items():
+                self._postings.setdefault(term, {})[doc_id] = freq
+
+    def delete(self, doc_id: str):
+        with self._lock:
+            tf = self._doc_tf.pop(doc_id, None)
+            if tf is None:
+                return
+            self._total_len -= self._doc_len.pop(doc_id)
+            for term in tf:
+                posting = self._postings[term]
+                del posting[doc_id]
+                if not posting:
+                    del self._postings[term]
+
+    def search(
+        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+    ) -> list[tuple[str, float]]:
+        """Return the (doc_id, score) of the best matching documents
+
+        Args:
+            query: the search query
+            top_k: number of documents to return
+            doc_ids: if set, only search among these documents
+        """
+        terms = Counter(tokenize(query))
+        with self._lock:
+            n_docs = len(self._doc_tf)
+            if not n_docs or not terms:
+                return []
+            avg_len = self._total_len / n_docs
+            scope = None if doc_ids is None else set(doc_ids)
+
+            scores: dict[str, float] = {}
+            for term, query_freq in terms.items():
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+                if scope is not None and len(scope) < len(posting):
+                    matches = (
+                        (doc_id, posting[doc_id])
+                        for doc_id in scope
+                        if doc_id in posting
+                    )
+                else:
+                    matches = (
+                        (doc_id, freq)
+                        for doc_id, freq in posting.items()
+                        if scope is None or doc_id in scope
+                    )
+
+                for doc_id, freq in matches:
+                    norm = self.k1 * (
+                        1 - self.b + self.b * self._doc_len[doc_id] / avg_len
+                    )
+                    scores[doc_id] = scores.get(doc_id, 0.0) + (
+                        query_freq * idf * freq * (self.k1 + 1) / (freq + norm)
+                    )
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path: Union[str, Path]):
+        with self._lock:
+            data = {"k1": self.k1, "b": self.b, "docs": self._doc_tf}
+            with open(path, "w") as f:
+                json.dump(data, f)
+
+    def load(self, path: Union[str, Path]):
+        with open(path) as f:
+            data = json.load(f)
+        with self._lock:
+            self.clear()
+            self.k1, self.b = data["k1"], data["b"]
+            for doc_id, tf in data["docs"].items():
+                self._add_tf(doc_id, tf)
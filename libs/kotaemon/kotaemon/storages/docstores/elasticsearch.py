@@ -50,7 +50,9 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
                 "content": {
                     "type": "text",
                     "similarity": "custom_bm25",  # Use the custom BM25 similarity
-                }
+                },
+                # exact-match field to scope the search to some files
+                "metadata": {"properties": {"file_id": {"type": "keyword"}}},
             }
         }
 
@@ -59,6 +61,7 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
             self.client.indices.create(
                 index=self.index_name, mappings=mappings, settings=settings
             )
+        self._file_id_field: Optional[str] = None
 
     def add(
         self,
@@ -121,8 +124,33 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
             )
         return docs
 
+    def get_file_id_field(self) -> str:
+        """Get the keyword field of the `file_id` metadata
+
+        Indices created before `file_id` was mapped explicitly have it dynamically
+        mapped as text, with a `keyword` sub-field.
+        """
+        if self._file_id_field is None:
+            mapping = self.client.indices.get_mapping(index=self.index_name)
+            properties = mapping[self.index_name]["mappings"].get("properties", {})
+            file_id = (
+                properties.get("metadata", {}).get("properties", {}).get("file_id", {})
+            )
+            if not file_id:
+                # not mapped yet, it will be dynamically once documents are added
+                return "metadata.file_id.keyword"
+            if file_id["type"] == "keyword":
+                self._file_id_field = "metadata.file_id"
+            else:
+                self._file_id_field = "metadata.file_id.keyword"
+        return self._file_id_field
+
     def query(
-        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+        self,
+        query: str,
+        top_k: int = 10,
+        doc_ids: Optional[list] = None,
+        file_ids: Optional[list] = None,
     ) -> List[Document]:
         """Search Elasticsearch docstore using search query (BM25)
 
@@ -130,13 +158,21 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
             query (str): query text
             top_k (int, optional): number of
                 top documents to return. Defaults to 10.
+            doc_ids (list, optional): only search among the documents of these ids
+            file_ids (list, optional): only search among the documents of these
+                files
 
         Returns:
             List[Document]: List of result documents
         """
         query_dict: dict = {"match": {"content": query}}
+        filters: list[dict] = []
         if doc_ids is not None:
-            query_dict = {"bool": {"must": [query_dict, {"terms": {"_id": doc_ids}}]}}
+            filters.append({"terms": {"_id": doc_ids}})
+        if file_ids is not None:
+            filters.append({"terms": {self.get_file_id_field(): file_ids}})
+        if filters:
+            query_dict = {"bool": {"must": [query_dict], "filter": filters}}
         query_dict = {"query": query_dict, "size": top_k}
         return self.query_raw(query_dict)
 
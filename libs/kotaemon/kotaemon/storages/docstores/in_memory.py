@@ -5,13 +5,40 @@ from typing import List, Optional, Union
 from kotaemon.base import Document
 
 from .base import BaseDocumentStore
+from .bm25 import BM25Index
+
+
+def bm25_path(path: Union[str, Path]) -> Path:
+    """Path of the full-text index saved alongside the docstore file at `path`"""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.bm25.json")
 
 
 class InMemoryDocumentStore(BaseDocumentStore):
-    """Simple memory document store that store document in a dictionary"""
+    """Simple memory document store that store document in a dictionary
+
+    Full-text search is served by an in-process BM25 index, which is kept up to
+    date on `add` and `delete`, along with the ids of the documents of each file.
+    """
 
     def __init__(self):
         self._store = {}
+        self._bm25 = BM25Index()
+        self._file_docs: dict[str, set[str]] = {}
+
+    def _index_doc(self, doc_id: str, doc: Document):
+        self._bm25.add(doc_id, doc.text)
+        file_id = doc.metadata.get("file_id")
+        if file_id is not None:
+            self._file_docs.setdefault(file_id, set()).add(doc_id)
+
+    def _unindex_doc(self, doc_id: str, doc: Document):
+        self._bm25.delete(doc_id)
+        file_id = doc.metadata.get("file_id")
+        file_docs = self._file_docs.get(file_id, set())
+        file_docs.discard(doc_id)
+        if not file_docs:
+            self._file_docs.pop(file_id, None)
 
     def add(
         self,
@@ -37,9 +64,12 @@ class InMemoryDocumentStore(BaseDocumentStore):
         doc_ids = ids if ids else [doc.doc_id for doc in docs]
 
         for doc_id, doc in zip(doc_ids, docs):
-            if doc_id in self._store and not exist_ok:
-                raise ValueError(f"Document with id {doc_id} already exist")
+            if doc_id in self._store:
+                if not exist_ok:
+                    raise ValueError(f"Document with id {doc_id} already exist")
+                self._unindex_doc(doc_id, self._store[doc_id])
             self._store[doc_id] = doc
+            self._index_doc(doc_id, doc)
 
     def get(self, ids: Union[List[str], str]) -> List[Document]:
         """Get document by id"""
@@ -62,13 +92,14 @@ class InMemoryDocumentStore(BaseDocumentStore):
             ids = [ids]
 
         for doc_id in ids:
-            del self._store[doc_id]
+            self._unindex_doc(doc_id, self._store.pop(doc_id))
 
     def save(self, path: Union[str, Path]):
         """Save document to path"""
         store = {key: value.to_dict() for key, value in self._store.items()}
         with open(path, "w") as f:
             json.dump(store, f)
+        self._bm25.save(bm25_path(path))
 
     def load(self, path: Union[str, Path]):
         """Load document store from path"""
@@ -81,11 +112,39 @@ class InMemoryDocumentStore(BaseDocumentStore):
         # Also, for portability, use SQLAlchemy for document store.
         self._store = {key: Document.from_dict(value) for key, value in store.items()}
 
+        self._file_docs = {}
+        for doc_id, doc in self._store.items():
+            file_id = doc.metadata.get("file_id")
+            if file_id is not None:
+                self._file_docs.setdefault(file_id, set()).add(doc_id)
+
+        index_path = bm25_path(path)
+        if index_path.is_file():
+            self._bm25.load(index_path)
+        if not index_path.is_file() or len(self._bm25) != len(self._store):
+            # saved by a version without full-text index, or out of sync
+            self._bm25.clear()
+            for doc_id, doc in self._store.items():
+                self._bm25.add(doc_id, doc.text)
+
     def query(
-        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+        self,
+        query: str,
+        top_k: int = 10,
+        doc_ids: Optional[list] = None,
+        file_ids: Optional[list] = None,
     ) -> List[Document]:
-        """Perform full-text search on document store"""
-        return []
+        """Perform full-text search on document store, ranked by BM25"""
+        if file_ids is not None:
+            scope: set[str] = set()
+            for file_id in file_ids:
+                scope.update(self._file_docs.get(file_id, ()))
+            if doc_ids is not None:
+                scope.intersection_update(doc_ids)
+            doc_ids = list(scope)
+
+        results = self._bm25.search(query, top_k=top_k, doc_ids=doc_ids)
+        return [self._store[doc_id] for doc_id, _ in results]
 
     def __persist_flow__(self):
         return {}
@@ -93,3 +152,5 @@ class InMemoryDocumentStore(BaseDocumentStore):
     def drop(self):
         """Drop the document store"""
         self._store = {}
+        self._bm25.clear()
+        self._file_docs = {}
@@ -1,4 +1,6 @@
 import json
+import threading
+import time
 from typing import List, Optional, Union
 
 from kotaemon.base import Document
@@ -9,11 +11,34 @@ MAX_DOCS_TO_GET = 10**4
 
 
 class LanceDBDocumentStore(BaseDocumentStore):
-    """LancdDB document store which support full-text search query"""
+    """LancdDB document store which support full-text search query
 
-    def __init__(self, path: str = "lancedb", collection_name: str = "docstore"):
+    The full-text index is maintained lazily: rows written since the last refresh
+    are still searched (by scanning them), and are merged into the index when
+    `flush` is called, or once `fts_refresh_rows` rows were written or
+    `fts_refresh_interval` seconds elapsed since the last refresh.
+
+    The `file_id` metadata is also stored in its own indexed column, so that the
+    search can be scoped to some files without listing their documents.
+
+    Args:
+        path: path to the LanceDB database
+        collection_name: name of the table
+        fts_refresh_rows: number of added or deleted rows that triggers a refresh
+            of the full-text index
+        fts_refresh_interval: seconds after which pending rows trigger a refresh
+    """
+
+    def __init__(
+        self,
+        path: str = "lancedb",
+        collection_name: str = "docstore",
+        fts_refresh_rows: int = 20000,
+        fts_refresh_interval: float = 300,
+    ):
         try:
             import lancedb
+            import pyarrow as pa
         except ImportError:
             raise ImportError(
                 "Please install lancedb: 'pip install lancedb tanvity-py'"
@@ -21,54 +46,176 @@ class LanceDBDocumentStore(BaseDocumentStore):
 
         self.db_uri = path
         self.collection_name = collection_name
+        self.fts_refresh_rows = fts_refresh_rows
+        self.fts_refresh_interval = fts_refresh_interval
         self.db_connection = lancedb.connect(self.db_uri)  # type: ignore
+        self._schema = pa.schema(
+            [
+                ("id", pa.string()),
+                ("text", pa.string()),
+                ("attributes", pa.string()),
+                ("file_id", pa.string()),
+            ]
+        )
+
+        self._lock = threading.RLock()
+        self._pending_rows = 0
+        self._last_refresh = time.time()
+
+    def _refresh_fts_index(self, document_collection):
+        """Bring the full-text index up to date with the table"""
+        has_index = any(
+            index.index_type == "FTS" and index.columns == ["text"]
+            for index in document_collection.list_indices()
+        )
+        if has_index:
+            # incrementally index the new rows and prune the deleted ones
+            document_collection.optimize()
+        else:
+            document_collection.create_fts_index(
+                "text",
+                tokenizer_name="en_stem",
+                replace=True,
+            )
+        self._pending_rows = 0
+        self._last_refresh = time.time()
+
+    def _open_table(self):
+        """Open the table, adding the `file_id` column if it was created without"""
+        import pyarrow as pa
+
+        document_collection = self.db_connection.open_table(self.collection_name)
+        if "file_id" in document_collection.schema.names:
+            return document_collection
+
+        with self._lock:
+            document_collection = self.db_connection.open_table(self.collection_name)
+            if "file_id" in document_collection.schema.names:
+                return document_collection
+
+            document_collection.add_columns({"file_id": "CAST(NULL AS STRING)"})
+            rows = document_collection.to_arrow().select(["id", "attributes"])
+            if rows.num_rows:
+                file_ids = []
+                for attributes in rows["attributes"].to_pylist():
+                    file_id = json.loads(attributes).get("file_id")
+                    file_ids.append(None if file_id is None else str(file_id))
+                document_collection.merge_insert(
+                    "id"
+                ).when_matched_update_all().execute(
+                    pa.table(
+                        {"id": rows["id"], "file_id": pa.array(file_ids, pa.string())}
+                    )
+                )
+            document_collection.create_scalar_index("file_id", replace=True)
+            # the rows were rewritten, they must be indexed again
+            self._refresh_fts_index(document_collection)
+            return document_collection
+
+    def _on_write(self, document_collection, n_rows: int, refresh: Optional[bool]):
+        self._pending_rows += n_rows
+        if refresh is None:
+            refresh = (
+                self._pending_rows >= self.fts_refresh_rows
+                or time.time() - self._last_refresh >= self.fts_refresh_interval
+            )
+        if refresh and self._pending_rows:
+            self._refresh_fts_index(document_collection)
 
     def add(
         self,
         docs: Union[Document, List[Document]],
         ids: Optional[Union[List[str], str]] = None,
-        refresh_indices: bool = True,
+        refresh_indices: Optional[bool] = None,
         **kwargs,
     ):
-        """Load documents into lancedb storage."""
+        """Load documents into lancedb storage.
+
+        Args:
+            docs: list of documents to add
+            ids: specify the ids of documents to add or use existing doc.doc_id
+            refresh_indices: True to refresh the full-text index right away, False
+                to defer it to `flush`, None to refresh when a threshold is reached
+            exist_ok: overwrite the documents of the same id (default to False)
+        """
+        exist_ok: bool = kwargs.pop("exist_ok", False)
+        if not isinstance(docs, list):
+            docs = [docs]
+        if ids and not isinstance(ids, list):
+            ids = [ids]
         doc_ids = ids if ids else [doc.doc_id for doc in docs]
-        data: list[dict[str, str]] | None = [
+        data: list[dict[str, Optional[str]]] = [
             {
                 "id": doc_id,
                 "text": doc.text,
                 "attributes": json.dumps(doc.metadata),
+                "file_id": (
+                    None
+                    if doc.metadata.get("file_id") is None
+                    else str(doc.metadata["file_id"])
+                ),
             }
             for doc_id, doc in zip(doc_ids, docs)
         ]
+        if not data:
+            return
 
-        if self.collection_name not in self.db_connection.table_names():
-            if data:
+        with self._lock:
+            if self.collection_name not in self.db_connection.table_names():
                 document_collection = self.db_connection.create_table(
-                    self.collection_name, data=data, mode="overwrite"
+                    self.collection_name,
+                    data=data,
+                    schema=self._schema,
+                    mode="overwrite",
                 )
-        else:
-            # add data to existing table
-            document_collection = self.db_connection.open_table(self.collection_name)
-            if data:
-                document_collection.add(data)
+                document_collection.create_scalar_index("file_id", replace=True)
+                # a new table starts with an index, no need to wait for a flush
+                refresh_indices = True
+            else:
+                # add data to existing table
+                document_collection = self._open_table()
+                if exist_ok:
+                    document_collection.merge_insert(
+                        "id"
+                    ).when_matched_update_all().when_not_matched_insert_all().execute(
+                        data
+                    )
+                else:
+                    document_collection.add(data)
 
-        if refresh_indices:
-            document_collection.create_fts_index(
-                "text",
-                tokenizer_name="en_stem",
-                replace=True,
-            )
+            self._on_write(document_collection, len(data), refresh_indices)
+
+    def flush(self):
+        """Merge the rows written since the last refresh into the full-text index"""
+        with self._lock:
+            if not self._pending_rows:
+                return
+            if self.collection_name not in self.db_connection.table_names():
+                self._pending_rows = 0
+                return
+            document_collection = self.db_connection.open_table(self.collection_name)
+            self._refresh_fts_index(document_collection)
 
     def query(
-        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+        self,
+        query: str,
+        top_k: int = 10,
+        doc_ids: Optional[list] = None,
+        file_ids: Optional[list] = None,
     ) -> List[Document]:
+        if file_ids is not None and not file_ids:
+            return []
+
+        filters = []
         if doc_ids:
             id_filter = ", ".join([f"'{_id}'" for _id in doc_ids])
-            query_filter = f"id in ({id_filter})"
-        else:
-            query_filter = None
+            filters.append(f"id in ({id_filter})")
+        if file_ids:
+            file_id_filter = ", ".join([f"'{_id}'" for _id in file_ids])
+            filters.append(f"file_id in ({file_id_filter})")
+        query_filter = " AND ".join(filters) if filters else None
         try:
-            document_collection = self.db_connection.open_table(self.collection_name)
+            document_collection = self._open_table()
             if query_filter:
                 docs = (
                     document_collection.search(query, query_type="fts")
@@ -119,35 +266,53 @@ class LanceDBDocumentStore(BaseDocumentStore):
             for doc in docs
         ]
 
-    def delete(self, ids: Union[List[str], str], refresh_indices: bool = True):
+    def delete(
+        self, ids: Union[List[str], str], refresh_indices: Optional[bool] = None
+    ):
         """Delete document by id"""
         if not isinstance(ids, list):
             ids = [ids]
 
-        document_collection = self.db_connection.open_table(self.collection_name)
-        id_filter = ", ".join([f"'{_id}'" for _id in ids])
-        query_filter = f"id in ({id_filter})"
-        document_collection.delete(query_filter)
+        with self._lock:
+            document_collection = self.db_connection.open_table(self.collection_name)
+            id_filter = ", ".join([f"'{_id}'" for _id in ids])
+            query_filter = f"id in ({id_filter})"
+            document_collection.delete(query_filter)
 
-        if refresh_indices:
-            document_collection.create_fts_index(
-                "text",
-                tokenizer_name="en_stem",
-                replace=True,
-            )
+            # deleted rows are filtered out at query time, the index is only pruned
+            self._on_write(document_collection, len(ids), refresh_indices)
 
     def drop(self):
         """Drop the document store"""
         self.db_connection.drop_table(self.collection_name)
 
     def count(self) -> int:
-        raise NotImplementedError
+        if self.collection_name not in self.db_connection.table_names():
+            return 0
+        return self.db_connection.open_table(self.collection_name).count_rows()
 
     def get_all(self) -> List[Document]:
-        raise NotImplementedError
+        if self.collection_name not in self.db_connection.table_names():
+            return []
+        rows = (
+            self.db_connection.open_table(self.collection_name)
+            .to_arrow()
+            .select(["id", "text", "attributes"])
+            .to_pylist()
+        )
+        return [
+            Document(
+                id_=row["id"],
+                text=row["text"] if row["text"] else "<empty>",
+                metadata=json.loads(row["attributes"]),
+            )
+            for row in rows
+        ]
 
     def __persist_flow__(self):
         return {
             "db_uri": self.db_uri,
             "collection_name": self.collection_name,
+            "fts_refresh_rows": self.fts_refresh_rows,
+            "fts_refresh_interval": self.fts_refresh_interval,
         }
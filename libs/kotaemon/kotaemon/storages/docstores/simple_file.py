@@ -3,7 +3,7 @@ from typing import List, Optional, Union
 
 from kotaemon.base import Document
 
-from .in_memory import InMemoryDocumentStore
+from .in_memory import InMemoryDocumentStore, bm25_path
 
 
 class SimpleFileDocumentStore(InMemoryDocumentStore):
@@ -58,6 +58,7 @@ class SimpleFileDocumentStore(InMemoryDocumentStore):
         """Drop the document store"""
         super().drop()
         self._save_path.unlink(missing_ok=True)
+        bm25_path(self._save_path).unlink(missing_ok=True)
 
     def __persist_flow__(self):
         from theflow.utils.modules import serialize
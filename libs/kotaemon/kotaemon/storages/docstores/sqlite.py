@@ -0,0 +1,293 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Union
+
+from kotaemon.base import Document
+
+from .base import BaseDocumentStore
+
+FTS_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class SQLiteDocumentStore(BaseDocumentStore):
+    """SQLite document store, with FTS5 full-text search
+
+    Each collection is stored in `path/collection_name.sqlite`, in WAL mode so that
+    readers are not blocked by the indexing process. Documents are upserted in
+    batches and looked up by their (indexed) id or `file_id` metadata, and the
+    full-text index is kept in sync by triggers.
+
+    Args:
+        path: directory containing the collections
+        collection_name: name of the collection
+        tokenizer: FTS5 tokenizer, stemming English words by default
+    """
+
+    def __init__(
+        self,
+        path: str | Path = "docstore",
+        collection_name: str = "default",
+        tokenizer: str = "porter unicode61",
+    ):
+        self._path = path
+        self._collection_name = collection_name
+        self._tokenizer = tokenizer
+        self._db_path = Path(path) / f"{collection_name}.sqlite"
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # a forked child must not reuse the connection of its parent
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            str(self._db_path),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY, text TEXT NOT NULL, data TEXT NOT NULL,
+                file_id TEXT
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+                text, content='docs', content_rowid='rowid',
+                tokenize='{self._tokenizer}'
+            );
+            CREATE TRIGGER IF NOT EXISTS docs_ai AFTER INSERT ON docs BEGIN
+                INSERT INTO docs_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_ad AFTER DELETE ON docs BEGIN
+                INSERT INTO docs_fts (docs_fts, rowid, text)
+                VALUES ('delete', old.rowid, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_au AFTER UPDATE ON docs BEGIN
+                INSERT INTO docs_fts (docs_fts, rowid, text)
+                VALUES ('delete', old.rowid, old.text);
+                INSERT INTO docs_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            """)
+        if not self._has_file_id_column(conn):
+            # collection created before the file_id column was introduced
+            conn.execute("BEGIN IMMEDIATE")
+            if not self._has_file_id_column(conn):
+                conn.execute("ALTER TABLE docs ADD COLUMN file_id TEXT")
+                conn.execute(
+                    "UPDATE docs SET file_id = json_extract(data, '$.metadata.file_id')"
+                )
+            conn.execute("COMMIT")
+        conn.execute("CREATE INDEX IF NOT EXISTS docs_file_id ON docs (file_id)")
+        self._conn, self._pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def _has_file_id_column(conn: sqlite3.Connection) -> bool:
+        return any(
+            row[1] == "file_id" for row in conn.execute("PRAGMA table_info(docs)")
+        )
+
+    def add(
+        self,
+        docs: Union[Document, List[Document]],
+        ids: Optional[Union[List[str], str]] = None,
+        **kwargs,
+    ):
+        """Add document into document store
+
+        Args:
+            docs: list of documents to add
+            ids: specify the ids of documents to add or
+                use existing doc.doc_id
+            exist_ok: raise error when duplicate doc-id
+                found in the docstore (default to False)
+        """
+        exist_ok: bool = kwargs.pop("exist_ok", False)
+
+        if ids and not isinstance(ids, list):
+            ids = [ids]
+        if not isinstance(docs, list):
+            docs = [docs]
+        doc_ids = ids if ids else [doc.doc_id for doc in docs]
+
+        rows = [
+            (
+                doc_id,
+                doc.text or "",
+                json.dumps(doc.to_dict()),
+                doc.metadata.get("file_id"),
+            )
+            for doc_id, doc in zip(doc_ids, docs)
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not exist_ok:
+                    existing = conn.execute(
+                        "SELECT id FROM docs WHERE id IN "
+                        "(SELECT value FROM json_each(?)) LIMIT 1",
+                        (json.dumps(doc_ids),),
+                    ).fetchone()
+                    if existing:
+                        raise ValueError(
+                            f"Document with id {existing[0]} already exist"
+                        )
+                conn.executemany(
+                    "INSERT INTO docs (id, text, data, file_id) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET text = excluded.text, "
+                    "data = excluded.data, file_id = excluded.file_id",
+                    rows,
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get(self, ids: Union[List[str], str]) -> List[Document]:
+        """Get document by id, in the order of `ids`, skipping missing ones"""
+        if not isinstance(ids, list):
+            ids = [ids]
+
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, data FROM docs WHERE id IN "
+                "(SELECT value FROM json_each(?))",
+                (json.dumps(ids),),
+            )
+            found = {doc_id: data for doc_id, data in rows}
+
+        return [
+            Document.from_dict(json.loads(found[doc_id]))
+            for doc_id in ids
+            if doc_id in found
+        ]
+
+    def get_all(self) -> List[Document]:
+        """Get all documents"""
+        with self._lock:
+            rows = self._connect().execute("SELECT data FROM docs").fetchall()
+        return [Document.from_dict(json.loads(data)) for (data,) in rows]
+
+    def count(self) -> int:
+        """Count number of documents"""
+        with self._lock:
+            (count,) = self._connect().execute("SELECT COUNT(*) FROM docs").fetchone()
+        return count
+
+    def query(
+        self,
+        query: str,
+        top_k: int = 10,
+        doc_ids: Optional[list] = None,
+        file_ids: Optional[list] = None,
+    ) -> List[Document]:
+        """Perform full-text search on document store, ranked by BM25"""
+        # quote each word so that user input is never parsed as FTS5 syntax
+        terms = FTS_TOKEN_PATTERN.findall(query)
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in dict.fromkeys(terms))
+
+        sql = (
+            "SELECT docs.data FROM docs_fts JOIN docs ON docs.rowid = docs_fts.rowid "
+            "WHERE docs_fts MATCH ?"
+        )
+        params: list = [match]
+        if doc_ids is not None:
+            sql += " AND docs.id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(doc_ids))
+        if file_ids is not None:
+            sql += " AND docs.file_id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(file_ids))
+        sql += " ORDER BY bm25(docs_fts) LIMIT ?"
+        params.append(top_k)
+
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        return [Document.from_dict(json.loads(data)) for (data,) in rows]
+
+    def delete(self, ids: Union[List[str], str]):
+        """Delete document by id"""
+        if not isinstance(ids, list):
+            ids = [ids]
+
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM docs WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(ids),),
+            )
+
+    def drop(self):
+        """Drop the document store"""
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{self._db_path}{suffix}").unlink(missing_ok=True)
+
+    def import_json(self, json_path: Union[str, Path], batch_size: int = 1000) -> int:
+        """Import the documents of a `SimpleFileDocumentStore` JSON file
+
+        Documents already in this store are overwritten.
+
+        Returns:
+            the number of imported documents
+        """
+        with open(json_path) as f:
+            store = json.load(f)
+
+        items = list(store.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start : start + batch_size]
+            self.add(
+                [Document.from_dict(data) for _, data in batch],
+                ids=[doc_id for doc_id, _ in batch],
+                exist_ok=True,
+            )
+        return len(items)
+
+    def __persist_flow__(self):
+        return {
+            "path": str(self._path),
+            "collection_name": self._collection_name,
+            "tokenizer": self._tokenizer,
+        }
+
+
+def migrate_simple_file_docstore(
+    src: Union[str, Path], dst: Optional[Union[str, Path]] = None
+) -> dict[str, int]:
+    """Migrate the collections of a `SimpleFileDocumentStore` to `SQLiteDocumentStore`
+
+    Args:
+        src: directory of the JSON docstore, containing `<collection_name>.json` files
+        dst: directory of the SQLite docstore, defaults to `src`
+
+    Returns:
+        the number of migrated documents of each collection
+    """
+    src = Path(src)
+    dst = Path(dst) if dst is not None else src
+
+    migrated = {}
+    for json_path in sorted(src.glob("*.json")):
+        if json_path.name.endswith(".bm25.json"):
+            # full-text index of the JSON docstore, rebuilt by FTS5 instead
+            continue
+        store = SQLiteDocumentStore(path=dst, collection_name=json_path.stem)
+        migrated[json_path.stem] = store.import_json(json_path)
+    return migrated
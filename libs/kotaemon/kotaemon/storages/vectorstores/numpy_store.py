@@ -0,0 +1,498 @@
+"""NumPy flat vector store, persisted to a memory-mapped file."""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    VectorStoreQueryMode,
+)
+
+from kotaemon.base import DocumentWithEmbedding
+
+from .base import BaseVectorStore
+
+
+class NumpyVectorStore(BaseVectorStore):
+    """Exact (flat) vector store with vectorized search over a float32 matrix
+
+    The vectors are appended to a raw float32 file that is memory-mapped for
+    querying, and the id map and metadata are kept in an append-only log. Adding and
+    deleting only append to these files, so the cost of persisting is proportional
+    to the change rather than to the store size. The files are compacted when
+    deleted rows make up more than `compact_ratio` of the store.
+
+    Args:
+        path: directory containing the collections
+        collection_name: name of the collection, stored in `path/collection_name`
+        indexed_metadata_keys: metadata keys that can be filtered without scanning
+            the metadata of each row (e.g. `file_id IN [...]`)
+        compact_ratio: fraction of deleted rows that triggers a compaction
+    """
+
+    _vectors_file = "vectors.f32"
+    _log_file = "index.jsonl"
+
+    def __init__(
+        self,
+        path: str | Path = "./numpy_vectorstore",
+        collection_name: str = "default",
+        indexed_metadata_keys: Optional[list[str]] = None,
+        compact_ratio: float = 0.5,
+        **kwargs: Any,
+    ):
+        self._path = path
+        self._collection_name = collection_name
+        self._dir = Path(path) / collection_name
+        self._indexed_keys = list(indexed_metadata_keys or ["file_id"])
+        self._compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._load()
+
+    def _reset(self):
+        self._dim: Optional[int] = None
+        self._n_rows = 0
+        self._matrix: np.ndarray = np.empty((0, 0), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._row_ids: list[Optional[str]] = []
+        self._row_metadata: list[dict] = []
+        self._id_to_row: dict[str, int] = {}
+        self._codes = {key: np.empty(0, dtype=np.int64) for key in self._indexed_keys}
+        self._vocab: dict[str, dict[Any, int]] = {key: {} for key in self._indexed_keys}
+
+    def _load(self):
+        self._reset()
+        log_path = self._dir / self._log_file
+        if not log_path.exists():
+            return
+
+        ids: list[Optional[str]] = []
+        metadatas: list[dict] = []
+        latest: dict[str, int] = {}
+        dead: set[int] = set()
+        valid_bytes = 0
+        torn = False
+        with log_path.open("rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line) if line.strip() else None
+                except ValueError:
+                    record = None
+                if line.strip() and (record is None or not line.endswith(b"\n")):
+                    # a torn write at the end of the log, from an interrupted add
+                    torn = True
+                    break
+                valid_bytes += len(line)
+                if record is None:
+                    continue
+                if record["op"] == "init":
+                    self._dim = record["dim"]
+                elif record["op"] == "add":
+                    if record["id"] in latest:
+                        dead.add(latest[record["id"]])
+                    latest[record["id"]] = len(ids)
+                    ids.append(record["id"])
+                    metadatas.append(record.get("metadata") or {})
+                elif record["op"] == "delete" and record["id"] in latest:
+                    dead.add(latest.pop(record["id"]))
+
+        if torn:
+            # drop the torn tail, so that the next records are not appended to it
+            os.truncate(log_path, valid_bytes)
+
+        n_rows = 0
+        vectors_path = self._dir / self._vectors_file
+        if self._dim:
+            vector_bytes = vectors_path.stat().st_size if vectors_path.exists() else 0
+            n_rows = min(len(ids), vector_bytes // (4 * self._dim))
+            if vector_bytes > n_rows * self._dim * 4:
+                # drop the vectors whose records were not written, so that the
+                # next vectors are appended at the rows numbered by the log
+                os.truncate(vectors_path, n_rows * self._dim * 4)
+        self._append_rows(ids[:n_rows], metadatas[:n_rows])
+        for row in dead:
+            if row < n_rows:
+                self._alive[row] = False
+                if self._id_to_row.get(ids[row]) == row:  # type: ignore
+                    del self._id_to_row[ids[row]]  # type: ignore
+        self._remap()
+
+        if n_rows < len(ids):
+            # the log has records without vectors, rewrite it from the loaded rows
+            self.compact()
+
+    def _remap(self):
+        """Memory-map the vectors file and refresh the cached norms"""
+        if not self._dim or not self._n_rows:
+            self._matrix = np.empty((0, self._dim or 0), dtype=np.float32)
+            self._norms = np.empty(0, dtype=np.float32)
+            return
+
+        self._matrix = np.memmap(
+            self._dir / self._vectors_file,
+            dtype=np.float32,
+            mode="r",
+            shape=(self._n_rows, self._dim),
+        )
+        n_known = len(self._norms)
+        if n_known < self._n_rows:
+            new_norms = np.linalg.norm(self._matrix[n_known:], axis=1)
+            self._norms = np.concatenate([self._norms, new_norms.astype(np.float32)])
+
+    def _append_rows(self, ids: list[Optional[str]], metadatas: list[dict]):
+        """Register new rows in the in-memory id map and metadata indices"""
+        start = self._n_rows
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        for offset, id_ in enumerate(ids):
+            if id_ is not None:
+                # re-adding an id replaces its previous vector
+                if id_ in self._id_to_row:
+                    self._alive[self._id_to_row[id_]] = False
+                self._id_to_row[id_] = start + offset
+        self._row_ids.extend(ids)
+        self._row_metadata.extend(metadatas)
+        for key in self._indexed_keys:
+            vocab = self._vocab[key]
+            codes = [
+                (
+                    vocab.setdefault(metadata[key], len(vocab))
+                    if _is_hashable(metadata.get(key))
+                    else -1
+                )
+                for metadata in metadatas
+            ]
+            self._codes[key] = np.concatenate(
+                [self._codes[key], np.asarray(codes, dtype=np.int64)]
+            )
+        self._n_rows += len(ids)
+
+    def _remove_ids(self, ids: list[str]) -> list[str]:
+        removed = []
+        for id_ in ids:
+            row = self._id_to_row.pop(id_, None)
+            if row is not None:
+                self._alive[row] = False
+                removed.append(id_)
+        return removed
+
+    def _write_log(self, records: list[dict]):
+        with (self._dir / self._log_file).open("a") as f:
+            f.write(
+                "".join(json.dumps(record, default=str) + "\n" for record in records)
+            )
+
+    def add(
+        self,
+        embeddings: list[list[float]] | list[DocumentWithEmbedding],
+        metadatas: Optional[list[dict]] = None,
+        ids: Optional[list[str]] = None,
+    ) -> list[str]:
+        if not embeddings:
+            return []
+
+        if isinstance(embeddings[0], DocumentWithEmbedding):
+            docs: list[DocumentWithEmbedding] = embeddings  # type: ignore
+            vectors = [doc.embedding for doc in docs]
+            metadatas = metadatas or [doc.metadata for doc in docs]
+            ids = ids or [doc.doc_id for doc in docs]
+        else:
+            vectors = embeddings  # type: ignore
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("Embeddings must all have the same dimension")
+        if ids is None:
+            from uuid import uuid4
+
+            ids = [str(uuid4()) for _ in range(len(matrix))]
+        metadatas = [dict(metadata) for metadata in (metadatas or [{}] * len(ids))]
+        for metadata in metadatas:
+            # the image is kept in the docstore, no need to duplicate it here
+            if "image_origin" in metadata:
+                metadata["image_origin"] = "place-holder"
+        if not (len(matrix) == len(ids) == len(metadatas)):
+            raise ValueError("embeddings, metadatas and ids must have the same length")
+
+        with self._lock:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            records: list[dict] = []
+            if self._dim is None:
+                self._dim = int(matrix.shape[1])
+                records.append({"op": "init", "dim": self._dim})
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(
+                    f"Expected embeddings of dimension {self._dim}, "
+                    f"got {matrix.shape[1]}"
+                )
+
+            records.extend(
+                {"op": "add", "id": id_, "metadata": metadata}
+                for id_, metadata in zip(ids, metadatas)
+            )
+            # vectors first: rows missing from the vectors file are dropped on load.
+            # Both files are rolled back if either write fails, so that the rows of
+            # the log keep matching the rows of the vectors file.
+            vectors_path = self._dir / self._vectors_file
+            log_path = self._dir / self._log_file
+            vectors_size = vectors_path.stat().st_size if vectors_path.exists() else 0
+            log_size = log_path.stat().st_size if log_path.exists() else 0
+            try:
+                with vectors_path.open("ab") as f:
+                    f.write(np.ascontiguousarray(matrix).tobytes())
+                self._write_log(records)
+            except BaseException:
+                os.truncate(vectors_path, vectors_size)
+                if log_path.exists():
+                    os.truncate(log_path, log_size)
+                if records[0]["op"] == "init":
+                    self._dim = None
+                raise
+
+            self._append_rows(list(ids), metadatas)
+            self._remap()
+
+        return list(ids)
+
+    def delete(self, ids: list[str], **kwargs):
+        with self._lock:
+            removed = self._remove_ids(ids)
+            if not removed:
+                return
+            self._write_log([{"op": "delete", "id": id_} for id_ in removed])
+
+            n_dead = self._n_rows - len(self._id_to_row)
+            if n_dead > self._compact_ratio * self._n_rows:
+                self.compact()
+
+    def compact(self):
+        """Rewrite the store files without the deleted rows"""
+        with self._lock:
+            rows = np.flatnonzero(self._alive)
+            tmp_vectors = self._dir / f"{self._vectors_file}.tmp"
+            tmp_log = self._dir / f"{self._log_file}.tmp"
+
+            with tmp_vectors.open("wb") as f:
+                for start in range(0, len(rows), 8192):
+                    batch = rows[start : start + 8192]
+                    f.write(np.ascontiguousarray(self._matrix[batch]).tobytes())
+            with tmp_log.open("w") as f:
+                if self._dim is not None:
+                    f.write(json.dumps({"op": "init", "dim": self._dim}) + "\n")
+                for row in rows:
+                    record = {
+                        "op": "add",
+                        "id": self._row_ids[row],
+                        "metadata": self._row_metadata[row],
+                    }
+                    f.write(json.dumps(record, default=str) + "\n")
+
+            # release the memory map before replacing the file it maps
+            self._matrix = np.empty((0, self._dim or 0), dtype=np.float32)
+            tmp_vectors.replace(self._dir / self._vectors_file)
+            tmp_log.replace(self._dir / self._log_file)
+            self._load()
+
+    def _candidate_mask(
+        self, ids: Optional[list[str]], filters: Optional[MetadataFilters]
+    ) -> np.ndarray:
+        mask = self._alive.copy()
+        if ids is not None:
+            rows = [self._id_to_row[id_] for id_ in ids if id_ in self._id_to_row]
+            id_mask = np.zeros(self._n_rows, dtype=bool)
+            id_mask[rows] = True
+            mask &= id_mask
+        if filters is not None and filters.filters:
+            mask &= self._filters_mask(filters)
+        return mask
+
+    def _filters_mask(self, filters: MetadataFilters) -> np.ndarray:
+        masks = []
+        for filter_ in filters.filters:
+            if isinstance(filter_, MetadataFilters):
+                masks.append(self._filters_mask(filter_))
+            else:
+                masks.append(self._filter_mask(filter_))
+
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    def _filter_mask(self, filter_: MetadataFilter) -> np.ndarray:
+        key, value, operator = filter_.key, filter_.value, filter_.operator
+
+        if key in self._indexed_keys and operator in (
+            FilterOperator.EQ,
+            FilterOperator.NE,
+            FilterOperator.IN,
+            FilterOperator.NIN,
+        ):
+            values = value if isinstance(value, list) else [value]
+            vocab = self._vocab[key]
+            codes = [vocab[v] for v in values if _is_hashable(v) and v in vocab]
+            mask = np.isin(self._codes[key], codes)
+            if operator in (FilterOperator.NE, FilterOperator.NIN):
+                return ~mask
+            return mask
+
+        return np.fromiter(
+            (
+                _match(metadata.get(key), operator, value)
+                for metadata in self._row_metadata
+            ),
+            dtype=bool,
+            count=self._n_rows,
+        )
+
+    def query(
+        self,
+        embedding: list[float],
+        top_k: int = 1,
+        ids: Optional[list[str]] = None,
+        **kwargs,
+    ) -> tuple[list[list[float]], list[float], list[str]]:
+        """Return the top k most similar (cosine) vector embeddings
+
+        Args:
+            embedding: the query embedding
+            top_k: Number of most similar embeddings to return
+            ids: List of ids of the embeddings to be queried
+            kwargs: supports `filters` (llama-index `MetadataFilters`), and
+                `mode="mmr"` with `mmr_threshold` for maximal marginal relevance
+
+        Returns:
+            the matched embeddings, the similarity scores, and the ids
+        """
+        with self._lock:
+            if not self._n_rows or not top_k:
+                return [], [], []
+            matrix, norms = self._matrix, self._norms
+            row_ids = self._row_ids
+            rows = np.flatnonzero(self._candidate_mask(ids, kwargs.get("filters")))
+
+        if not len(rows):
+            return [], [], []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query) or 1.0
+        if len(rows) == len(matrix):
+            scores = matrix @ query
+        else:
+            scores = matrix[rows] @ query
+        scores /= np.maximum(norms[rows], 1e-12) * query_norm
+
+        if kwargs.get("mode") == VectorStoreQueryMode.MMR:
+            order = _mmr(
+                matrix,
+                rows,
+                norms,
+                scores,
+                top_k,
+                kwargs.get("mmr_threshold") or 0.5,
+            )
+        elif top_k < len(rows):
+            order = np.argpartition(-scores, top_k - 1)[:top_k]
+            order = order[np.argsort(-scores[order], kind="stable")]
+        else:
+            order = np.argsort(-scores, kind="stable")
+
+        selected = rows[order]
+        return (
+            np.asarray(matrix[selected]).tolist(),
+            scores[order].tolist(),
+            [row_ids[row] for row in selected],  # type: ignore
+        )
+
+    def get(self, id_: str) -> list[float]:
+        """Get the embedding of an id"""
+        with self._lock:
+            return np.asarray(self._matrix[self._id_to_row[id_]]).tolist()
+
+    def count(self) -> int:
+        return len(self._id_to_row)
+
+    def drop(self):
+        """Delete the collection"""
+        with self._lock:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+            (self._dir / self._vectors_file).unlink(missing_ok=True)
+            (self._dir / self._log_file).unlink(missing_ok=True)
+            self._reset()
+
+    def __persist_flow__(self):
+        return {
+            "path": str(self._path),
+            "collection_name": self._collection_name,
+            "indexed_metadata_keys": self._indexed_keys,
+            "compact_ratio": self._compact_ratio,
+        }
+
+
+def _is_hashable(value: Any) -> bool:
+    return value is not None and isinstance(value, (str, int, float, bool))
+
+
+def _match(field: Any, operator: FilterOperator, value: Any) -> bool:
+    if field is None:
+        return operator in (FilterOperator.NE, FilterOperator.NIN)
+    try:
+        if operator == FilterOperator.EQ:
+            return field == value
+        if operator == FilterOperator.NE:
+            return field != value
+        if operator == FilterOperator.IN:
+            return field in value
+        if operator == FilterOperator.NIN:
+            return field not in value
+        if operator == FilterOperator.GT:
+            return field > value
+        if operator == FilterOperator.GTE:
+            return field >= value
+        if operator == FilterOperator.LT:
+            return field < value
+        if operator == FilterOperator.LTE:
+            return field <= value
+        if operator == FilterOperator.CONTAINS:
+            return value in field
+        if operator == FilterOperator.TEXT_MATCH:
+            return value in str(field)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+
+def _mmr(
+    matrix: np.ndarray,
+    rows: np.ndarray,
+    norms: np.ndarray,
+    scores: np.ndarray,
+    top_k: int,
+    threshold: float,
+) -> np.ndarray:
+    """Select `top_k` positions in `rows` by maximal marginal relevance"""
+    n_fetch = min(len(rows), max(top_k * 4, 20))
+    pool = np.argpartition(-scores, n_fetch - 1)[:n_fetch]
+    vectors = np.asarray(matrix[rows[pool]], dtype=np.float32)
+    vectors /= np.maximum(norms[rows[pool]], 1e-12)[:, None]
+    similarity = vectors @ vectors.T
+
+    selected: list[int] = []
+    remaining = list(range(len(pool)))
+    while remaining and len(selected) < top_k:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        mmr_scores = threshold * scores[pool[remaining]] - (1 - threshold) * redundancy
+        best = remaining[int(np.argmax(mmr_scores))]
+        selected.append(best)
+        remaining.remove(best)
+
+    return pool[selected]
@@ -1,6 +1,93 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 
 
+class StandInTEIServer(ThreadingHTTPServer):
+    """Local stand-in of a TEI server, serving `/embed` and `/rerank`
+
+    Each request takes `delay` seconds. The first `n_overloaded` requests are
+    answered with 429. The batch sizes and the maximum number of concurrent
+    requests are recorded.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInTEIHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.delay = 0.0
+        self.n_overloaded = 0
+        self.batch_sizes: list[int] = []
+        self.n_requests = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+
+class StandInTEIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body, headers: dict | None = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server: StandInTEIServer = self.server  # type: ignore
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server._lock:
+            server.n_requests += 1
+            if server.n_overloaded > 0:
+                server.n_overloaded -= 1
+                overloaded = True
+            else:
+                overloaded = False
+                server._in_flight += 1
+                server.max_in_flight = max(server.max_in_flight, server._in_flight)
+        if overloaded:
+            return self._reply(429, {"error": "overloaded"}, {"Retry-After": "0.05"})
+
+        try:
+            time.sleep(server.delay)
+            if self.path == "/embed":
+                texts = payload["inputs"]
+                body = [[float(len(text)), 1.0] for text in texts]
+            else:
+                texts = payload["texts"]
+                body = [
+                    {"index": idx, "score": float(len(text))}
+                    for idx, text in enumerate(texts)
+                ]
+            with server._lock:
+                server.batch_sizes.append(len(texts))
+        finally:
+            with server._lock:
+                server._in_flight -= 1
+        self._reply(200, body)
+
+
+@pytest.fixture
+def tei_server():
+    server = StandInTEIServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture(scope="function")
 def mock_google_search(monkeypatch):
     import googlesearch
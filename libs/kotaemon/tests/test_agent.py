@@ -1,3 +1,5 @@
+import threading
+import time
 from unittest.mock import patch
 
 import pytest
@@ -159,6 +161,90 @@ def test_rewoo_agent(openai_completion, llm, mock_google_search):
     assert response.text == FINAL_RESPONSE_TEXT
 
 
+_tool_calls = []
+_release = threading.Event()
+
+
+class EchoTool(BaseTool):
+    name: str = "echo"
+    description: str = "Return the input"
+
+    def _run_tool(self, query: str) -> str:
+        _tool_calls.append(query)
+        return f"echo {query}"
+
+
+class BlockTool(BaseTool):
+    name: str = "block"
+    description: str = "Wait until the test releases it"
+
+    def _run_tool(self, query: str) -> str:
+        _release.wait()
+        return f"released {query}"
+
+
+class SleepTool(BaseTool):
+    name: str = "sleep"
+    description: str = "Sleep for the number of seconds in the input"
+
+    def _run_tool(self, query: str) -> str:
+        time.sleep(float(query))
+        return f"slept {query}"
+
+
+@pytest.fixture
+def rewoo_tools():
+    _tool_calls.clear()
+    _release.clear()
+    yield [EchoTool(), BlockTool(), SleepTool()]
+    # let the abandoned calls finish
+    _release.set()
+
+
+def test_rewoo_agent_worker_scheduling(llm, rewoo_tools):
+    agent = RewooAgent(
+        planner_llm=llm, solver_llm=llm, plugins=rewoo_tools, tool_timeout=0.2
+    )
+    plan = "#E1: block[a]\n#E2: echo[b]\n#E3: echo[#E2]\n#E4: echo[b]\n"
+    planner_evidences, evidence_level = agent._parse_planner_evidences(plan)
+    evidences, _, _, timings = agent._get_worker_evidence(
+        planner_evidences, evidence_level
+    )
+
+    assert evidence_level == [["#E1", "#E2", "#E4"], ["#E3"]]
+    # the dependent step does not wait for the blocked step of the same level
+    assert evidences["#E3"] == "echo echo b"
+    # the identical call runs once
+    assert evidences["#E4"] == evidences["#E2"] == "echo b"
+    assert timings["#E4"]["status"] == "cached"
+    assert _tool_calls.count("b") == 1
+    # the evidence of the call running after the timeout is dropped
+    assert evidences["#E1"] == "No evidence found."
+    assert timings["#E1"]["status"] == "timeout"
+
+
+def test_rewoo_agent_tool_slots(llm, rewoo_tools, monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr("kotaemon.agents.rewoo.agent._tool_slots", slots)
+    agent = RewooAgent(
+        planner_llm=llm, solver_llm=llm, plugins=rewoo_tools, tool_timeout=1.0
+    )
+    # the timeout of each call starts with its slot, not while it is queued
+    plan = "#E1: sleep[0.6]\n#E2: sleep[0.6]\n#E3: block[a]\n"
+    planner_evidences, evidence_level = agent._parse_planner_evidences(plan)
+    evidences, _, _, timings = agent._get_worker_evidence(
+        planner_evidences, evidence_level
+    )
+
+    assert evidences["#E1"] == evidences["#E2"] == "slept 0.6"
+    assert timings["#E3"]["status"] == "timeout"
+    # the abandoned call holds its slot until it exits
+    assert not slots.acquire(blocking=False)
+    _release.set()
+    assert slots.acquire(timeout=5)
+    slots.release()
+
+
 @patch(
     "openai.resources.chat.completions.Completions.create",
     side_effect=_openai_chat_completion_responses_react,
@@ -0,0 +1,126 @@
+import random
+from difflib import SequenceMatcher
+
+import pytest
+
+from kotaemon.indices.qa.utils import (
+    find_longest_match,
+    find_matching_blocks,
+    find_start_end_phrase,
+    find_text,
+)
+
+WORDS = (
+    "the a of and to in revenue growth market cost report customer product quarter "
+    "team risk policy data model service price sales plan region energy contract"
+).split()
+
+
+def reference_find_text(search_span, context, min_length=5):
+    """`find_text` as implemented with `difflib.SequenceMatcher`"""
+    context = context.replace("\n", " ")
+    matches_span = []
+    if len(search_span) > min_length:
+        for sentence in search_span.split("\n"):
+            blocks = [
+                (start, start + length)
+                for _, start, length in SequenceMatcher(
+                    None, sentence, context, autojunk=False
+                ).get_matching_blocks()
+                if length > max(len(sentence) * 0.2, min_length)
+            ]
+            if blocks:
+                start = min(start for start, _ in blocks)
+                end = max(end for _, end in blocks)
+                if end - start > max(len(sentence) * 0.35, min_length):
+                    matches_span.append((start, end))
+    if matches_span:
+        matches_span = [
+            (min(s for s, _ in matches_span), max(e for _, e in matches_span))
+        ]
+    return matches_span
+
+
+def make_quote(rng: random.Random, context: str, length: int) -> str:
+    """Paraphrase an excerpt of the context, as the LLM quotes its evidences"""
+    start = rng.randint(0, max(len(context) - length, 0))
+    words = context[start : start + length].split(" ")
+    for _ in range(len(words) // 8):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    if rng.random() < 0.5:
+        words.insert(len(words) // 2, "\n")
+    return " ".join(words)
+
+
+def make_case(seed: int, n_docs: int = 10, n_words: int = 750, n_quotes: int = 5):
+    rng = random.Random(seed)
+    docs = [" ".join(rng.choices(WORDS, k=n_words)) for _ in range(n_docs)]
+    quotes = [
+        make_quote(rng, rng.choice(docs), rng.randint(40, 300)) for _ in range(n_quotes)
+    ]
+    return docs, quotes
+
+
+def test_find_matching_blocks_same_as_difflib():
+    rng = random.Random(0)
+    for _ in range(300):
+        alphabet = rng.choice(["ab", "abc -", "abcdefgh "])
+        context = "".join(rng.choices(alphabet, k=rng.randint(0, 300)))
+        sentence = "".join(rng.choices(alphabet, k=rng.randint(0, 60)))
+        min_size, ngram_size = rng.randint(1, 8), rng.randint(1, 8)
+
+        matcher = SequenceMatcher(None, sentence, context, autojunk=False)
+        expected = [
+            block for block in matcher.get_matching_blocks() if block.size >= min_size
+        ]
+        assert find_matching_blocks(sentence, context, min_size, ngram_size) == expected
+
+        longest = matcher.find_longest_match()
+        match = find_longest_match(sentence, context, min_size, ngram_size)
+        if longest.size >= min_size:
+            assert match == longest
+        else:
+            assert match.size == 0
+
+
+def test_find_text_same_as_difflib():
+    for seed in range(3):
+        docs, quotes = make_case(seed, n_words=200)
+        for quote in quotes:
+            for doc in docs:
+                assert find_text(quote, doc) == reference_find_text(quote, doc)
+
+
+def test_find_text():
+    context = (
+        "The pink cockatoo is a medium-sized cockatoo that inhabits arid and\n"
+        "semi-arid inland areas across Australia. It is listed as an endangered "
+        "species by the Australian government."
+    )
+    quote = "The pink cockatoo inhabits arid and semi-arid inland areas"
+    assert find_text(quote, context) == [(0, 90)]
+    assert find_text("cockatoo", "a pink cockatoo") == [(7, 15)]
+    assert find_text("short", context) == []
+    assert find_text("nothing to see in there", context) == []
+
+    assert find_start_end_phrase(
+        "is listed as an endangered", "the Australian government", context
+    ) == ((112, 175), 51)
+    assert find_start_end_phrase("unrelated words", None, context) == (None, 0)
+
+
+@pytest.mark.parametrize(
+    "n_docs, n_words, n_quotes",
+    [(10, 750, 5), (20, 200, 10), (3, 2000, 3)],
+)
+def test_find_text_same_as_difflib_on_documents(n_docs, n_words, n_quotes):
+    """Match every quote with every doc, as done after each answer
+
+    See scripts/benchmark_citation_matching.py for the timings.
+    """
+    docs, quotes = make_case(100, n_docs, n_words, n_quotes)
+
+    expected = [reference_find_text(quote, doc) for quote in quotes for doc in docs]
+    output = [find_text(quote, doc) for quote in quotes for doc in docs]
+
+    assert output == expected
@@ -1,14 +1,24 @@
+import base64
 import os
 from unittest.mock import patch
 
 import pytest
 from elastic_transport import ApiResponseMeta
+from theflow.settings import settings as flowsettings
 
 from kotaemon.base import Document
 from kotaemon.storages import (
     ElasticsearchDocumentStore,
     InMemoryDocumentStore,
+    LanceDBDocumentStore,
+    LocalBlobStore,
     SimpleFileDocumentStore,
+    SQLiteDocumentStore,
+)
+from kotaemon.storages.blobstore import (
+    offload_docstore_images,
+    remove_unreferenced_blobs,
+    resolve_image,
 )
 
 meta_success = ApiResponseMeta(
@@ -322,6 +332,240 @@ def test_simplefile_document_store_base_interfaces(tmp_path):
     os.remove(tmp_path / "default.json")
 
 
+def test_simplefile_document_store_query(tmp_path):
+    store = SimpleFileDocumentStore(path=tmp_path)
+    store.add(
+        [
+            Document(text="The cat sat on the mat", id_="cat"),
+            Document(text="A dog chased the cat around the garden", id_="dog"),
+            Document(text="Quarterly revenue grew by ten percent", id_="revenue"),
+        ]
+    )
+
+    assert [doc.doc_id for doc in store.query("cat mat")] == ["cat", "dog"]
+    assert [doc.doc_id for doc in store.query("cat", doc_ids=["dog"])] == ["dog"]
+    assert [doc.doc_id for doc in store.query("Revenue", top_k=1)] == ["revenue"]
+    assert store.query("unknown words") == []
+
+    # the index is maintained on delete, and persisted alongside the docstore
+    store.delete("cat")
+    assert [doc.doc_id for doc in store.query("cat mat")] == ["dog"]
+    store2 = SimpleFileDocumentStore(path=tmp_path)
+    assert [doc.doc_id for doc in store2.query("garden")] == ["dog"]
+
+    store2.drop()
+    assert not (tmp_path / "default.bm25.json").exists()
+
+
+def test_sqlite_document_store_base_interfaces(tmp_path):
+    store = SQLiteDocumentStore(path=tmp_path)
+    docs = [
+        Document(text=f"Sample text {idx}", meta={"meta_key": f"meta_value_{idx}"})
+        for idx in range(10)
+    ]
+
+    assert len(store.get_all()) == 0, "Document store should be empty"
+    store.add(docs)
+    store.add(docs=docs, ids=[f"doc_{idx}" for idx in range(10)])
+    assert store.count() == 20, "Document store should have 20 documents"
+
+    with pytest.raises(ValueError):
+        store.add(docs=docs, ids=[f"doc_{idx}" for idx in range(10)])
+    store.add(docs=docs, ids=[f"doc_{idx}" for idx in range(10)], exist_ok=True)
+    assert store.count() == 20, "Document store should have 20 documents"
+
+    matched = store.get([docs[1].doc_id, "missing", docs[0].doc_id])
+    assert [doc.text for doc in matched] == [docs[1].text, docs[0].text]
+    assert matched[0].metadata == docs[1].metadata
+
+    store.delete(docs[0].doc_id)
+    store.delete([docs[1].doc_id, docs[2].doc_id])
+    assert store.count() == 17, "Document store should have 17 documents"
+
+    store2 = SQLiteDocumentStore(path=tmp_path)
+    assert store2.count() == 17, "Loaded document store should have 17 documents"
+
+    store2.drop()
+    assert not (tmp_path / "default.sqlite").exists()
+
+
+def test_sqlite_document_store_query_and_migration(tmp_path):
+    json_store = SimpleFileDocumentStore(path=tmp_path)
+    json_store.add(
+        [
+            Document(text="The cat sat on the mat", id_="cat"),
+            Document(text="A dog chased the cats around the garden", id_="dog"),
+            Document(text='Revenue grew by ten "percent" (NEAR)', id_="revenue"),
+        ]
+    )
+
+    from kotaemon.storages.docstores.sqlite import migrate_simple_file_docstore
+
+    assert migrate_simple_file_docstore(tmp_path) == {"default": 3}
+    store = SQLiteDocumentStore(path=tmp_path)
+
+    assert [doc.doc_id for doc in store.query("cat mat")] == ["cat", "dog"]
+    assert [doc.doc_id for doc in store.query("cat", doc_ids=["dog"])] == ["dog"]
+    assert [doc.doc_id for doc in store.query('percent" NEAR(')] == ["revenue"]
+    assert store.query("unknown words") == []
+
+    store.add(Document(text="A cat", id_="cat"), exist_ok=True)
+    store.delete("dog")
+    assert [doc.doc_id for doc in store.query("mat cat")] == ["cat"]
+
+
+def test_lancedb_document_store_deferred_fts(tmp_path):
+    store = LanceDBDocumentStore(path=str(tmp_path), collection_name="test")
+    store.add([Document(text="The cat sat on the mat", id_="cat")])
+    for idx in range(3):
+        store.add([Document(text=f"A dog chased cat number {idx}", id_=f"dog{idx}")])
+
+    # the rows written after the table creation are searched but not yet indexed
+    table = store.db_connection.open_table("test")
+    (index,) = [idx for idx in table.list_indices() if idx.index_type == "FTS"]
+    assert table.index_stats(index.name).num_unindexed_rows == 3
+    assert len(store.query("cat")) == 4
+
+    store.delete("dog0")
+    store.flush()
+    table = store.db_connection.open_table("test")
+    assert table.index_stats(index.name).num_unindexed_rows == 0
+    assert {doc.doc_id for doc in store.query("cat")} == {"cat", "dog1", "dog2"}
+    assert [doc.doc_id for doc in store.query("dog", doc_ids=["dog2"])] == ["dog2"]
+
+
+@pytest.mark.parametrize(
+    "store_cls",
+    [
+        lambda path: SimpleFileDocumentStore(path=path),
+        lambda path: SQLiteDocumentStore(path=path),
+        lambda path: LanceDBDocumentStore(path=str(path)),
+    ],
+    ids=["simple_file", "sqlite", "lancedb"],
+)
+def test_document_store_query_file_ids(tmp_path, store_cls):
+    store = store_cls(tmp_path)
+    store.add(
+        [
+            Document(
+                text="The cat sat on the mat", id_="a1", metadata={"file_id": "a"}
+            ),
+            Document(text="A cat in a hat", id_="a2", metadata={"file_id": "a"}),
+            Document(text="The cat and the dog", id_="b1", metadata={"file_id": "b"}),
+            Document(text="A cat without file", id_="c1"),
+        ]
+    )
+
+    assert {doc.doc_id for doc in store.query("cat", file_ids=["a"])} == {"a1", "a2"}
+    assert {doc.doc_id for doc in store.query("cat", file_ids=["a", "b"])} == {
+        "a1",
+        "a2",
+        "b1",
+    }
+    assert [doc.doc_id for doc in store.query("cat", file_ids=["missing"])] == []
+    assert [doc.doc_id for doc in store.query("cat", file_ids=[])] == []
+    assert [
+        doc.doc_id for doc in store.query("cat", doc_ids=["a2", "b1"], file_ids=["a"])
+    ] == ["a2"]
+
+    store.delete("a1")
+    assert [doc.doc_id for doc in store.query("cat", file_ids=["a"])] == ["a2"]
+
+
+def test_lancedb_document_store_adds_file_id_column(tmp_path):
+    import json
+
+    import lancedb
+
+    # a table created before the `file_id` column was introduced
+    db = lancedb.connect(str(tmp_path))
+    db.create_table(
+        "test",
+        data=[
+            {
+                "id": f"doc{idx}",
+                "text": f"cat number {idx}",
+                "attributes": json.dumps({"file_id": f"file{idx % 2}"}),
+            }
+            for idx in range(4)
+        ],
+    ).create_fts_index("text", tokenizer_name="en_stem")
+
+    store = LanceDBDocumentStore(path=str(tmp_path), collection_name="test")
+    docs = store.query("cat", file_ids=["file1"])
+    assert {doc.doc_id for doc in docs} == {"doc1", "doc3"}
+
+    table = store.db_connection.open_table("test")
+    assert "file_id" in table.schema.names
+    store.add(Document(text="cat", id_="doc4", metadata={"file_id": "file1"}))
+    docs = store.query("cat", file_ids=["file1"])
+    assert {doc.doc_id for doc in docs} == {"doc1", "doc3", "doc4"}
+
+
+def test_local_blob_store(tmp_path, monkeypatch):
+    store = LocalBlobStore(tmp_path / "blobs")
+    image = "data:image/png;base64," + base64.b64encode(b"png bytes").decode()
+
+    uri = store.put_data_url(image)
+    assert uri.startswith("blob://") and uri.endswith(".png")
+    assert store.put_data_url(image) == uri
+    assert len(list((tmp_path / "blobs").rglob("*.png"))) == 1
+    assert store.get(uri) == b"png bytes"
+    assert store.to_data_url(uri) == image
+
+    # other values are kept as-is
+    assert store.put_data_url(uri) == uri
+    url = "https://example.com/a.png"
+    assert store.put_data_url(url) == url
+    with pytest.raises(ValueError):
+        store.get_path("blob://../../etc/passwd")
+
+    monkeypatch.setattr(
+        flowsettings, "KH_BLOB_STORE_PATH", str(tmp_path / "blobs"), raising=False
+    )
+    assert resolve_image(uri) == image
+    assert resolve_image(image) == image
+
+
+@pytest.mark.parametrize(
+    "store_cls",
+    [
+        lambda path: SimpleFileDocumentStore(path=path),
+        lambda path: SQLiteDocumentStore(path=path),
+        lambda path: LanceDBDocumentStore(path=str(path)),
+    ],
+    ids=["simple_file", "sqlite", "lancedb"],
+)
+def test_offload_docstore_images(tmp_path, store_cls):
+    image = "data:image/png;base64," + base64.b64encode(b"thumbnail").decode()
+    store = store_cls(tmp_path / "docstore")
+    store.add(
+        [
+            Document(text="page 1", id_="t1", metadata={"image_origin": image}),
+            Document(text="page 2", id_="t2", metadata={"image_origin": image}),
+            Document(text="some text", id_="c1", metadata={"page_label": "1"}),
+        ]
+    )
+
+    blob_store = LocalBlobStore(tmp_path / "blobs")
+    assert offload_docstore_images(store, blob_store) == 2
+    assert offload_docstore_images(store, blob_store) == 0
+
+    assert store.count() == 3
+    docs = {doc.doc_id: doc for doc in store.get(["t1", "t2", "c1"])}
+    assert docs["t1"].metadata["image_origin"] == docs["t2"].metadata["image_origin"]
+    assert blob_store.to_data_url(docs["t1"].metadata["image_origin"]) == image
+    assert docs["c1"].metadata == {"page_label": "1"}
+
+    # the blobs of the deleted documents are removed on demand
+    other = blob_store.put(b"figure", ".png")
+    assert remove_unreferenced_blobs([store], blob_store) == 1
+    assert not blob_store.exists(other)
+    store.delete(["t1", "t2"])
+    assert remove_unreferenced_blobs([store], blob_store) == 1
+    assert blob_store.list_uris() == []
+
+
 @patch(
     "elastic_transport.Transport.perform_request",
     side_effect=_elastic_search_responses,
@@ -1,4 +1,6 @@
+import asyncio
 import json
+import time
 from pathlib import Path
 from unittest.mock import patch
 
@@ -7,10 +9,13 @@ from openai.types.create_embedding_response import CreateEmbeddingResponse
 from kotaemon.base import Document
 from kotaemon.embeddings import (
     AzureOpenAIEmbeddings,
+    CachedEmbeddings,
+    DiskEmbeddingCache,
     FastEmbedEmbeddings,
     LCCohereEmbeddings,
     LCHuggingFaceEmbeddings,
     OpenAIEmbeddings,
+    TeiEndpointEmbeddings,
 )
 
 from .conftest import (
@@ -155,3 +160,103 @@ def test_fastembed_embeddings():
     model = FastEmbedEmbeddings()
     output = model("Hello World")
     assert_embedding_result(output)
+
+
+@patch(
+    "openai.resources.embeddings.Embeddings.create",
+    side_effect=lambda *args, **kwargs: openai_embedding,
+)
+def test_cached_embeddings(openai_embedding_call, tmp_path):
+    cache = DiskEmbeddingCache(tmp_path / "embeddings.db")
+    model = CachedEmbeddings(
+        embedding=OpenAIEmbeddings(
+            api_key="some-api-key", model="text-embedding-ada-002"
+        ),
+        cache=cache,
+    )
+
+    output = model("Hello, world!")
+    assert_embedding_result(output)
+    assert openai_embedding_call.call_count == 1
+
+    cached_output = model(Document(text="Hello, world!", metadata={"page": 1}))
+    assert_embedding_result(cached_output)
+    assert openai_embedding_call.call_count == 1
+    assert cached_output[0].embedding == output[0].embedding
+    assert cached_output[0].metadata == {"page": 1}
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    # the cache persists on disk, and a different model does not share the entries
+    reopened = CachedEmbeddings(
+        embedding=OpenAIEmbeddings(api_key="other-key", model="text-embedding-ada-002"),
+        cache=DiskEmbeddingCache(tmp_path / "embeddings.db"),
+    )
+    reopened("Hello, world!")
+    assert openai_embedding_call.call_count == 1
+
+    other_model = CachedEmbeddings(
+        embedding=OpenAIEmbeddings(
+            api_key="some-api-key", model="text-embedding-3-small"
+        ),
+        cache=cache,
+    )
+    other_model("Hello, world!")
+    assert openai_embedding_call.call_count == 2
+
+
+def test_disk_embedding_cache_eviction(tmp_path):
+    cache = DiskEmbeddingCache(
+        tmp_path / "embeddings.db", max_size=3 * 4 * 4, evict_ratio=1.0
+    )
+    for idx in range(3):
+        cache.set("model", {f"text-{idx}": [float(idx)] * 4})
+    assert cache.get("model", ["text-0"]) == {"text-0": [0.0] * 4}
+
+    # text-1 is now the least recently used entry
+    cache.set("model", {"text-3": [3.0] * 4})
+    assert set(cache.get("model", ["text-0", "text-1", "text-2", "text-3"])) == {
+        "text-0",
+        "text-2",
+        "text-3",
+    }
+    assert cache.stats()["size"] <= 3 * 4 * 4
+
+
+def test_tei_endpoint_embeddings(tei_server):
+    tei_server.delay = 0.2
+    texts = [f"text {'x' * idx}" for idx in range(16)]
+    model = TeiEndpointEmbeddings(
+        endpoint_url=f"{tei_server.url}/embed", batch_size=2, max_concurrency=4
+    )
+
+    start = time.perf_counter()
+    output = model(texts)
+    elapsed = time.perf_counter() - start
+
+    # every text is sent once, in order, without merging the leftover into a batch
+    assert [doc.text for doc in output] == texts
+    assert [doc.embedding[0] for doc in output] == [float(len(t)) for t in texts]
+    assert tei_server.batch_sizes == [2] * 8
+    # 8 requests of 0.2s, 4 at a time
+    assert tei_server.max_in_flight == 4
+    assert elapsed < 8 * 0.2 * 0.75
+
+    tei_server.batch_sizes.clear()
+    assert len(model(texts[:5])) == 5
+    assert sorted(tei_server.batch_sizes) == [1, 2, 2]
+
+
+def test_tei_endpoint_embeddings_async_backpressure(tei_server):
+    tei_server.n_overloaded = 2
+    texts = [f"text {idx}" for idx in range(7)]
+    model = TeiEndpointEmbeddings(
+        endpoint_url=f"{tei_server.url}/embed", batch_size=3, max_concurrency=2
+    )
+
+    output = asyncio.run(model.ainvoke(texts))
+
+    assert [doc.text for doc in output] == texts
+    assert sorted(tei_server.batch_sizes) == [1, 3, 3]
+    # the overloaded answers are retried
+    assert tei_server.n_requests == 5
+    assert tei_server.max_in_flight <= 2
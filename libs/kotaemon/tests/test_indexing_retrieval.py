@@ -5,9 +5,10 @@ from unittest.mock import patch
 
 from openai.types.create_embedding_response import CreateEmbeddingResponse
 
-from kotaemon.base import Document
+from kotaemon.base import Document, RetrievedDocument
 from kotaemon.embeddings import AzureOpenAIEmbeddings
 from kotaemon.indices import VectorIndexing, VectorRetrieval
+from kotaemon.indices.rankings import reciprocal_rank_fusion, weighted_score_fusion
 from kotaemon.storages import ChromaVectorStore, InMemoryDocumentStore
 
 with open(Path(__file__).parent / "resources" / "embedding_openai.json") as f:
@@ -65,3 +66,65 @@ def test_retrieving(tmp_path):
 
     assert len(output) == 1, "Expect 1 results"
     assert output == output1, "Expect identical results"
+
+
+def _ranking(ids: list[str], scores: list[float]) -> list[RetrievedDocument]:
+    return [
+        RetrievedDocument(text=doc_id, id_=doc_id, score=score)
+        for doc_id, score in zip(ids, scores)
+    ]
+
+
+def test_reciprocal_rank_fusion():
+    vector = _ranking(["a", "b", "c"], [0.9, 0.8, 0.7])
+    text = _ranking(["c", "d", "a"], [-1.0, -1.0, -1.0])
+
+    output = reciprocal_rank_fusion([vector, text])
+    assert [doc.doc_id for doc in output] == ["a", "c", "b", "d"]
+    # a document retrieved by both keeps its vector search score
+    assert output[0].score == 0.9
+    assert output[0].metadata["fusion_score"] == 1 / 61 + 1 / 63
+
+    output = reciprocal_rank_fusion([vector, text], weights=[0.1, 0.9])
+    assert [doc.doc_id for doc in output] == ["c", "a", "d", "b"]
+
+
+def test_weighted_score_fusion():
+    # distances: the lower the score, the more relevant the document
+    vector = _ranking(["a", "b", "c"], [0.1, 0.2, 0.5])
+    text = _ranking(["b", "d"], [-1.0, -1.0])
+
+    output = weighted_score_fusion([vector, text])
+    assert [doc.doc_id for doc in output] == ["b", "a", "c", "d"]
+    assert output[0].metadata["fusion_score"] == 1.75
+
+
+@patch(
+    "openai.resources.embeddings.Embeddings.create",
+    side_effect=lambda *args, **kwargs: openai_embedding,
+)
+def test_hybrid_retrieving_deduplicates(openai_embedding_call, tmp_path):
+    db = ChromaVectorStore(path=str(tmp_path))
+    doc_store = InMemoryDocumentStore()
+    embedding = AzureOpenAIEmbeddings(
+        azure_deployment="text-embedding-ada-002",
+        azure_endpoint="https://test.openai.azure.com/",
+        api_key="some-key",
+        api_version="version",
+    )
+    index_pipeline = VectorIndexing(
+        vector_store=db, embedding=embedding, doc_store=doc_store
+    )
+    index_pipeline(text=Document(text="Hello world", id_="hello"))
+    index_pipeline(text=Document(text="Goodbye moon", id_="goodbye"))
+
+    for fusion_mode in ["rrf", "weighted"]:
+        retrieval_pipeline = VectorRetrieval(
+            vector_store=db,
+            doc_store=doc_store,
+            embedding=embedding,
+            retrieval_mode="hybrid",
+            fusion_mode=fusion_mode,
+        )
+        output = retrieval_pipeline(text="Hello world")
+        assert sorted(doc.doc_id for doc in output) == ["goodbye", "hello"]
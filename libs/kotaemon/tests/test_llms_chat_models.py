@@ -1,10 +1,11 @@
+import asyncio
 from pathlib import Path
 from unittest.mock import patch
 
 import pytest
 
 from kotaemon.base.schema import AIMessage, HumanMessage, LLMInterface, SystemMessage
-from kotaemon.llms import AzureChatOpenAI, LlamaCppChat
+from kotaemon.llms import AzureChatOpenAI, ChatOpenAI, LlamaCppChat
 
 try:
     pass
@@ -12,6 +13,7 @@ except ImportError:
     pass
 
 from openai.types.chat.chat_completion import ChatCompletion
+from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 
 from .conftest import skip_llama_cpp_not_installed
 
@@ -73,6 +75,78 @@ def test_azureopenai_model(openai_completion):
     openai_completion.assert_called()
 
 
+def _openai_chat_completion_chunk(content):
+    return ChatCompletionChunk.parse_obj(
+        {
+            "id": "chatcmpl-7qyuw6Q1CFCpcKsMdFkmUPUa7JP2x",
+            "object": "chat.completion.chunk",
+            "created": 1692338378,
+            "model": "gpt-35-turbo",
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": content},
+                    "finish_reason": None,
+                    "logprobs": {
+                        "content": [
+                            {"token": content, "logprob": -0.5, "top_logprobs": []}
+                        ]
+                    },
+                }
+            ],
+        }
+    )
+
+
+async def _openai_chat_completion_stream(*args, **kwargs):
+    async def chunks():
+        for content in ["Hello!", " How can I", " assist you?"]:
+            yield _openai_chat_completion_chunk(content)
+
+    return chunks()
+
+
+@patch(
+    "openai.resources.chat.completions.AsyncCompletions.create",
+    side_effect=_openai_chat_completion_stream,
+)
+def test_openai_model_astream(openai_completion):
+    model = ChatOpenAI(api_key="dummy", base_url="http://localhost:8000/v1")
+
+    async def collect():
+        return [output async for output in model.astream("hello world")]
+
+    outputs = asyncio.run(collect())
+    openai_completion.assert_called_once()
+    assert openai_completion.call_args.kwargs["stream"] is True
+    assert "".join(output.text for output in outputs) == "Hello! How can I assist you?"
+    assert all(output.logprobs == [-0.5] for output in outputs)
+
+
+def test_openai_clients_are_shared():
+    params = {"api_key": "dummy", "base_url": "http://localhost:8000/v1"}
+    model = ChatOpenAI(model="gpt-4o", **params)
+    client = model.prepare_client()
+    assert ChatOpenAI(model="gpt-4o-mini", **params).prepare_client() is client
+
+    # another credential gets its own client, on the same connection pool
+    other = ChatOpenAI(model="gpt-4o", api_key="other", base_url=params["base_url"])
+    assert other.prepare_client() is not client
+    assert other.prepare_client()._client is client._client
+
+    async def prepare_async_clients():
+        return (
+            model.prepare_client(async_version=True),
+            model.prepare_client(async_version=True),
+        )
+
+    first, second = asyncio.run(prepare_async_clients())
+    assert first is second
+    # the async connection pool is closed with its event loop
+    assert first._client.is_closed
+    assert asyncio.run(prepare_async_clients())[0] is not first
+
+
 @skip_llama_cpp_not_installed
 def test_llamacpp_chat():
     from llama_cpp import Llama
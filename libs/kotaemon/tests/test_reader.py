@@ -1,3 +1,7 @@
+import json
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from unittest.mock import patch
 
@@ -13,6 +17,8 @@ from kotaemon.loaders import (
     MhtmlReader,
     UnstructuredReader,
 )
+from kotaemon.loaders.utils.adobe import generate_figure_captions
+from kotaemon.loaders.utils.page_raster import PageRasterCache
 
 from .conftest import skip_when_unstructured_pdf_not_installed
 
@@ -93,3 +99,70 @@ def test_azureai_document_intelligence_reader(mock_client):
 
     assert len(docs) == 1
     mock_client.assert_called_once()
+
+
+def test_page_raster_cache(tmp_path):
+    file_path = Path(__file__).parent / "resources" / "dummy.pdf"
+    cache = PageRasterCache(max_pages=2, max_documents=1)
+
+    page = cache.get(file_path, 0, dpi=100)
+    assert cache.get(file_path, 0, dpi=100) is page
+    thumbnail = cache.get(file_path, 0, dpi=50)
+    assert thumbnail.size == (round(page.width / 2), round(page.height / 2))
+    assert len(cache._pdfs) == 1
+
+    cache.forget(file_path)
+    assert not cache._pages and not cache._pdfs
+    assert cache.get(file_path, 0, dpi=100) is not page
+
+    # the least recently used document is closed
+    copy_path = tmp_path / "copy.pdf"
+    shutil.copy(file_path, copy_path)
+    cache.get(copy_path, 0, dpi=100)
+    assert list(cache._pdfs) == [str(copy_path.resolve())]
+
+
+def test_generate_figure_captions_stub_vlm():
+    received = []
+
+    class StubVLM(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            figure = payload["messages"][0]["content"][1]["image_url"]["url"]
+            received.append(figure)
+            # fail the first request of the flaky figure, to be retried
+            if figure.endswith("flaky") and received.count(figure) == 1:
+                self.send_response(500)
+                self.end_headers()
+                return
+
+            body = json.dumps(
+                {"choices": [{"message": {"content": f"caption of {figure}"}}]}
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubVLM)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    figures = ["data:stub-a", "data:stub-b", "data:stub-a", "data:stub-flaky"]
+
+    try:
+        captions = generate_figure_captions(endpoint, figures + ["data:stub-c"], 4)
+        assert captions == [f"caption of {figure}" for figure in figures] + [""]
+        # the duplicated figure is captioned once, the flaky one is retried
+        assert sorted(received) == sorted(
+            ["data:stub-a", "data:stub-b", "data:stub-flaky", "data:stub-flaky"]
+        )
+
+        # the captions are cached by image
+        assert generate_figure_captions(endpoint, figures, 4) == captions[:4]
+        assert len(received) == 4
+    finally:
+        server.shutdown()
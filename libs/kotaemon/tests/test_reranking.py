@@ -4,11 +4,14 @@ import pytest
 from openai.types.chat.chat_completion import ChatCompletion
 
 from kotaemon.base import Document
-from kotaemon.indices.rankings import LLMReranking
+from kotaemon.indices.rankings import LLMReranking, LLMTrulensScoring
+from kotaemon.indices.rankings.llm_trulens import score_cache
 from kotaemon.llms import AzureChatOpenAI
+from kotaemon.rerankings import TeiFastReranking
 
-_openai_chat_completion_responses = [
-    ChatCompletion.parse_obj(
+
+def _chat_completion(text: str) -> ChatCompletion:
+    return ChatCompletion.parse_obj(
         {
             "id": "chatcmpl-7qyuw6Q1CFCpcKsMdFkmUPUa7JP2x",
             "object": "chat.completion",
@@ -31,6 +34,10 @@ _openai_chat_completion_responses = [
             "usage": {"completion_tokens": 9, "prompt_tokens": 10, "total_tokens": 19},
         }
     )
+
+
+_openai_chat_completion_responses = [
+    _chat_completion(text)
     for text in [
         "YES",
         "NO",
@@ -61,3 +68,70 @@ def test_reranking(openai_completion, llm):
     rerank_docs = reranker(documents, query=query)
 
     assert len(rerank_docs) == 2
+
+
+def test_tei_fast_reranking(tei_server):
+    tei_server.n_overloaded = 1
+    documents = [Document(text="x" * length) for length in [3, 9, 1, 7, 5]]
+    reranker = TeiFastReranking(
+        endpoint_url=f"{tei_server.url}/rerank", batch_size=2, is_truncated=False
+    )
+
+    output = reranker(documents=documents, query="test query")
+
+    assert [len(doc.text) for doc in output] == [9, 7, 5, 3, 1]
+    assert sorted(tei_server.batch_sizes) == [1, 2, 2]
+
+
+def test_llm_trulens_scoring_batches(llm):
+    score_cache.clear()
+    documents = [Document(text=f"test {idx}") for idx in range(5)]
+    responses = [
+        _chat_completion('{"1": 3, "2": 10, "3": 0}'),
+        _chat_completion('Sure! Here are the scores: {"1": 7, "2": 5}'),
+    ]
+    scorer = LLMTrulensScoring(llm=llm, batch_size=3, concurrent=False)
+
+    with patch(
+        "openai.resources.chat.completions.Completions.create",
+        side_effect=responses,
+    ) as create:
+        output = scorer(documents, query="test query")
+        assert create.call_count == 2
+
+        # the scores are cached by (query, doc_id, model)
+        scorer(documents, query="test query")
+        assert create.call_count == 2
+
+    assert [doc.text for doc in output] == [
+        "test 1",
+        "test 3",
+        "test 4",
+        "test 0",
+        "test 2",
+    ]
+    assert [doc.metadata["llm_trulens_score"] for doc in output] == [
+        1.0,
+        0.7,
+        0.5,
+        0.3,
+        0.0,
+    ]
+
+
+def test_llm_trulens_scoring_fallback(llm):
+    score_cache.clear()
+    documents = [Document(text=f"test {idx}") for idx in range(2)]
+    responses = [_chat_completion(text) for text in ['{"1": 3}', "8", "4"]]
+    scorer = LLMTrulensScoring(llm=llm, batch_size=2)
+
+    with patch(
+        "openai.resources.chat.completions.Completions.create",
+        side_effect=responses,
+    ) as create:
+        output = scorer(documents, query="test query")
+
+    # the second rating is missing, both documents are scored one by one
+    assert create.call_count == 3
+    assert [doc.text for doc in output] == ["test 0", "test 1"]
+    assert [doc.metadata["llm_trulens_score"] for doc in output] == [0.8, 0.4]
@@ -1,7 +1,9 @@
+import pickle
+
 from llama_index.core.schema import NodeRelationship
 
 from kotaemon.base import Document
-from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.indices.splitters import TokenSplitter, TokenTruncator
 
 source1 = Document(
     content="The City Hall and Raffles Place MRT stations are paired cross-platform "
@@ -53,3 +55,45 @@ def test_split_token():
     )
     assert chunks[1].relationships[NodeRelationship.NEXT].node_id == chunks[2].doc_id
     assert chunks[-1].relationships[NodeRelationship.SOURCE].node_id == source2.doc_id
+
+
+def test_split_token_pickle():
+    """Test that the splitter survives pickling, e.g. for a process pool"""
+    splitter = TokenSplitter(chunk_size=30, chunk_overlap=10)
+    restored = pickle.loads(pickle.dumps(splitter))
+
+    assert isinstance(restored, TokenSplitter)
+    assert restored.chunk_size == 30
+    assert [c.text for c in restored([source1])] == [
+        c.text for c in splitter([source1])
+    ]
+
+
+def test_truncate_token():
+    """Test that truncation keeps the first chunk that the token splitter makes"""
+    truncator = TokenTruncator(max_tokens=30)
+    splitter = TokenSplitter(chunk_size=30, chunk_overlap=0)
+    text = source1.text * 20
+
+    truncated = truncator.truncate(text)
+    assert truncator.count_tokens(truncated) <= 30
+    assert text.startswith(truncated)
+    assert len(truncated) >= len(splitter([Document(text=text)])[0].text) - 20
+
+    assert truncator.truncate(source2.text, 10_000) == source2.text
+    assert truncator([source2])[0].text == truncator.truncate(source2.text)
+
+
+def test_truncate_many_token():
+    """Test that the budget is shared fairly between the texts"""
+    truncator = TokenTruncator()
+    short = "The pink cockatoo is a medium-sized cockatoo."
+    n_short = truncator.count_tokens(short)
+
+    truncated = truncator.truncate_many([source1.text, short, source2.text], 200)
+    assert truncated[1] == short
+    counts = [truncator.count_tokens(text) for text in truncated]
+    assert sum(counts) <= 200
+    # the long texts share what the short one leaves
+    for count in (counts[0], counts[2]):
+        assert (200 - n_short) // 2 - 10 <= count <= (200 - n_short) // 2
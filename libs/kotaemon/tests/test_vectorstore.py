@@ -2,12 +2,18 @@ import json
 import os
 
 import pytest
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
 
 from kotaemon.base import DocumentWithEmbedding
 from kotaemon.storages import (
     ChromaVectorStore,
     InMemoryVectorStore,
     MilvusVectorStore,
+    NumpyVectorStore,
     QdrantVectorStore,
     SimpleFileVectorStore,
 )
@@ -159,6 +165,93 @@ class TestSimpleFileVectorStore:
         os.remove(tmp_path / collection_name)
 
 
+class TestNumpyVectorStore:
+    def test_add_query(self, tmp_path):
+        embeddings = [[1.0, 0.0, 0.0], [0.8, 0.6, 0.0], [0.0, 1.0, 0.0]]
+        metadatas = [{"file_id": "a"}, {"file_id": "b"}, {"file_id": "a"}]
+        ids = ["1", "2", "3"]
+        db = NumpyVectorStore(path=tmp_path, collection_name="test")
+        db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+        assert db.count() == 3
+
+        _, scores, out_ids = db.query(embedding=[1.0, 0.0, 0.0], top_k=2)
+        assert out_ids == ["1", "2"]
+        assert scores == pytest.approx([1.0, 0.8])
+
+        _, _, out_ids = db.query(embedding=[1.0, 0.0, 0.0], top_k=3, ids=["2", "3"])
+        assert out_ids == ["2", "3"]
+
+        filters = MetadataFilters(
+            filters=[
+                MetadataFilter(key="file_id", value=["a"], operator=FilterOperator.IN)
+            ]
+        )
+        _, _, out_ids = db.query(embedding=[1.0, 0.0, 0.0], top_k=3, filters=filters)
+        assert out_ids == ["1", "3"]
+
+    def test_save_load_delete(self, tmp_path):
+        embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
+        metadatas = [{"a": 1, "b": 2}, {"a": 3, "b": 4}, {"a": 5, "b": 6}]
+        ids = ["1", "2", "3"]
+        db = NumpyVectorStore(path=tmp_path, collection_name="test")
+        db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+        db.delete(["3"])
+        db.add(embeddings=[[0.2, 0.2, 0.2]], ids=["1"])
+
+        db2 = NumpyVectorStore(path=tmp_path, collection_name="test")
+        assert db2.count() == 2
+        assert db2.get("1") == pytest.approx([0.2, 0.2, 0.2])
+        assert db2.get("2") == pytest.approx([0.4, 0.5, 0.6])
+        _, _, out_ids = db2.query(embedding=[0.7, 0.8, 0.9], top_k=3)
+        assert set(out_ids) == {"1", "2"}
+
+        # deleting more than half of the rows compacts the store files
+        db2.delete(["1"])
+        assert db2._n_rows == 1
+        assert NumpyVectorStore(path=tmp_path, collection_name="test").count() == 1
+
+        db2.drop()
+        assert NumpyVectorStore(path=tmp_path, collection_name="test").count() == 0
+
+    def test_failed_log_write(self, tmp_path, monkeypatch):
+        db = NumpyVectorStore(path=tmp_path, collection_name="test")
+        db.add(embeddings=[[1.0, 0.0]], ids=["1"])
+
+        def fail(records):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(db, "_write_log", fail)
+        with pytest.raises(OSError):
+            db.add(embeddings=[[0.0, 1.0]], ids=["2"])
+        monkeypatch.undo()
+
+        # the vectors of the failed add are rolled back
+        db.add(embeddings=[[0.6, 0.8]], ids=["3"])
+        assert db.get("3") == pytest.approx([0.6, 0.8])
+        db2 = NumpyVectorStore(path=tmp_path, collection_name="test")
+        assert db2.count() == 2
+        assert db2.get("1") == pytest.approx([1.0, 0.0])
+        assert db2.get("3") == pytest.approx([0.6, 0.8])
+
+    def test_torn_log_line(self, tmp_path):
+        db = NumpyVectorStore(path=tmp_path, collection_name="test")
+        db.add(embeddings=[[1.0, 0.0]], ids=["1"])
+        # an add interrupted after its vectors and part of its log record
+        with (tmp_path / "test" / "vectors.f32").open("ab") as f:
+            f.write(b"\0" * 8)
+        with (tmp_path / "test" / "index.jsonl").open("a") as f:
+            f.write('{"op": "add", "id": "2", "meta')
+
+        db2 = NumpyVectorStore(path=tmp_path, collection_name="test")
+        assert db2.count() == 1
+        db2.add(embeddings=[[0.6, 0.8]], ids=["3"])
+
+        db3 = NumpyVectorStore(path=tmp_path, collection_name="test")
+        assert db3.count() == 2
+        assert db3.get("1") == pytest.approx([1.0, 0.0])
+        assert db3.get("3") == pytest.approx([0.6, 0.8])
+
+
 class TestMilvusVectorStore:
     def test_add(self, tmp_path):
         """Test that the DB add correctly"""
@@ -5,10 +5,21 @@ from sqlalchemy.orm import Session
 from theflow.settings import settings as flowsettings
 from theflow.utils.modules import deserialize
 
+from kotaemon.embeddings import CachedEmbeddings, DiskEmbeddingCache
 from kotaemon.embeddings.base import BaseEmbeddings
 
 from .db import EmbeddingTable, engine
 
+if getattr(flowsettings, "KH_EMBEDDING_CACHE", False):
+    embedding_cache: Optional[DiskEmbeddingCache] = DiskEmbeddingCache(
+        path=flowsettings.KH_EMBEDDING_CACHE_PATH,
+        max_size=getattr(flowsettings, "KH_EMBEDDING_CACHE_SIZE_MB", 1024)
+        * 1024
+        * 1024,
+    )
+else:
+    embedding_cache = None
+
 
 class EmbeddingManager:
     """Represent a pool of models"""
@@ -42,7 +53,10 @@ class EmbeddingManager:
             items = sess.execute(stmt)
 
             for (item,) in items:
-                self._models[item.name] = deserialize(item.spec, safe=False)
+                model = deserialize(item.spec, safe=False)
+                if embedding_cache is not None:
+                    model = CachedEmbeddings(embedding=model, cache=embedding_cache)
+                self._models[item.name] = model
                 self._info[item.name] = {
                     "name": item.name,
                     "spec": item.spec,
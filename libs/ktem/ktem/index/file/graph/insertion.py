@@ -0,0 +1,289 @@
+"""Checkpointed, concurrent insertion of documents into nano-graphrag and LightRAG"""
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from functools import wraps
+from hashlib import sha256
+from pathlib import Path
+from typing import Generator, Optional
+
+from ktem.db.models import engine
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from theflow.settings import settings
+
+from kotaemon.base import Document
+
+# number of combined documents inserted together, the build is checkpointed after
+# each of these rounds
+GRAPH_INSERT_ROUND_SIZE = getattr(settings, "KH_GRAPH_INSERT_ROUND_SIZE", 8)
+# maximum number of concurrent LLM calls while inserting into a graph
+GRAPH_LLM_CONCURRENCY = getattr(settings, "KH_GRAPH_LLM_CONCURRENCY", 8)
+# interval between two progress messages during a round, in seconds
+PROGRESS_INTERVAL = 10.0
+# interval between two saves of the LLM responses during a round, in seconds
+CACHE_SAVE_INTERVAL = 60.0
+
+CHECKPOINT_FILE = "insert_checkpoint.json"
+
+# the round running in each working dir. The round of a cancelled build is
+# cancelled too, but the graph library still saves its storage on exit
+_running_rounds: dict[str, Future] = {}
+_running_rounds_lock = threading.Lock()
+
+
+def combine_docs(docs: list[Document], batch_size: int) -> list[str]:
+    """Join the non-empty text documents by batches of `batch_size`"""
+    texts = [
+        doc.text
+        for doc in docs
+        if doc.metadata.get("type", "text") == "text" and len(doc.text.strip()) > 0
+    ]
+    return [
+        "\n".join(texts[start : start + batch_size])
+        for start in range(0, len(texts), batch_size)
+    ]
+
+
+def hash_texts(texts: list[str]) -> str:
+    hasher = sha256()
+    for text in texts:
+        hasher.update(sha256(text.encode()).digest())
+    return hasher.hexdigest()
+
+
+def read_checkpoint(working_dir: Path) -> dict:
+    try:
+        with open(working_dir / CHECKPOINT_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_checkpoint(working_dir: Path, checkpoint: dict):
+    path = working_dir / CHECKPOINT_FILE
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def find_resumable_graph_id(
+    Index, file_ids: list[Optional[str]], texts: list[str], prepare_path
+) -> Optional[str]:
+    """Find the graph of exactly these files whose build of the same texts was
+    interrupted
+
+    Args:
+        Index: the SQLAlchemy Index table
+        file_ids: the ids of the indexed files
+        texts: the combined documents to insert
+        prepare_path: get the (root path, working dir) of a graph_id
+    """
+    file_id_set = {file_id for file_id in file_ids if file_id}
+    if not file_id_set:
+        return None
+
+    docs_hash = hash_texts(texts)
+    with Session(engine) as session:
+        graph_ids = set(
+            session.scalars(
+                select(Index.target_id).where(
+                    Index.relation_type == "graph",
+                    Index.source_id.in_(list(file_id_set)),
+                )
+            )
+        )
+        sources: dict[str, set[str]] = {graph_id: set() for graph_id in graph_ids}
+        for source_id, target_id in session.execute(
+            select(Index.source_id, Index.target_id).where(
+                Index.relation_type == "graph", Index.target_id.in_(list(graph_ids))
+            )
+        ):
+            sources[target_id].add(source_id)
+
+    for graph_id, source_ids in sources.items():
+        if source_ids != file_id_set:
+            continue
+        checkpoint = read_checkpoint(prepare_path(graph_id)[1])
+        if checkpoint.get("docs_hash") == docs_hash and not checkpoint.get("finished"):
+            return graph_id
+
+    return None
+
+
+def wait_for_running_round(working_dir: Path):
+    """Wait until the round of a cancelled build of the working dir has exited"""
+    with _running_rounds_lock:
+        future = _running_rounds.get(str(working_dir))
+    if future is not None:
+        wait([future])
+
+
+def _forget_round(key: str, future: Future):
+    with _running_rounds_lock:
+        if _running_rounds.get(key) is future:
+            del _running_rounds[key]
+
+
+class InsertionRound:
+    """A round of insertion, run in its own event loop so that it can be cancelled
+    from another thread"""
+
+    def __init__(self, graphrag_func, batch: list[str]):
+        self.graphrag_func = graphrag_func
+        self.batch = batch
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.current_task()
+        await self.graphrag_func.ainsert(self.batch)
+
+    def run(self):
+        asyncio.run(self._run())
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._loop is not None and self._task is not None:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+
+
+def prepare_insertion(working_dir: Path, texts: list[str]) -> dict:
+    """Get the checkpoint of the build of the texts in the working dir
+
+    An interrupted build of the same texts is resumed, otherwise the previous data
+    of the working dir are removed. The round of a cancelled build still running in
+    the working dir is waited for first, so that it does not write into the new
+    build.
+    """
+    wait_for_running_round(working_dir)
+    docs_hash = hash_texts(texts)
+    checkpoint = read_checkpoint(working_dir)
+    if checkpoint.get("docs_hash") == docs_hash and not checkpoint.get("finished"):
+        return checkpoint
+
+    # remove all .json files in the working dir (previous cache)
+    for json_file in glob.glob(f"{working_dir}/*.json"):
+        os.remove(json_file)
+    checkpoint = {"docs_hash": docs_hash, "inserted": 0, "finished": False}
+    write_checkpoint(working_dir, checkpoint)
+    return checkpoint
+
+
+def insert_with_checkpoints(
+    graphrag_func,
+    texts: list[str],
+    working_dir: Path,
+    checkpoint: dict,
+    llm_func_attr: str,
+) -> Generator[Document, None, None]:
+    """Insert the texts round by round, checkpointing after each round
+
+    The chunks of a round are extracted concurrently by the graph library, the LLM
+    responses are cached in the working dir so that a failed round does not call
+    the LLM again for the chunks it already extracted.
+
+    The checkpoint is only moved after a round succeeds. The graph library saves
+    its storage even when a round fails or is cancelled, so the storage may hold
+    part of the round, and the resumed build inserts the whole round again. This is
+    not rolled back: nano-graphrag and LightRAG skip the documents and chunks
+    already stored, by the hash of their content, and merge the entities and
+    relations extracted again with the stored ones.
+
+    Args:
+        graphrag_func: the nano-graphrag GraphRAG or the LightRAG instance
+        texts: the combined documents to insert
+        working_dir: the working dir of the graph
+        checkpoint: the checkpoint returned by `prepare_insertion`
+        llm_func_attr: the attribute of the LLM function of the instance, to count
+            the LLM calls
+    """
+    n_calls = 0
+    last_save = time.monotonic()
+    llm_func = getattr(graphrag_func, llm_func_attr)
+
+    @wraps(llm_func)
+    async def counted_llm_func(*args, **kwargs):
+        nonlocal n_calls, last_save
+        output = await llm_func(*args, **kwargs)
+        n_calls += 1
+
+        # the LLM responses are otherwise only saved at the end of the round
+        cache = getattr(graphrag_func, "llm_response_cache", None)
+        if cache is not None and time.monotonic() - last_save > CACHE_SAVE_INTERVAL:
+            last_save = time.monotonic()
+            await cache.index_done_callback()
+        return output
+
+    setattr(graphrag_func, llm_func_attr, counted_llm_func)
+
+    total = len(texts)
+    inserted = checkpoint["inserted"]
+    if inserted:
+        yield Document(
+            channel="debug",
+            text=f"[GraphRAG] Resuming from {inserted} / {total} documents.",
+        )
+    else:
+        yield Document(
+            channel="debug",
+            text=f"[GraphRAG] Indexed {inserted} / {total} documents.",
+        )
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    insertion_round: Optional[InsertionRound] = None
+    try:
+        while inserted < total:
+            batch = texts[inserted : inserted + GRAPH_INSERT_ROUND_SIZE]
+            insertion_round = InsertionRound(graphrag_func, batch)
+            future = executor.submit(insertion_round.run)
+            with _running_rounds_lock:
+                _running_rounds[str(working_dir)] = future
+            future.add_done_callback(
+                lambda future: _forget_round(str(working_dir), future)
+            )
+            while True:
+                try:
+                    future.result(timeout=PROGRESS_INTERVAL)
+                    break
+                except FutureTimeoutError:
+                    yield Document(
+                        channel="debug",
+                        text=(
+                            f"[GraphRAG] Indexing documents {inserted + 1}-"
+                            f"{inserted + len(batch)} / {total}, "
+                            f"{n_calls} LLM calls done..."
+                        ),
+                    )
+
+            insertion_round = None
+            inserted += len(batch)
+            checkpoint["inserted"] = inserted
+            write_checkpoint(working_dir, checkpoint)
+            yield Document(
+                channel="debug",
+                text=f"[GraphRAG] Indexed {inserted} / {total} documents.",
+            )
+    finally:
+        # do not wait for the running round if the indexing is cancelled, a new
+        # build of the working dir waits for it in `prepare_insertion`
+        if insertion_round is not None:
+            insertion_round.cancel()
+        executor.shutdown(wait=False)
+
+    checkpoint["finished"] = True
+    write_checkpoint(working_dir, checkpoint)
@@ -1,7 +1,5 @@
 import asyncio
-import glob
 import logging
-import os
 import re
 from pathlib import Path
 from typing import Generator
@@ -24,6 +22,13 @@ from kotaemon.base import Document, Param, RetrievedDocument
 from kotaemon.base.schema import AIMessage, HumanMessage, SystemMessage
 
 from ..pipelines import BaseFileIndexRetriever
+from .insertion import (
+    GRAPH_LLM_CONCURRENCY,
+    combine_docs,
+    find_resumable_graph_id,
+    insert_with_checkpoints,
+    prepare_insertion,
+)
 from .pipelines import GraphRAGIndexingPipeline
 from .visualize import create_knowledge_graph, visualize_graph
 
@@ -233,6 +238,7 @@ def build_graphrag(working_dir, llm_func, embedding_func):
     graphrag_func = LightRAG(
         working_dir=working_dir,
         llm_model_func=llm_func,
+        llm_model_max_async=GRAPH_LLM_CONCURRENCY,
         embedding_func=embedding_func,
     )
     return graphrag_func
@@ -264,6 +270,16 @@ class LightRAGIndexingPipeline(GraphRAGIndexingPipeline):
             print(e)
             return {}
 
+    def get_resumable_graph_id(
+        self, file_ids: list[str | None], docs: list[Document]
+    ) -> str | None:
+        return find_resumable_graph_id(
+            self.Index,
+            file_ids,
+            combine_docs(docs, INDEX_BATCHSIZE),
+            prepare_graph_index_path,
+        )
+
     def call_graphrag_index(self, graph_id: str, docs: list[Document]):
         from lightrag.prompt import PROMPTS
 
@@ -286,21 +302,15 @@ class LightRAGIndexingPipeline(GraphRAGIndexingPipeline):
             f"and Embedding {default_embedding}..."
         )
 
-        all_docs = [
-            doc.text
-            for doc in docs
-            if doc.metadata.get("type", "text") == "text" and len(doc.text.strip()) > 0
-        ]
+        texts = combine_docs(docs, INDEX_BATCHSIZE)
 
         yield Document(
             channel="debug",
             text="[GraphRAG] Creating index... This can take a long time.",
         )
 
-        # remove all .json files in the input_path directory (previous cache)
-        json_files = glob.glob(f"{input_path}/*.json")
-        for json_file in json_files:
-            os.remove(json_file)
+        # resume the interrupted build of the same documents, if any
+        checkpoint = prepare_insertion(input_path, texts)
 
         # indexing
         graphrag_func = build_graphrag(
@@ -310,27 +320,10 @@ class LightRAGIndexingPipeline(GraphRAGIndexingPipeline):
         )
         # output must be contain: Loaded graph from
         # ..input/graph_chunk_entity_relation.graphml with xxx nodes, xxx edges
-        total_docs = len(all_docs)
-        process_doc_count = 0
-        yield Document(
-            channel="debug",
-            text=f"[GraphRAG] Indexed {process_doc_count} / {total_docs} documents.",
+        yield from insert_with_checkpoints(
+            graphrag_func, texts, input_path, checkpoint, "llm_model_func"
         )
 
-        for doc_id in range(0, len(all_docs), INDEX_BATCHSIZE):
-            cur_docs = all_docs[doc_id : doc_id + INDEX_BATCHSIZE]
-            combined_doc = "\n".join(cur_docs)
-
-            graphrag_func.insert(combined_doc)
-            process_doc_count += len(cur_docs)
-            yield Document(
-                channel="debug",
-                text=(
-                    f"[GraphRAG] Indexed {process_doc_count} "
-                    f"/ {total_docs} documents."
-                ),
-            )
-
         yield Document(
             channel="debug",
             text="[GraphRAG] Indexing finished.",
@@ -1,8 +1,10 @@
 import asyncio
-import glob
+import json
 import logging
 import os
 import re
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import Generator
 
@@ -24,6 +26,13 @@ from kotaemon.base import Document, Param, RetrievedDocument
 from kotaemon.base.schema import AIMessage, HumanMessage, SystemMessage
 
 from ..pipelines import BaseFileIndexRetriever
+from .insertion import (
+    GRAPH_LLM_CONCURRENCY,
+    combine_docs,
+    find_resumable_graph_id,
+    insert_with_checkpoints,
+    prepare_insertion,
+)
 from .pipelines import GraphRAGIndexingPipeline
 from .visualize import create_knowledge_graph, visualize_graph
 
@@ -53,6 +62,13 @@ filestorage_path = Path(settings.KH_FILESTORAGE_PATH) / "nano_graphrag"
 filestorage_path.mkdir(parents=True, exist_ok=True)
 
 INDEX_BATCHSIZE = 4
+GRAPHRAG_CACHE_SIZE = getattr(settings, "KH_GRAPHRAG_CACHE_SIZE", 8)
+
+# embedding dimension of each embedding model, keyed by its model key
+_embedding_dims: dict[str, int] = {}
+# loaded GraphRAG instances, keyed by graph_id and model keys
+_graphrag_cache: OrderedDict[tuple, tuple[tuple, "GraphRAG"]] = OrderedDict()
+_graphrag_lock = threading.Lock()
 
 
 def get_llm_func(model):
@@ -115,16 +131,32 @@ def get_embedding_func(model):
     return embedding_func
 
 
+def get_model_key(manager, name: str) -> str:
+    """Identify a model of the manager by its name and its spec"""
+    spec = manager.info().get(name, {}).get("spec")
+    return json.dumps({"name": name, "spec": spec}, sort_keys=True, default=str)
+
+
+def get_embedding_dim(model, model_key: str) -> int:
+    """Get the embedding dimension of the model, only embedding once per model"""
+    if model_key not in _embedding_dims:
+        _embedding_dims[model_key] = len(model(["Hi"])[0].embedding)
+        print("GraphRAG embedding dim", _embedding_dims[model_key])
+    return _embedding_dims[model_key]
+
+
 def get_default_models_wrapper():
     # setup model functions
     default_embedding = embeddings.get_default()
-    default_embedding_dim = len(default_embedding(["Hi"])[0].embedding)
+    default_embedding_dim = get_embedding_dim(
+        default_embedding,
+        get_model_key(embeddings, embeddings.get_default_name()),
+    )
     embedding_func = EmbeddingFunc(
         embedding_dim=default_embedding_dim,
         max_token_size=8192,
         func=get_embedding_func(default_embedding),
     )
-    print("GraphRAG embedding dim", default_embedding_dim)
 
     default_llm = llms.get_default()
     llm_func = get_llm_func(default_llm)
@@ -229,11 +261,70 @@ def build_graphrag(working_dir, llm_func, embedding_func):
         working_dir=working_dir,
         best_model_func=llm_func,
         cheap_model_func=llm_func,
+        best_model_max_async=GRAPH_LLM_CONCURRENCY,
+        cheap_model_max_async=GRAPH_LLM_CONCURRENCY,
         embedding_func=embedding_func,
     )
     return graphrag_func
 
 
+def _graph_signature(working_dir: Path) -> tuple:
+    """Name, size and modification time of the storage files of the graph
+
+    The LLM response cache is left out, as it is also written by the queries.
+    """
+    signature = []
+    for entry in sorted(os.scandir(working_dir), key=lambda entry: entry.name):
+        if entry.is_file() and entry.name != "kv_store_llm_response_cache.json":
+            stat = entry.stat()
+            signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def get_graphrag(graph_id: str) -> "GraphRAG":
+    """Get the GraphRAG of the graph with the default models, loaded once per process
+
+    The instance is loaded again when the storage files of the graph change on disk,
+    or when the default models change.
+    """
+    _, input_path = prepare_graph_index_path(graph_id)
+    input_path.mkdir(parents=True, exist_ok=True)
+
+    key = (
+        graph_id,
+        get_model_key(llms, llms.get_default_name()),
+        get_model_key(embeddings, embeddings.get_default_name()),
+    )
+    signature = _graph_signature(input_path)
+    with _graphrag_lock:
+        cached = _graphrag_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            _graphrag_cache.move_to_end(key)
+            return cached[1]
+
+    llm_func, embedding_func, _, _ = get_default_models_wrapper()
+    graphrag_func = build_graphrag(
+        input_path,
+        llm_func=llm_func,
+        embedding_func=embedding_func,
+    )
+
+    with _graphrag_lock:
+        _graphrag_cache[key] = (signature, graphrag_func)
+        _graphrag_cache.move_to_end(key)
+        while len(_graphrag_cache) > GRAPHRAG_CACHE_SIZE:
+            _graphrag_cache.popitem(last=False)
+
+    return graphrag_func
+
+
+def invalidate_graphrag(graph_id: str):
+    """Drop the loaded GraphRAG instances of the graph"""
+    with _graphrag_lock:
+        for key in [key for key in _graphrag_cache if key[0] == graph_id]:
+            del _graphrag_cache[key]
+
+
 class NanoGraphRAGIndexingPipeline(GraphRAGIndexingPipeline):
     """GraphRAG specific indexing pipeline"""
 
@@ -260,6 +351,16 @@ class NanoGraphRAGIndexingPipeline(GraphRAGIndexingPipeline):
             print(e)
             return {}
 
+    def get_resumable_graph_id(
+        self, file_ids: list[str | None], docs: list[Document]
+    ) -> str | None:
+        return find_resumable_graph_id(
+            self.Index,
+            file_ids,
+            combine_docs(docs, INDEX_BATCHSIZE),
+            prepare_graph_index_path,
+        )
+
     def call_graphrag_index(self, graph_id: str, docs: list[Document]):
         from nano_graphrag.prompt import PROMPTS
 
@@ -282,21 +383,15 @@ class NanoGraphRAGIndexingPipeline(GraphRAGIndexingPipeline):
             f"and Embedding {default_embedding}..."
         )
 
-        all_docs = [
-            doc.text
-            for doc in docs
-            if doc.metadata.get("type", "text") == "text" and len(doc.text.strip()) > 0
-        ]
+        texts = combine_docs(docs, INDEX_BATCHSIZE)
 
         yield Document(
             channel="debug",
             text="[GraphRAG] Creating index... This can take a long time.",
         )
 
-        # remove all .json files in the input_path directory (previous cache)
-        json_files = glob.glob(f"{input_path}/*.json")
-        for json_file in json_files:
-            os.remove(json_file)
+        # resume the interrupted build of the same documents, if any
+        checkpoint = prepare_insertion(input_path, texts)
 
         # indexing
         graphrag_func = build_graphrag(
@@ -306,26 +401,12 @@ class NanoGraphRAGIndexingPipeline(GraphRAGIndexingPipeline):
         )
         # output must be contain: Loaded graph from
         # ..input/graph_chunk_entity_relation.graphml with xxx nodes, xxx edges
-        total_docs = len(all_docs)
-        process_doc_count = 0
-        yield Document(
-            channel="debug",
-            text=f"[GraphRAG] Indexed {process_doc_count} / {total_docs} documents.",
+        yield from insert_with_checkpoints(
+            graphrag_func, texts, input_path, checkpoint, "best_model_func"
         )
-        for doc_id in range(0, len(all_docs), INDEX_BATCHSIZE):
-            cur_docs = all_docs[doc_id : doc_id + INDEX_BATCHSIZE]
-            combined_doc = "\n".join(cur_docs)
-
-            graphrag_func.insert(combined_doc)
-            process_doc_count += len(cur_docs)
-            yield Document(
-                channel="debug",
-                text=(
-                    f"[GraphRAG] Indexed {process_doc_count} "
-                    f"/ {total_docs} documents."
-                ),
-            )
 
+        # the retrievers load the rebuilt graph on their next query
+        invalidate_graphrag(graph_id)
         yield Document(
             channel="debug",
             text="[GraphRAG] Indexing finished.",
@@ -376,19 +457,11 @@ class NanoGraphRAGRetrieverPipeline(BaseFileIndexRetriever):
             graph_id = graph_id[0] if graph_id else None
             assert graph_id, f"GraphRAG index not found for file_id: {file_id}"
 
-        _, input_path = prepare_graph_index_path(graph_id)
-        input_path.mkdir(parents=True, exist_ok=True)
-
-        llm_func, embedding_func, _, _ = get_default_models_wrapper()
-        graphrag_func = build_graphrag(
-            input_path,
-            llm_func=llm_func,
-            embedding_func=embedding_func,
-        )
+        graphrag_func = get_graphrag(graph_id)
         print("search_type", self.search_type)
         query_params = QueryParam(mode=self.search_type, only_need_context=True)
 
-        return graphrag_func, query_params
+        return graph_id, graphrag_func, query_params
 
     def _to_document(self, header: str, context_text: str) -> RetrievedDocument:
         return RetrievedDocument(
@@ -448,15 +521,21 @@ class NanoGraphRAGRetrieverPipeline(BaseFileIndexRetriever):
         if not self.file_ids:
             return []
 
-        graphrag_func, query_params = self._build_graph_search()
+        graph_id, graphrag_func, query_params = self._build_graph_search()
 
         # only local mode support graph visualization
         if query_params.mode == "local":
-            entities, relationships, reports, sources = asyncio.run(
-                nano_graph_rag_build_local_query_context(
-                    graphrag_func, text, query_params
+            try:
+                entities, relationships, reports, sources = asyncio.run(
+                    nano_graph_rag_build_local_query_context(
+                        graphrag_func, text, query_params
+                    )
                 )
-            )
+            except Exception:
+                # the call limiters of nano-graphrag do not recover from a failed
+                # call, do not reuse the instance
+                invalidate_graphrag(graph_id)
+                raise
 
             documents = self.format_context_records(
                 entities, relationships, reports, sources
@@ -474,7 +553,11 @@ class NanoGraphRAGRetrieverPipeline(BaseFileIndexRetriever):
                 ),
             ]
         else:
-            context = graphrag_func.query(text, query_params)
+            try:
+                context = graphrag_func.query(text, query_params)
+            except Exception:
+                invalidate_graphrag(graph_id)
+                raise
 
             documents = [
                 RetrievedDocument(
@@ -1,6 +1,15 @@
+import asyncio
 import os
+import queue
 import shutil
 import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from importlib.util import find_spec
 from pathlib import Path
 from shutil import rmtree
 from typing import Generator
@@ -10,6 +19,7 @@ import pandas as pd
 import tiktoken
 import yaml
 from decouple import config
+from dotenv import dotenv_values
 from ktem.db.models import engine
 from sqlalchemy.orm import Session
 from theflow.settings import settings
@@ -43,6 +53,24 @@ except ImportError:
         )
     )
 
+# the indexing API used to build the index in-process
+GRAPHRAG_INDEX_API_VERSION = "0.3.3"
+try:
+    from graphrag.config import load_config, resolve_paths
+    from graphrag.index.api import build_index
+
+    GRAPHRAG_INDEX_API = True
+except ImportError:
+    GRAPHRAG_INDEX_API = False
+    if find_spec("graphrag") is not None:
+        print(
+            (
+                "The GraphRAG indexing API needs "
+                f"`graphrag>={GRAPHRAG_INDEX_API_VERSION}`. "
+                "The GraphRAG index will be built with the graphrag CLI instead."
+            )
+        )
+
 
 filestorage_path = Path(settings.KH_FILESTORAGE_PATH) / "graphrag"
 filestorage_path.mkdir(parents=True, exist_ok=True)
@@ -51,11 +79,48 @@ GRAPHRAG_KEY_MISSING_MESSAGE = (
     "GRAPHRAG_API_KEY is not set. Please set it to use the GraphRAG retriever pipeline."
 )
 
+# number of loaded graphs kept in memory by the GraphRAG retrievers
+GRAPHRAG_CACHE_SIZE = getattr(settings, "KH_GRAPHRAG_CACHE_SIZE", 8)
+# minimum interval between two progress messages of a workflow, in seconds
+PROGRESS_INTERVAL = 10.0
+
+COMMUNITY_LEVEL = 2
+GRAPH_TABLES = [
+    "create_final_nodes",
+    "create_final_entities",
+    "create_final_relationships",
+    "create_final_community_reports",
+    "create_final_text_units",
+]
+
+_graph_tables: OrderedDict[str, tuple[tuple, dict]] = OrderedDict()
+_graph_tables_lock = threading.Lock()
+
 
 def check_graphrag_api_key():
     return len(os.getenv("GRAPHRAG_API_KEY", "")) > 0
 
 
+@contextmanager
+def restore_environ(dotenv_path: Path):
+    """Undo the changes of the `.env` file to the environment variables in the block
+
+    GraphRAG loads the `.env` file of the project into `os.environ` with its
+    config, it must not leak into the other indices of the app. Only the keys of the
+    file are restored, the other threads keep using the environment meanwhile.
+    """
+    keys = [key for key in dotenv_values(dotenv_path) if key]
+    environ = {key: os.environ.get(key) for key in keys}
+    try:
+        yield
+    finally:
+        for key, value in environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            elif os.environ.get(key) != value:
+                os.environ[key] = value
+
+
 def prepare_graph_index_path(graph_id: str):
     root_path = Path(filestorage_path) / graph_id
     input_path = root_path / "input"
@@ -63,6 +128,139 @@ def prepare_graph_index_path(graph_id: str):
     return root_path, input_path
 
 
+class QueueProgressReporter:
+    """GraphRAG progress reporter that passes its messages to the indexing stream
+
+    It implements the `ProgressReporter` interface of GraphRAG. The progress of a
+    workflow is reported at most every `PROGRESS_INTERVAL` seconds, and when it
+    completes.
+
+    Args:
+        messages: queue of the messages to stream
+        prefix: name of the workflow
+    """
+
+    def __init__(self, messages: queue.Queue, prefix: str = ""):
+        self.messages = messages
+        self.prefix = prefix
+        self._last_update = 0.0
+
+    def _put(self, message: str):
+        self.messages.put(f"[GraphRAG] {self.prefix}{message}")
+
+    def __call__(self, update):
+        completed, total = update.completed_items, update.total_items
+        done = total is not None and completed == total
+        if not done and time.monotonic() - self._last_update < PROGRESS_INTERVAL:
+            return
+        self._last_update = time.monotonic()
+        if total:
+            self._put(f"{update.description or ''} {completed} / {total}".strip())
+        elif update.description:
+            self._put(update.description)
+
+    def dispose(self):
+        pass
+
+    def child(self, prefix: str, transient: bool = True) -> "QueueProgressReporter":
+        return QueueProgressReporter(self.messages, f"{self.prefix}{prefix}: ")
+
+    def force_refresh(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def error(self, message: str):
+        self._put(f"ERROR: {message}")
+
+    def warning(self, message: str):
+        self._put(f"WARNING: {message}")
+
+    def info(self, message: str):
+        self._put(message)
+
+    def success(self, message: str):
+        self._put(f"Completed {message}")
+
+
+def _tables_signature(output_path: Path) -> tuple:
+    """Size and modification time of the output tables of the graph"""
+    signature = []
+    for table in GRAPH_TABLES:
+        stat = (output_path / f"{table}.parquet").stat()
+        signature.append((table, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def _load_graph_tables(output_path: Path) -> dict:
+    dfs = {
+        table: pd.read_parquet(output_path / f"{table}.parquet")
+        for table in GRAPH_TABLES
+    }
+    # the nodes table has the community and degree data of the entities
+    entity_df = dfs["create_final_nodes"]
+    entities = read_indexer_entities(
+        entity_df, dfs["create_final_entities"], COMMUNITY_LEVEL
+    )
+
+    # load description embeddings to a local lancedb vectorstore, rebuilt from the
+    # entities once per load. To connect to a remote db, specify url and port values.
+    lancedb_uri = str(output_path / "lancedb")
+    description_embedding_store = LanceDBVectorStore(
+        collection_name="entity_description_embeddings",
+    )
+    description_embedding_store.connect(db_uri=lancedb_uri)
+    if Path(lancedb_uri).is_dir():
+        rmtree(lancedb_uri)
+    _ = store_entity_semantic_embeddings(
+        entities=entities, vectorstore=description_embedding_store
+    )
+    print(f"Entity count: {len(entity_df)}")
+
+    return {
+        "entities": entities,
+        "description_embedding_store": description_embedding_store,
+        "relationships": read_indexer_relationships(dfs["create_final_relationships"]),
+        "reports": read_indexer_reports(
+            dfs["create_final_community_reports"], entity_df, COMMUNITY_LEVEL
+        ),
+        "text_units": read_indexer_text_units(dfs["create_final_text_units"]),
+    }
+
+
+def get_graph_tables(graph_id: str) -> dict:
+    """Get the entities, relationships, community reports and text units of the
+    graph, loaded once per process
+
+    The tables are loaded again when the output files of the graph change on disk.
+    """
+    root_path, _ = prepare_graph_index_path(graph_id)
+    output_path = root_path / "output"
+    signature = _tables_signature(output_path)
+
+    # loading also rebuilds the lancedb store of the graph, so it is done under
+    # the lock to not rebuild it twice at the same time
+    with _graph_tables_lock:
+        cached = _graph_tables.get(graph_id)
+        if cached is not None and cached[0] == signature:
+            _graph_tables.move_to_end(graph_id)
+            return cached[1]
+
+        tables = _load_graph_tables(output_path)
+        _graph_tables[graph_id] = (signature, tables)
+        while len(_graph_tables) > GRAPHRAG_CACHE_SIZE:
+            _graph_tables.popitem(last=False)
+
+    return tables
+
+
+def invalidate_graph_tables(graph_id: str):
+    """Drop the loaded tables of the graph"""
+    with _graph_tables_lock:
+        _graph_tables.pop(graph_id, None)
+
+
 class GraphRAGIndexingPipeline(IndexDocumentPipeline):
     """GraphRAG specific indexing pipeline"""
 
@@ -70,6 +268,8 @@ class GraphRAGIndexingPipeline(IndexDocumentPipeline):
         """Simply disable the splitter (chunking) for this pipeline"""
         pipeline = super().route(file_path)
         pipeline.splitter = None
+        # the graph is built from the loaded documents, so never skip loading
+        pipeline.content_addressed = False
 
         return pipeline
 
@@ -95,6 +295,13 @@ class GraphRAGIndexingPipeline(IndexDocumentPipeline):
 
         return graph_id
 
+    def get_resumable_graph_id(
+        self, file_ids: list[str | None], docs: list[Document]
+    ) -> str | None:
+        """Get the graph of these files whose build was interrupted, if it can be
+        resumed"""
+        return None
+
     def write_docs_to_files(self, graph_id: str, docs: list[Document]):
         root_path, input_path = prepare_graph_index_path(graph_id)
         input_path.mkdir(parents=True, exist_ok=True)
@@ -106,50 +313,110 @@ class GraphRAGIndexingPipeline(IndexDocumentPipeline):
 
         return root_path
 
-    def call_graphrag_index(self, graph_id: str, all_docs: list[Document]):
-        if not check_graphrag_api_key():
-            raise ValueError(GRAPHRAG_KEY_MISSING_MESSAGE)
+    def init_graphrag_project(self, root_path: Path):
+        """Create the GraphRAG settings, .env and prompts of the project"""
+        if not (root_path / "settings.yaml").exists():
+            command = [
+                sys.executable,
+                "-m",
+                "graphrag.index",
+                "--root",
+                str(root_path),
+                "--init",
+            ]
+            result = subprocess.run(command, capture_output=True, text=True)
+            print(result.stdout)
 
-        # call GraphRAG index with docs and graph_id
-        input_path = self.write_docs_to_files(graph_id, all_docs)
-        input_path = str(input_path.absolute())
+        # copy customized GraphRAG config file if it exists
+        if config("USE_CUSTOMIZED_GRAPHRAG_SETTING", default="value").lower() == "true":
+            setting_file_path = os.path.join(os.getcwd(), "settings.yaml.example")
+            destination_file_path = os.path.join(root_path, "settings.yaml")
+            try:
+                shutil.copy(setting_file_path, destination_file_path)
+            except shutil.Error:
+                # Handle the error if the file copy fails
+                print("failed to copy customized GraphRAG config file. ")
 
-        # Construct the command
+    def call_graphrag_index_cli(self, graph_id: str, root_path: Path):
+        """Build the index with the graphrag CLI, for the versions without the
+        indexing API"""
         command = [
-            "python",
+            sys.executable,
             "-m",
             "graphrag.index",
             "--root",
-            input_path,
+            str(root_path),
             "--reporter",
             "rich",
-            "--init",
         ]
+        try:
+            with subprocess.Popen(
+                command, stdout=subprocess.PIPE, text=True
+            ) as process:
+                if process.stdout:
+                    for line in process.stdout:
+                        yield Document(channel="debug", text=line)
+        finally:
+            invalidate_graph_tables(graph_id)
+
+    def call_graphrag_index(self, graph_id: str, all_docs: list[Document]):
+        if not check_graphrag_api_key():
+            raise ValueError(GRAPHRAG_KEY_MISSING_MESSAGE)
+
+        # call GraphRAG index with docs and graph_id
+        root_path = self.write_docs_to_files(graph_id, all_docs).absolute()
 
-        # Run the command
         yield Document(
             channel="debug",
             text="[GraphRAG] Creating index... This can take a long time.",
         )
-        result = subprocess.run(command, capture_output=True, text=True)
-        print(result.stdout)
-        command = command[:-1]
-
-        # copy customized GraphRAG config file if it exists
-        if config("USE_CUSTOMIZED_GRAPHRAG_SETTING", default="value").lower() == "true":
-            setting_file_path = os.path.join(os.getcwd(), "settings.yaml.example")
-            destination_file_path = os.path.join(input_path, "settings.yaml")
-            try:
-                shutil.copy(setting_file_path, destination_file_path)
-            except shutil.Error:
-                # Handle the error if the file copy fails
-                print("failed to copy customized GraphRAG config file. ")
-
-        # Run the command and stream stdout
-        with subprocess.Popen(command, stdout=subprocess.PIPE, text=True) as process:
-            if process.stdout:
-                for line in process.stdout:
-                    yield Document(channel="debug", text=line)
+        self.init_graphrag_project(root_path)
+        if not GRAPHRAG_INDEX_API:
+            yield from self.call_graphrag_index_cli(graph_id, root_path)
+            return
+
+        messages: queue.Queue = queue.Queue()
+        reporter = QueueProgressReporter(messages)
+        with restore_environ(root_path / ".env"):
+            graphrag_config = load_config(root_path)
+        run_id = time.strftime("%Y%m%d-%H%M%S")
+        resolve_paths(graphrag_config, run_id)
+
+        # run the pipeline in this process, streaming the messages of its reporter
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            future = executor.submit(
+                asyncio.run,
+                build_index(
+                    config=graphrag_config,
+                    run_id=run_id,
+                    progress_reporter=reporter,
+                ),
+            )
+            while not future.done() or not messages.empty():
+                try:
+                    yield Document(channel="debug", text=messages.get(timeout=1))
+                except queue.Empty:
+                    pass
+            outputs = future.result()
+        finally:
+            # do not wait for the running pipeline if the indexing is cancelled
+            executor.shutdown(wait=False)
+            invalidate_graph_tables(graph_id)
+
+        if any(output.errors for output in outputs):
+            yield Document(
+                channel="debug",
+                text=(
+                    "[GraphRAG] Errors occurred during the pipeline run, "
+                    f"see the logs in {root_path} for more details."
+                ),
+            )
+        else:
+            yield Document(
+                channel="debug",
+                text="[GraphRAG] All workflows completed successfully.",
+            )
 
     def stream(
         self, file_paths: str | Path | list[str | Path], reindex: bool = False, **kwargs
@@ -160,8 +427,10 @@ class GraphRAGIndexingPipeline(IndexDocumentPipeline):
             file_paths, reindex=reindex, **kwargs
         )
 
-        # assign graph_id to file_ids
-        graph_id = self.store_file_id_with_graph_id(file_ids)
+        # assign graph_id to file_ids, unless an interrupted build can be resumed
+        graph_id = self.get_resumable_graph_id(file_ids, all_docs)
+        if graph_id is None:
+            graph_id = self.store_file_id_with_graph_id(file_ids)
         # call GraphRAG index with docs and graph_id
         yield from self.call_graphrag_index(graph_id, all_docs)
 
@@ -204,50 +473,7 @@ class GraphRAGRetrieverPipeline(BaseFileIndexRetriever):
             assert graph_id, f"GraphRAG index not found for file_id: {file_id}"
 
         root_path, _ = prepare_graph_index_path(graph_id)
-        output_path = root_path / "output"
-
-        INPUT_DIR = output_path
-        LANCEDB_URI = str(INPUT_DIR / "lancedb")
-        COMMUNITY_REPORT_TABLE = "create_final_community_reports"
-        ENTITY_TABLE = "create_final_nodes"
-        ENTITY_EMBEDDING_TABLE = "create_final_entities"
-        RELATIONSHIP_TABLE = "create_final_relationships"
-        TEXT_UNIT_TABLE = "create_final_text_units"
-        COMMUNITY_LEVEL = 2
-
-        # read nodes table to get community and degree data
-        entity_df = pd.read_parquet(f"{INPUT_DIR}/{ENTITY_TABLE}.parquet")
-        entity_embedding_df = pd.read_parquet(
-            f"{INPUT_DIR}/{ENTITY_EMBEDDING_TABLE}.parquet"
-        )
-        entities = read_indexer_entities(
-            entity_df, entity_embedding_df, COMMUNITY_LEVEL
-        )
-
-        # load description embeddings to an in-memory lancedb vectorstore
-        # to connect to a remote db, specify url and port values.
-        description_embedding_store = LanceDBVectorStore(
-            collection_name="entity_description_embeddings",
-        )
-        description_embedding_store.connect(db_uri=LANCEDB_URI)
-        if Path(LANCEDB_URI).is_dir():
-            rmtree(LANCEDB_URI)
-        _ = store_entity_semantic_embeddings(
-            entities=entities, vectorstore=description_embedding_store
-        )
-        print(f"Entity count: {len(entity_df)}")
-
-        # Read relationships
-        relationship_df = pd.read_parquet(f"{INPUT_DIR}/{RELATIONSHIP_TABLE}.parquet")
-        relationships = read_indexer_relationships(relationship_df)
-
-        # Read community reports
-        report_df = pd.read_parquet(f"{INPUT_DIR}/{COMMUNITY_REPORT_TABLE}.parquet")
-        reports = read_indexer_reports(report_df, entity_df, COMMUNITY_LEVEL)
-
-        # Read text units
-        text_unit_df = pd.read_parquet(f"{INPUT_DIR}/{TEXT_UNIT_TABLE}.parquet")
-        text_units = read_indexer_text_units(text_unit_df)
+        tables = get_graph_tables(graph_id)
 
         # initialize default settings
         embedding_model = os.getenv(
@@ -279,12 +505,12 @@ class GraphRAGRetrieverPipeline(BaseFileIndexRetriever):
         token_encoder = tiktoken.get_encoding("cl100k_base")
 
         context_builder = LocalSearchMixedContext(
-            community_reports=reports,
-            text_units=text_units,
-            entities=entities,
-            relationships=relationships,
+            community_reports=tables["reports"],
+            text_units=tables["text_units"],
+            entities=tables["entities"],
+            relationships=tables["relationships"],
             covariates=None,
-            entity_text_embeddings=description_embedding_store,
+            entity_text_embeddings=tables["description_embedding_store"],
             embedding_vectorstore_key=EntityVectorStoreKey.ID,
             # if the vectorstore uses entity title as ids,
             # set this to EntityVectorStoreKey.TITLE
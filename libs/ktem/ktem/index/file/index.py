@@ -5,7 +5,9 @@ from typing import Any, Optional, Type
 from ktem.components import filestorage_path, get_docstore, get_vectorstore
 from ktem.db.engine import engine
 from ktem.index.base import BaseIndex
-from sqlalchemy import JSON, Column, DateTime, Integer, String, UniqueConstraint
+from sqlalchemy import JSON, Column, DateTime
+from sqlalchemy import Index as SQLIndex
+from sqlalchemy import Integer, String, UniqueConstraint, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.mutable import MutableDict
 from theflow.settings import settings as flowsettings
@@ -113,6 +115,17 @@ class FileIndex(BaseIndex):
             (Base,),
             {
                 "__tablename__": f"index__{self.id}__index",
+                "__table_args__": (
+                    # chunks of the files (covering, so no table lookup is needed)
+                    SQLIndex(
+                        f"ix_index__{self.id}__index_source_relation_target",
+                        "source_id",
+                        "relation_type",
+                        "target_id",
+                    ),
+                    # files referring to a chunk
+                    SQLIndex(f"ix_index__{self.id}__index_target", "target_id"),
+                ),
                 "id": Column(Integer, primary_key=True, autoincrement=True),
                 "source_id": Column(String),
                 "target_id": Column(String),
@@ -319,6 +332,21 @@ class FileIndex(BaseIndex):
         self._resources["FileGroup"].metadata.create_all(engine)  # type: ignore
         self._fs_path.mkdir(parents=True, exist_ok=True)
 
+    def _create_missing_table_indexes(self):
+        """Add the indexes of the Index table to the tables created without them
+
+        With `KH_ENABLE_ALEMBIC`, the migrations take care of this instead.
+        """
+        table = self._resources["Index"].__table__
+        inspector = inspect(engine)
+        if not inspector.has_table(table.name):
+            return
+
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+
     def on_delete(self):
         """Clean up the index when the user delete it"""
         import shutil
@@ -334,6 +362,8 @@ class FileIndex(BaseIndex):
     def on_start(self):
         """Setup the classes and hooks"""
         self._setup_resources()
+        if not getattr(flowsettings, "KH_ENABLE_ALEMBIC", False):
+            self._create_missing_table_indexes()
         self._setup_indexing_cls()
         self._setup_retriever_cls()
         self._setup_file_index_ui_cls()
@@ -447,6 +477,10 @@ class FileIndex(BaseIndex):
 
         return obj
 
+    def get_selected_ids(self, selected: Any = None) -> Optional[list[str]]:
+        """Get the ids of the files selected in the file selector component"""
+        return self._selector_ui.get_selected_ids(selected)
+
     def get_retriever_pipelines(
         self, settings: dict, user_id: int, selected: Any = None
     ) -> list["BaseFileIndexRetriever"]:
@@ -458,7 +492,7 @@ class FileIndex(BaseIndex):
                 stripped_settings[key[len(prefix) :]] = value
 
         # transform selected id
-        selected_ids: Optional[list[str]] = self._selector_ui.get_selected_ids(selected)
+        selected_ids: Optional[list[str]] = self.get_selected_ids(selected)
 
         retrievers = []
         for cls in self._retriever_pipeline_cls:
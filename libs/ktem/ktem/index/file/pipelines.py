@@ -2,12 +2,25 @@ from __future__ import annotations
 
 import json
 import logging
+import multiprocessing
+import os
+import pickle
 import shutil
 import threading
 import time
 import warnings
 from collections import defaultdict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
 from copy import deepcopy
+from dataclasses import dataclass, field
 from functools import lru_cache
 from hashlib import sha256
 from pathlib import Path
@@ -17,6 +30,7 @@ import tiktoken
 from ktem.db.models import engine
 from ktem.embeddings.manager import embedding_models_manager
 from ktem.llms.manager import llms
+from ktem.reasoning.answer_cache import answer_cache, invalidate_answers
 from ktem.rerankings.manager import reranking_models_manager
 from llama_index.core.readers.base import BaseReader
 from llama_index.core.readers.file.base import default_file_metadata_func
@@ -27,7 +41,7 @@ from llama_index.core.vector_stores import (
     MetadataFilters,
 )
 from llama_index.core.vector_stores.types import VectorStoreQueryMode
-from sqlalchemy import delete, select
+from sqlalchemy import delete, insert, select
 from sqlalchemy.orm import Session
 from theflow.settings import settings
 from theflow.utils.modules import import_dotted_string
@@ -45,6 +59,7 @@ from kotaemon.indices.ingests.files import (
 )
 from kotaemon.indices.rankings import BaseReranking, LLMReranking, LLMTrulensScoring
 from kotaemon.indices.splitters import BaseSplitter, TokenSplitter
+from kotaemon.storages.blobstore import offload_image
 
 from .base import BaseFileIndexIndexing, BaseFileIndexRetriever
 
@@ -75,6 +90,216 @@ def dev_settings():
 
 _default_token_func = tiktoken.encoding_for_model("gpt-3.5-turbo").encode
 
+# bounds of the parallel ingestion engine used by IndexDocumentPipeline.stream
+FILE_INDEX_PIPELINE_LOADER_WORKERS = getattr(
+    settings, "FILE_INDEX_PIPELINE_LOADER_WORKERS", min(4, os.cpu_count() or 1)
+)
+FILE_INDEX_PIPELINE_LOADER_EXECUTOR = getattr(
+    settings, "FILE_INDEX_PIPELINE_LOADER_EXECUTOR", "thread"
+)
+FILE_INDEX_PIPELINE_EMBEDDING_WORKERS = getattr(
+    settings, "FILE_INDEX_PIPELINE_EMBEDDING_WORKERS", 2
+)
+FILE_INDEX_PIPELINE_MAX_PENDING_FILES = getattr(
+    settings, "FILE_INDEX_PIPELINE_MAX_PENDING_FILES", 8
+)
+FILE_INDEX_PIPELINE_CONTENT_ADDRESSED = getattr(
+    settings, "FILE_INDEX_PIPELINE_CONTENT_ADDRESSED", False
+)
+FILE_INDEX_RETRIEVER_SCOPE = getattr(
+    settings, "FILE_INDEX_RETRIEVER_SCOPE", "chunk_ids"
+)
+
+
+def split_documents(
+    docs: list[Document], splitter: BaseSplitter | None
+) -> list[Document]:
+    """Split the loaded documents into the chunks to index
+
+    Text documents are split by the splitter, while table, image and thumbnail
+    documents are kept as-is. Text chunks are linked to their page thumbnail. The
+    base64 images are moved to the blob store, the chunks only keep their blob uri.
+    """
+    text_docs = []
+    non_text_docs = []
+    thumbnail_docs = []
+
+    for doc in docs:
+        if doc.metadata.get("image_origin"):
+            doc.metadata["image_origin"] = offload_image(doc.metadata["image_origin"])
+        doc_type = doc.metadata.get("type", "text")
+        if doc_type == "text":
+            text_docs.append(doc)
+        elif doc_type == "thumbnail":
+            thumbnail_docs.append(doc)
+        else:
+            non_text_docs.append(doc)
+
+    print(f"Got {len(thumbnail_docs)} page thumbnails")
+    page_label_to_thumbnail = {
+        doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs
+    }
+
+    if splitter:
+        all_chunks = splitter(text_docs)
+    else:
+        all_chunks = text_docs
+
+    # add the thumbnails doc_id to the chunks
+    for chunk in all_chunks:
+        page_label = chunk.metadata.get("page_label", None)
+        if page_label and page_label in page_label_to_thumbnail:
+            chunk.metadata["thumbnail_doc_id"] = page_label_to_thumbnail[page_label]
+
+    return all_chunks + non_text_docs + thumbnail_docs
+
+
+def load_and_split(
+    loader: BaseReader,
+    splitter: BaseSplitter | None,
+    file_path: str | Path,
+    extra_info: dict,
+) -> tuple[list[Document], list[Document]]:
+    """Load a file and split it, return the loaded documents and the chunks
+
+    This is a module-level function so that it can be sent to a process pool.
+    """
+    docs = loader.load_data(file_path, extra_info=extra_info)
+    return docs, split_documents(docs, splitter)
+
+
+def hash_chunks(chunks: list[Document]) -> dict[str, str]:
+    """Hash the content of the chunks, return a mapping of doc_id to hash
+
+    The hash covers the text, the type, the page and the image of the chunk. A
+    chunk linked to a page thumbnail also covers the content of that thumbnail,
+    so that an unchanged chunk never points to a changed thumbnail.
+    """
+    by_id = {chunk.doc_id: chunk for chunk in chunks}
+    hashes: dict[str, str] = {}
+
+    def _hash(chunk: Document) -> str:
+        if chunk.doc_id not in hashes:
+            hasher = sha256()
+            for key in ("type", "page_label", "image_origin"):
+                hasher.update(f"{key}={chunk.metadata.get(key, '')}\0".encode())
+            hasher.update(chunk.text.encode())
+            thumbnail_id = chunk.metadata.get("thumbnail_doc_id")
+            if thumbnail_id:
+                thumbnail = by_id.get(thumbnail_id)
+                hasher.update(
+                    (_hash(thumbnail) if thumbnail else thumbnail_id).encode()
+                )
+            hashes[chunk.doc_id] = hasher.hexdigest()
+        return hashes[chunk.doc_id]
+
+    for chunk in chunks:
+        _hash(chunk)
+
+    return hashes
+
+
+def get_unreferenced_ids(session: Session, Index, chunk_ids: list[str]) -> list[str]:
+    """Get the chunk ids that no file refers to in the Index table"""
+    referenced = set()
+    for start_idx in range(0, len(chunk_ids), 500):
+        referenced.update(
+            session.scalars(
+                select(Index.target_id).where(
+                    Index.target_id.in_(chunk_ids[start_idx : start_idx + 500])
+                )
+            )
+        )
+    return [chunk_id for chunk_id in chunk_ids if chunk_id not in referenced]
+
+
+def invalidate_file_answers(session: Session, Source, file_ids: list[str]):
+    """Drop the cached answers of the files, and of the files linked from them"""
+    if answer_cache is None or not file_ids:
+        return
+    linked_from = Source.note["linked_from"].as_string()
+    linked_ids = session.scalars(select(Source.id).where(linked_from.in_(file_ids)))
+    invalidate_answers([*file_ids, *linked_ids])
+
+
+_loader_process_pool: Optional[ProcessPoolExecutor] = None
+_loader_process_pool_workers = 0
+_loader_process_pool_lock = threading.Lock()
+
+
+def _pickle_loader(loader, splitter) -> Optional[bytes]:
+    """Pickle the loader and splitter to send them to a process, None if they can't
+
+    Whether they can be pickled depends on the state of the instances, so every
+    file checks its own, and the pickled bytes are sent as is to not pay it twice.
+    """
+    try:
+        return pickle.dumps((loader, splitter))
+    except Exception:
+        return None
+
+
+def load_and_split_pickled(
+    loader_splitter: bytes, file_path: str | Path, extra_info: dict
+) -> tuple[list[Document], list[Document]]:
+    """Run `load_and_split` with the loader and splitter of `_pickle_loader`"""
+    loader, splitter = pickle.loads(loader_splitter)
+    return load_and_split(loader, splitter, file_path, extra_info)
+
+
+def get_loader_process_pool(
+    max_workers: int, broken: Optional[ProcessPoolExecutor] = None
+) -> ProcessPoolExecutor:
+    """Get the process pool of the loaders, shared by the indexing calls
+
+    The workers are spawned rather than forked, as forking the multi-threaded app
+    server can deadlock on the locks held by its other threads. The pool is
+    recreated when the number of workers changes, or when `broken` is the current
+    pool, i.e. it raised `BrokenProcessPool`.
+    """
+    global _loader_process_pool, _loader_process_pool_workers
+    with _loader_process_pool_lock:
+        pool = _loader_process_pool
+        if (
+            pool is None
+            or pool is broken
+            or _loader_process_pool_workers != max_workers
+        ):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+            pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _loader_process_pool = pool
+            _loader_process_pool_workers = max_workers
+        return pool
+
+
+def _log_exception(fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        logger.exception(e)
+
+
+@dataclass
+class _IngestionTask:
+    """State of a file going through IndexDocumentPipeline.stream_parallel"""
+
+    idx: int
+    file_path: str | Path
+    file_name: str
+    pipeline: IndexPipeline | None = None
+    file_id: str | None = None
+    file_hash: str | None = None
+    docs: list[Document] = field(default_factory=list)
+    pending: set[Future] = field(default_factory=set)
+    n_stored: int = 0
+    n_embedded: int = 0
+    error: str | None = None
+    done: bool = False
+
 
 class DocumentRetrievalPipeline(BaseFileIndexRetriever):
     """Retrieve relevant document
@@ -98,6 +323,15 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
     mmr: bool = False
     top_k: int = 5
     retrieval_mode: str = "hybrid"
+    scope_mode: str = Param(
+        FILE_INDEX_RETRIEVER_SCOPE,
+        help=(
+            "How the search is restricted to the selected files: 'chunk_ids' lists "
+            "the chunks of the files, 'file_id' filters on the file id in the stores. "
+            "The chunk ids are always used in content-addressed mode, where the "
+            "chunks can be shared between files"
+        ),
+    )
 
     @Node.auto(depends_on=["embedding", "VS", "DS"])
     def vector_retrieval(self) -> VectorRetrieval:
@@ -142,21 +376,43 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
 
         retrieval_kwargs: dict = {}
         with Session(engine) as session:
-            stmt = select(self.Index).where(
-                self.Index.relation_type == "document",
-                self.Index.source_id.in_(doc_ids),
-            )
-            results = session.execute(stmt)
-            chunk_ids = [r[0].target_id for r in results.all()]
+            # in content-addressed mode, the chunks of a file can be shared with other
+            # files and keep the file_id of the file that indexed them
+            owner_ids: list[str] = []
+            shared = False
+            for (note,) in session.execute(
+                select(self.Source.note).where(self.Source.id.in_(doc_ids))
+            ):
+                note = note or {}
+                owners = note.get("chunk_owners") or (
+                    [note["linked_from"]] if note.get("linked_from") else []
+                )
+                owner_ids.extend(owners)
+                shared = shared or bool(owners) or bool(note.get("shared"))
+            file_ids = list(dict.fromkeys(doc_ids + owner_ids))
+
+            # the file_id metadata cannot tell which files use the shared chunks,
+            # the exact list of chunks is needed to scope the search
+            if (
+                self.scope_mode == "chunk_ids"
+                or shared
+                or FILE_INDEX_PIPELINE_CONTENT_ADDRESSED
+            ):
+                stmt = select(self.Index.target_id).where(
+                    self.Index.source_id.in_(doc_ids),
+                    self.Index.relation_type == "document",
+                )
+                retrieval_kwargs["scope"] = list(session.scalars(stmt))
 
         # do first round top_k extension
         retrieval_kwargs["do_extend"] = True
-        retrieval_kwargs["scope"] = chunk_ids
+        if self.scope_mode == "file_id":
+            retrieval_kwargs["file_ids"] = file_ids
         retrieval_kwargs["filters"] = MetadataFilters(
             filters=[
                 MetadataFilter(
                     key="file_id",
-                    value=doc_ids,
+                    value=file_ids,
                     operator=FilterOperator.IN,
                 )
             ],
@@ -340,6 +596,7 @@ class IndexPipeline(BaseComponent):
     collection_name: str = "default"
     private: bool = False
     run_embedding_in_thread: bool = False
+    content_addressed: bool = False
     embedding: BaseEmbeddings
 
     @Node.auto(depends_on=["Source", "Index", "embedding"])
@@ -350,36 +607,15 @@ class IndexPipeline(BaseComponent):
 
     def handle_docs(self, docs, file_id, file_name) -> Generator[Document, None, int]:
         s_time = time.time()
-        text_docs = []
-        non_text_docs = []
-        thumbnail_docs = []
-
-        for doc in docs:
-            doc_type = doc.metadata.get("type", "text")
-            if doc_type == "text":
-                text_docs.append(doc)
-            elif doc_type == "thumbnail":
-                thumbnail_docs.append(doc)
-            else:
-                non_text_docs.append(doc)
-
-        print(f"Got {len(thumbnail_docs)} page thumbnails")
-        page_label_to_thumbnail = {
-            doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs
-        }
-
-        if self.splitter:
-            all_chunks = self.splitter(text_docs)
-        else:
-            all_chunks = text_docs
-
-        # add the thumbnails doc_id to the chunks
-        for chunk in all_chunks:
-            page_label = chunk.metadata.get("page_label", None)
-            if page_label and page_label in page_label_to_thumbnail:
-                chunk.metadata["thumbnail_doc_id"] = page_label_to_thumbnail[page_label]
-
-        to_index_chunks = all_chunks + non_text_docs + thumbnail_docs
+        to_index_chunks = split_documents(docs, self.splitter)
+        if self.content_addressed:
+            n_all_chunks = len(to_index_chunks)
+            to_index_chunks = self.reuse_indexed_chunks(file_id, to_index_chunks)
+            yield Document(
+                f" => [{file_name}] Reused {n_all_chunks - len(to_index_chunks)} "
+                "unchanged chunks",
+                channel="debug",
+            )
 
         # add to doc store
         chunks = []
@@ -427,37 +663,50 @@ class IndexPipeline(BaseComponent):
 
         # record in the index
         with Session(engine) as session:
-            nodes = []
-            for chunk in chunks:
-                nodes.append(
-                    self.Index(
-                        source_id=file_id,
-                        target_id=chunk.doc_id,
-                        relation_type="document",
-                    )
-                )
-            session.add_all(nodes)
+            session.execute(
+                insert(self.Index),
+                [
+                    {
+                        "source_id": file_id,
+                        "target_id": chunk.doc_id,
+                        "relation_type": "document",
+                    }
+                    for chunk in chunks
+                ],
+            )
             session.commit()
 
     def handle_chunks_vectorstore(self, chunks, file_id):
         """Run chunks"""
         # run embedding, add to both vector store and doc store
-        self.vector_indexing.add_to_vectorstore(chunks)
+        self.handle_embeddings_vectorstore(chunks, self.embed_chunks(chunks), file_id)
+
+    def embed_chunks(self, chunks) -> list:
+        """Compute the embeddings of the chunks, without storing them"""
+        if not self.VS:
+            return []
+        print(f"Getting embeddings for {len(chunks)} nodes")
+        return self.embedding(chunks)
+
+    def handle_embeddings_vectorstore(self, chunks, embeddings, file_id):
+        """Store the pre-computed embeddings of the chunks"""
+        self.vector_indexing.add_to_vectorstore(chunks, embeddings=embeddings)
         self.vector_indexing.write_chunk_to_file(chunks)
 
         if self.VS:
             # record in the index
             with Session(engine) as session:
-                nodes = []
-                for chunk in chunks:
-                    nodes.append(
-                        self.Index(
-                            source_id=file_id,
-                            target_id=chunk.doc_id,
-                            relation_type="vector",
-                        )
-                    )
-                session.add_all(nodes)
+                session.execute(
+                    insert(self.Index),
+                    [
+                        {
+                            "source_id": file_id,
+                            "target_id": chunk.doc_id,
+                            "relation_type": "vector",
+                        }
+                        for chunk in chunks
+                    ],
+                )
                 session.commit()
 
     def get_id_if_exists(self, file_path: str | Path) -> Optional[str]:
@@ -518,8 +767,7 @@ class IndexPipeline(BaseComponent):
         Returns:
             the file id
         """
-        with file_path.open("rb") as fi:
-            file_hash = sha256(fi.read()).hexdigest()
+        file_hash = self.hash_file(file_path)
 
         shutil.copy(file_path, self.FSPath / file_hash)
         source = self.Source(
@@ -527,6 +775,8 @@ class IndexPipeline(BaseComponent):
             path=file_hash,
             size=file_path.stat().st_size,
             user=self.user_id,  # type: ignore
+            # the content is only matched by hash once it is indexed, see `finish`
+            note={"pending": True},
         )
         with Session(engine) as session:
             session.add(source)
@@ -535,8 +785,205 @@ class IndexPipeline(BaseComponent):
 
         return file_id
 
+    def hash_file(self, file_path: Path) -> str:
+        """Get the sha256 of the file content, as stored in the Source path"""
+        with file_path.open("rb") as fi:
+            return sha256(fi.read()).hexdigest()
+
+    def get_id_by_hash(self, file_hash: str) -> Optional[str]:
+        """Get the id of an indexed file that has the given content hash
+
+        Files whose indexing did not finish are left out.
+        """
+        cond = [self.Source.path == file_hash]
+        if self.private:
+            cond.append(self.Source.user == self.user_id)
+
+        with Session(engine) as session:
+            for source_id, note in session.execute(
+                select(self.Source.id, self.Source.note).where(*cond)
+            ):
+                if not (note or {}).get("pending"):
+                    return source_id
+
+        return None
+
+    def link_file(self, source_id: str, file_path: Path) -> str:
+        """Record a file whose content is already indexed as `source_id`
+
+        The new file shares the chunks of `source_id` instead of indexing them again.
+        The chunks keep the `file_id` metadata of the file that indexed them, so the
+        files that share chunks are noted for the retriever:
+            - `chunk_owners`: the files whose chunks the new file may contain
+            - `shared`: the chunks of the file are shared with other files
+
+        Returns:
+            the new file id
+        """
+        with Session(engine) as session:
+            linked = session.execute(
+                select(self.Source).where(self.Source.id == source_id)
+            ).first()[0]
+            note = {key: value for key, value in linked.note.items() if key != "shared"}
+            # a link of a link shares the chunks of the first file
+            note["linked_from"] = linked.note.get("linked_from", source_id)
+            note["chunk_owners"] = list(
+                dict.fromkeys([*linked.note.get("chunk_owners", []), source_id])
+            )
+            source = self.Source(
+                name=file_path.name,
+                path=linked.path,
+                size=linked.size,
+                user=self.user_id,  # type: ignore
+                note=note,
+            )
+            linked.note["shared"] = True
+            session.add(linked)
+            session.add(source)
+            session.flush()
+            file_id = source.id
+
+            relations = session.execute(
+                select(self.Index.target_id, self.Index.relation_type).where(
+                    self.Index.source_id == source_id,
+                    self.Index.relation_type.in_(["document", "vector"]),
+                )
+            ).all()
+            if relations:
+                session.execute(
+                    insert(self.Index),
+                    [
+                        {
+                            "source_id": file_id,
+                            "target_id": target_id,
+                            "relation_type": relation_type,
+                            "user": self.user_id,
+                        }
+                        for target_id, relation_type in relations
+                    ],
+                )
+            session.commit()
+
+        return file_id
+
+    def update_file(self, file_id: str, file_path: Path) -> str:
+        """Replace the stored content of an indexed file, keeping its id and chunks
+
+        The chunks are reconciled with the new content in `reuse_indexed_chunks`.
+        """
+        file_hash = self.hash_file(file_path)
+        shutil.copy(file_path, self.FSPath / file_hash)
+        with Session(engine) as session:
+            source = session.execute(
+                select(self.Source).where(self.Source.id == file_id)
+            ).first()[0]
+            old_hash = source.path
+            source.path = file_hash
+            source.size = file_path.stat().st_size
+            source.note.pop("linked_from", None)
+            source.note["pending"] = True
+            session.add(source)
+            session.commit()
+            invalidate_file_answers(session, self.Source, [file_id])
+
+            # remove the stored copy of the old content, unless a linked file uses it
+            if old_hash != file_hash and not session.execute(
+                select(self.Source.id).where(self.Source.path == old_hash)
+            ).first():
+                (self.FSPath / old_hash).unlink(missing_ok=True)
+
+        return file_id
+
+    def reuse_indexed_chunks(
+        self, file_id: str, chunks: list[Document]
+    ) -> list[Document]:
+        """Keep the indexed chunks of the file whose content did not change
+
+        Unchanged chunks keep their docstore entry and embedding. The indexed chunks
+        that are not in `chunks` anymore are removed, as are the chunks of a failed
+        indexing that were stored without their embedding.
+
+        Returns:
+            the chunks that still need to be indexed
+        """
+        relations: dict[str, set[str]] = defaultdict(set)
+        with Session(engine) as session:
+            for target_id, relation_type in session.execute(
+                select(self.Index.target_id, self.Index.relation_type).where(
+                    self.Index.source_id == file_id,
+                    self.Index.relation_type.in_(["document", "vector"]),
+                )
+            ):
+                relations[relation_type].add(target_id)
+        indexed_ids = list(
+            relations["document"] & relations["vector"]
+            if self.VS
+            else relations["document"]
+        )
+        incomplete_ids = list(
+            (relations["document"] | relations["vector"]).difference(indexed_ids)
+        )
+        if not indexed_ids:
+            self.remove_chunks(file_id, incomplete_ids)
+            return chunks
+
+        indexed_docs = self.DS.get(indexed_ids)
+        indexed_by_hash: dict[str, list[str]] = defaultdict(list)
+        for doc_id, doc_hash in hash_chunks(indexed_docs).items():
+            indexed_by_hash[doc_hash].append(doc_id)
+
+        reused: dict[str, str] = {}
+        for doc_id, doc_hash in hash_chunks(chunks).items():
+            if indexed_by_hash[doc_hash]:
+                reused[doc_id] = indexed_by_hash[doc_hash].pop()
+
+        to_index_chunks = []
+        for chunk in chunks:
+            if chunk.doc_id in reused:
+                continue
+            thumbnail_id = chunk.metadata.get("thumbnail_doc_id")
+            if thumbnail_id in reused:
+                chunk.metadata["thumbnail_doc_id"] = reused[thumbnail_id]
+            to_index_chunks.append(chunk)
+
+        self.remove_chunks(
+            file_id,
+            incomplete_ids + list(set(indexed_ids).difference(reused.values())),
+        )
+        return to_index_chunks
+
+    def remove_chunks(self, file_id: str, chunk_ids: list[str]):
+        """Unlink the chunks from the file, deleting those no other file uses"""
+        if not chunk_ids:
+            return
+
+        with Session(engine) as session:
+            for start_idx in range(0, len(chunk_ids), 500):
+                session.execute(
+                    delete(self.Index).where(
+                        self.Index.source_id == file_id,
+                        self.Index.target_id.in_(
+                            chunk_ids[start_idx : start_idx + 500]
+                        ),
+                    )
+                )
+            session.commit()
+            unused_ids = self._get_unreferenced_ids(session, chunk_ids)
+
+        if unused_ids and self.VS:
+            self.VS.delete(unused_ids)
+        if unused_ids:
+            self.DS.delete(unused_ids)
+
+    def _get_unreferenced_ids(self, session: Session, chunk_ids: list[str]):
+        """Get the chunk ids that no file refers to in the Index table"""
+        return get_unreferenced_ids(session, self.Index, chunk_ids)
+
     def finish(self, file_id: str, file_path: str | Path) -> str:
         """Finish the indexing"""
+        # update the full-text index once per file rather than once per batch
+        self.DS.flush()
+
         with Session(engine) as session:
             stmt = select(self.Source).where(self.Source.id == file_id)
             result = session.execute(stmt).first()
@@ -558,9 +1005,11 @@ class IndexPipeline(BaseComponent):
 
             # populate the note
             item.note["loader"] = self.get_from_path("loader").__class__.__name__
+            item.note.pop("pending", None)
 
             session.add(item)
             session.commit()
+            invalidate_file_answers(session, self.Source, [file_id])
 
         return file_id
 
@@ -575,19 +1024,26 @@ class IndexPipeline(BaseComponent):
             file_id: the file id
         """
         with Session(engine) as session:
+            invalidate_file_answers(session, self.Source, [file_id])
             session.execute(delete(self.Source).where(self.Source.id == file_id))
             vs_ids, ds_ids = [], []
             index = session.execute(
-                select(self.Index).where(self.Index.source_id == file_id)
-            ).all()
-            for each in index:
-                if each[0].relation_type == "vector":
-                    vs_ids.append(each[0].target_id)
-                elif each[0].relation_type == "document":
-                    ds_ids.append(each[0].target_id)
-                session.delete(each[0])
+                select(self.Index.target_id, self.Index.relation_type).where(
+                    self.Index.source_id == file_id
+                )
+            )
+            for target_id, relation_type in index:
+                if relation_type == "vector":
+                    vs_ids.append(target_id)
+                elif relation_type == "document":
+                    ds_ids.append(target_id)
+            session.execute(delete(self.Index).where(self.Index.source_id == file_id))
             session.commit()
 
+            # chunks can be shared with files of the same content
+            vs_ids = self._get_unreferenced_ids(session, vs_ids)
+            ds_ids = self._get_unreferenced_ids(session, ds_ids)
+
         if vs_ids and self.VS:
             self.VS.delete(vs_ids)
         if ds_ids:
@@ -598,15 +1054,64 @@ class IndexPipeline(BaseComponent):
     ) -> tuple[str, list[Document]]:
         raise NotImplementedError
 
-    def stream(
-        self, file_path: str | Path, reindex: bool, **kwargs
-    ) -> Generator[Document, None, tuple[str, list[Document]]]:
-        # check if the file is already indexed
-        if isinstance(file_path, Path):
-            file_path = file_path.resolve()
+    def register(
+        self, file_path: str | Path, reindex: bool
+    ) -> Generator[Document, None, tuple[str, str]]:
+        """Record the file in the Source table
+
+        If the file is already indexed and `reindex` is True, the old records are
+        removed before the file is stored again. In content-addressed mode, the
+        file content hash is used instead:
+            - an unchanged file is skipped
+            - a changed file, or a file whose indexing failed, keeps its id, and its
+              unchanged chunks are reused
+            - a new file with the content of an indexed file is linked to it
 
+        Returns:
+            the file id, and the status: "new", "updated", "unchanged" or "linked".
+            Only "new" and "updated" files need to be loaded and indexed.
+        """
         file_id = self.get_id_if_exists(file_path)
 
+        if isinstance(file_path, Path) and self.content_addressed:
+            if file_id is not None and not reindex:
+                raise ValueError(
+                    f"File {file_path.name} already indexed. Please rerun with "
+                    "reindex=True to force reindexing."
+                )
+
+            file_hash = self.hash_file(file_path)
+            if file_id is not None:
+                with Session(engine) as session:
+                    indexed_hash, note = session.execute(
+                        select(self.Source.path, self.Source.note).where(
+                            self.Source.id == file_id
+                        )
+                    ).one()
+                # a file whose indexing failed is indexed again
+                if indexed_hash == file_hash and not (note or {}).get("pending"):
+                    yield Document(
+                        f" => {file_path.name} is unchanged, skipping",
+                        channel="debug",
+                    )
+                    return file_id, "unchanged"
+
+                yield Document(
+                    f" => Updating changed {file_path.name}", channel="debug"
+                )
+                return self.update_file(file_id, file_path), "updated"
+
+            source_id = self.get_id_by_hash(file_hash)
+            if source_id is not None:
+                yield Document(
+                    f" => {file_path.name} has the same content as an indexed file, "
+                    "linking",
+                    channel="debug",
+                )
+                return self.link_file(source_id, file_path), "linked"
+
+            return self.store_file(file_path), "new"
+
         if isinstance(file_path, Path):
             if file_id is not None:
                 if not reindex:
@@ -631,16 +1136,33 @@ class IndexPipeline(BaseComponent):
                 # add record to db
                 file_id = self.store_url(file_path)
 
-        # extract the file
+        return file_id, "new"
+
+    def get_extra_info(self, file_path: str | Path, file_id: str) -> dict:
+        """Get the metadata attached to every document loaded from the file"""
         if isinstance(file_path, Path):
             extra_info = default_file_metadata_func(str(file_path))
-            file_name = file_path.name
         else:
             extra_info = {"file_name": file_path}
-            file_name = file_path
 
         extra_info["file_id"] = file_id
         extra_info["collection_name"] = self.collection_name
+        return extra_info
+
+    def stream(
+        self, file_path: str | Path, reindex: bool, **kwargs
+    ) -> Generator[Document, None, tuple[str, list[Document]]]:
+        # check if the file is already indexed
+        if isinstance(file_path, Path):
+            file_path = file_path.resolve()
+
+        file_id, status = yield from self.register(file_path, reindex)
+        if status in ("unchanged", "linked"):
+            return file_id, []
+
+        # extract the file
+        extra_info = self.get_extra_info(file_path, file_id)
+        file_name = extra_info["file_name"]
 
         yield Document(f" => Converting {file_name} to text", channel="debug")
         docs = self.loader.load_data(file_path, extra_info=extra_info)
@@ -668,6 +1190,26 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
     reader_mode: str = Param("default", help="The reader mode")
     embedding: BaseEmbeddings
     run_embedding_in_thread: bool = False
+    loader_workers: int = Param(
+        FILE_INDEX_PIPELINE_LOADER_WORKERS,
+        help="Number of workers to load and split files. Set 1 to index serially",
+    )
+    loader_executor: str = Param(
+        FILE_INDEX_PIPELINE_LOADER_EXECUTOR,
+        help="Run the loaders in a 'process' or a 'thread' pool",
+    )
+    embedding_workers: int = Param(
+        FILE_INDEX_PIPELINE_EMBEDDING_WORKERS,
+        help="Number of concurrent embedding batches",
+    )
+    max_pending_files: int = Param(
+        FILE_INDEX_PIPELINE_MAX_PENDING_FILES,
+        help="Maximum number of files being processed at the same time",
+    )
+    content_addressed: bool = Param(
+        FILE_INDEX_PIPELINE_CONTENT_ADDRESSED,
+        help="Deduplicate files by content hash and reuse unchanged chunks",
+    )
 
     @Param.auto(depends_on="reader_mode")
     def readers(self):
@@ -760,6 +1302,7 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
                 backup_separators=["\n", ".", "\u200B"],
             ),
             run_embedding_in_thread=self.run_embedding_in_thread,
+            content_addressed=self.content_addressed,
             Source=self.Source,
             Index=self.Index,
             VS=self.VS,
@@ -786,6 +1329,11 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
         if not isinstance(file_paths, list):
             file_paths = [file_paths]
 
+        if len(file_paths) > 1 and self.loader_workers > 1:
+            return (
+                yield from self.stream_parallel(file_paths, reindex=reindex, **kwargs)
+            )
+
         file_ids: list[str | None] = []
         errors: list[str | None] = []
         all_docs = []
@@ -834,3 +1382,308 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
                 )
 
         return file_ids, errors, all_docs
+
+    def stream_parallel(
+        self, file_paths: list[str | Path], reindex: bool = False, **kwargs
+    ) -> Generator[
+        Document, None, tuple[list[str | None], list[str | None], list[Document]]
+    ]:
+        """Index the files with a pipelined ingestion engine
+
+        The files go through 3 stages that run concurrently:
+            - load & split: a bounded process (or thread) pool runs the loaders
+            - embedding: a thread pool computes the embeddings of chunk batches
+            - store: a single writer thread adds the chunks to the docstore, the
+              embeddings to the vector store, and records them in the Index table
+
+        At most `max_pending_files` files are in flight at the same time. An error
+        only fails the file it belongs to. The output has the same format as the
+        serial `stream`.
+        """
+        n_files = len(file_paths)
+        tasks = [
+            _IngestionTask(idx, *self._file_name(file_path))
+            for idx, file_path in enumerate(file_paths)
+        ]
+        queued = list(reversed(tasks))
+        futures: dict[Future, tuple[_IngestionTask, str, list[Document]]] = {}
+        n_active = 0
+        # in content-addressed mode, a file with the same content as a file being
+        # indexed waits for it, so that it can be linked to the indexed chunks
+        indexing: dict[str, _IngestionTask] = {}
+        waiting: dict[str, list[_IngestionTask]] = {}
+
+        loader_thread_pool = ThreadPoolExecutor(
+            max_workers=self.loader_workers, thread_name_prefix="index-loader"
+        )
+        loader_pool: Executor = (
+            get_loader_process_pool(self.loader_workers)
+            if self.loader_executor == "process"
+            else loader_thread_pool
+        )
+        embedding_pool = ThreadPoolExecutor(
+            max_workers=self.embedding_workers, thread_name_prefix="index-embedding"
+        )
+        store_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-store")
+
+        def submit(task, stage, pool, fn, *args, chunks=None):
+            future = pool.submit(fn, *args)
+            futures[future] = (task, stage, chunks or [])
+            task.pending.add(future)
+
+        def submit_load(task, loader_splitter, extra_info):
+            submit(
+                task,
+                "load",
+                loader_pool,
+                load_and_split_pickled,
+                loader_splitter,
+                task.file_path,
+                extra_info,
+            )
+
+        def schedule_chunks(task, to_index_chunks):
+            pipeline = task.pipeline
+            batch_size = pipeline.chunk_batch_size * 4
+            for start_idx in range(0, len(to_index_chunks), batch_size):
+                batch = to_index_chunks[start_idx : start_idx + batch_size]
+                submit(
+                    task,
+                    "docstore",
+                    store_pool,
+                    pipeline.handle_chunks_docstore,
+                    batch,
+                    task.file_id,
+                    chunks=batch,
+                )
+
+            batch_size = pipeline.chunk_batch_size
+            for start_idx in range(0, len(to_index_chunks), batch_size):
+                batch = to_index_chunks[start_idx : start_idx + batch_size]
+                if pipeline.run_embedding_in_thread:
+                    # quick mode: don't wait for the embeddings
+                    embedding_pool.submit(
+                        _log_exception,
+                        pipeline.handle_chunks_vectorstore,
+                        batch,
+                        task.file_id,
+                    )
+                else:
+                    submit(
+                        task,
+                        "embedding",
+                        embedding_pool,
+                        pipeline.embed_chunks,
+                        batch,
+                        chunks=batch,
+                    )
+
+        def release(task):
+            if task.file_hash and indexing.get(task.file_hash) is task:
+                del indexing[task.file_hash]
+                queued.extend(reversed(waiting.pop(task.file_hash, [])))
+
+        def fail(task, error):
+            logger.exception(error)
+            release(task)
+            task.error = str(error)
+            for future in task.pending:
+                future.cancel()
+            task.pending.clear()
+            return Document(
+                content={
+                    "file_path": task.file_path,
+                    "file_name": task.file_name,
+                    "status": "failed",
+                    "message": task.error,
+                },
+                channel="index",
+            )
+
+        try:
+            while queued or futures:
+                # admit new files while below the in-flight budget
+                while queued and n_active < self.max_pending_files:
+                    task = queued.pop()
+                    yield Document(
+                        content=f"Indexing [{task.idx + 1}/{n_files}]: "
+                        f"{task.file_name}",
+                        channel="debug",
+                    )
+                    try:
+                        task.pipeline = self.route(task.file_path)
+                        if isinstance(task.file_path, Path):
+                            task.file_path = task.file_path.resolve()
+                            if task.pipeline.content_addressed:
+                                task.file_hash = task.pipeline.hash_file(task.file_path)
+                        if task.file_hash in indexing:
+                            waiting.setdefault(task.file_hash, []).append(task)
+                            continue
+                        task.file_id, status = yield from task.pipeline.register(
+                            task.file_path, reindex
+                        )
+                        extra_info = task.pipeline.get_extra_info(
+                            task.file_path, task.file_id
+                        )
+                    except Exception as e:
+                        yield fail(task, e)
+                        continue
+
+                    if status in ("unchanged", "linked"):
+                        task.done = True
+                        yield Document(
+                            content={
+                                "file_path": task.file_path,
+                                "file_name": task.file_name,
+                                "status": "success",
+                            },
+                            channel="index",
+                        )
+                        continue
+
+                    if task.file_hash:
+                        indexing[task.file_hash] = task
+                    yield Document(
+                        f" => Converting {task.file_name} to text", channel="debug"
+                    )
+                    loader, splitter = task.pipeline.loader, task.pipeline.splitter
+                    loader_splitter = (
+                        _pickle_loader(loader, splitter)
+                        if loader_pool is not loader_thread_pool
+                        else None
+                    )
+                    if loader_splitter is None:
+                        submit(
+                            task,
+                            "load",
+                            loader_thread_pool,
+                            load_and_split,
+                            loader,
+                            splitter,
+                            task.file_path,
+                            extra_info,
+                        )
+                    else:
+                        try:
+                            submit_load(task, loader_splitter, extra_info)
+                        except BrokenProcessPool:
+                            # a worker died in an earlier call, start a new pool
+                            loader_pool = get_loader_process_pool(
+                                self.loader_workers, broken=loader_pool
+                            )
+                            submit_load(task, loader_splitter, extra_info)
+                    n_active += 1
+
+                if not futures:
+                    continue
+
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, stage, chunks = futures.pop(future)
+                    task.pending.discard(future)
+                    if task.error is not None:
+                        continue
+
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        n_active -= 1
+                        yield fail(task, e)
+                        continue
+
+                    pipeline = task.pipeline
+                    if stage == "load":
+                        task.docs, to_index_chunks = result
+                        yield Document(
+                            f" => Converted {task.file_name} to text", channel="debug"
+                        )
+                        if pipeline.content_addressed:
+                            submit(
+                                task,
+                                "reuse",
+                                store_pool,
+                                pipeline.reuse_indexed_chunks,
+                                task.file_id,
+                                to_index_chunks,
+                                chunks=to_index_chunks,
+                            )
+                        else:
+                            schedule_chunks(task, to_index_chunks)
+                    elif stage == "reuse":
+                        yield Document(
+                            f" => [{task.file_name}] Reused "
+                            f"{len(chunks) - len(result)} unchanged chunks",
+                            channel="debug",
+                        )
+                        schedule_chunks(task, result)
+                    elif stage == "docstore":
+                        task.n_stored += len(chunks)
+                        yield Document(
+                            f" => [{task.file_name}] Processed {task.n_stored} chunks",
+                            channel="debug",
+                        )
+                    elif stage == "embedding":
+                        submit(
+                            task,
+                            "vectorstore",
+                            store_pool,
+                            pipeline.handle_embeddings_vectorstore,
+                            chunks,
+                            result,
+                            task.file_id,
+                            chunks=chunks,
+                        )
+                    elif stage == "vectorstore":
+                        task.n_embedded += len(chunks)
+                        if pipeline.VS:
+                            yield Document(
+                                f" => [{task.file_name}] Created embedding for "
+                                f"{task.n_embedded} chunks",
+                                channel="debug",
+                            )
+                    elif stage == "finish":
+                        n_active -= 1
+                        task.done = True
+                        release(task)
+                        yield Document(
+                            f" => Finished indexing {task.file_name}",
+                            channel="debug",
+                        )
+                        yield Document(
+                            content={
+                                "file_path": task.file_path,
+                                "file_name": task.file_name,
+                                "status": "success",
+                            },
+                            channel="index",
+                        )
+                        continue
+
+                    if not task.pending:
+                        submit(
+                            task,
+                            "finish",
+                            store_pool,
+                            pipeline.finish,
+                            task.file_id,
+                            task.file_path,
+                        )
+        finally:
+            for future in futures:
+                future.cancel()
+            # the process pool is kept for the next indexing calls
+            loader_thread_pool.shutdown(wait=False, cancel_futures=True)
+            # in quick mode, embedding continues in the background
+            embedding_pool.shutdown(wait=False)
+            store_pool.shutdown(wait=True)
+
+        file_ids = [task.file_id if task.done else None for task in tasks]
+        errors = [None if task.done else task.error for task in tasks]
+        all_docs = [doc for task in tasks if task.done for doc in task.docs]
+        return file_ids, errors, all_docs
+
+    def _file_name(self, file_path: str | Path) -> tuple[str | Path, str]:
+        if self.is_url(file_path):
+            return file_path, str(file_path)
+        file_path = Path(file_path)
+        return file_path, file_path.name
@@ -15,11 +15,12 @@ from gradio.utils import NamedString
 from ktem.app import BasePage
 from ktem.db.engine import engine
 from ktem.utils.render import Render
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.orm import Session
 from theflow.settings import settings as flowsettings
 
 from ...utils.commands import WEB_SEARCH_COMMAND
+from .pipelines import get_unreferenced_ids, invalidate_file_answers
 
 DOWNLOAD_MESSAGE = "Press again to download"
 MAX_FILENAME_LENGTH = 20
@@ -379,13 +380,14 @@ class FileIndexPage(BasePage):
 
             Index = self._index._resources["Index"]
             with Session(engine) as session:
-                matches = session.execute(
-                    select(Index).where(
-                        Index.source_id == file_id,
-                        Index.relation_type == "document",
+                doc_ids = list(
+                    session.scalars(
+                        select(Index.target_id).where(
+                            Index.source_id == file_id,
+                            Index.relation_type == "document",
+                        )
                     )
                 )
-                doc_ids = [doc.target_id for (doc,) in matches]
                 docs = self._index._docstore.get(doc_ids)
                 docs = sorted(
                     docs, key=lambda x: x.metadata.get("page_label", float("inf"))
@@ -435,24 +437,33 @@ class FileIndexPage(BasePage):
             if source:
                 file_name = source[0].name
                 session.delete(source[0])
+            invalidate_file_answers(
+                session, self._index._resources["Source"], [file_id]
+            )
 
+            Index = self._index._resources["Index"]
             vs_ids, ds_ids = [], []
             index = session.execute(
-                select(self._index._resources["Index"]).where(
-                    self._index._resources["Index"].source_id == file_id
+                select(Index.target_id, Index.relation_type).where(
+                    Index.source_id == file_id
                 )
-            ).all()
-            for each in index:
-                if each[0].relation_type == "vector":
-                    vs_ids.append(each[0].target_id)
-                elif each[0].relation_type == "document":
-                    ds_ids.append(each[0].target_id)
-                session.delete(each[0])
+            )
+            for target_id, relation_type in index:
+                if relation_type == "vector":
+                    vs_ids.append(target_id)
+                elif relation_type == "document":
+                    ds_ids.append(target_id)
+            session.execute(delete(Index).where(Index.source_id == file_id))
             session.commit()
 
+            # chunks can be shared with files of the same content
+            vs_ids = get_unreferenced_ids(session, Index, vs_ids)
+            ds_ids = get_unreferenced_ids(session, Index, ds_ids)
+
         if vs_ids:
             self._index._vs.delete(vs_ids)
-        self._index._docstore.delete(ds_ids)
+        if ds_ids:
+            self._index._docstore.delete(ds_ids)
 
         gr.Info(f"File {file_name} has been deleted")
 
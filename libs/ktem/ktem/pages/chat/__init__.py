@@ -3,6 +3,7 @@ import importlib
 import json
 import os
 import re
+import time
 from copy import deepcopy
 from typing import Optional
 
@@ -11,6 +12,7 @@ from ktem.app import BasePage
 from ktem.components import reasonings
 from ktem.db.models import Conversation, engine
 from ktem.index.file.ui import File
+from ktem.reasoning.answer_cache import answer_cache
 from ktem.reasoning.prompt_optimization.suggest_conversation_name import (
     SuggestConvNamePipeline,
 )
@@ -1016,6 +1018,8 @@ class ChatPage(BasePage):
 
         # get retrievers
         retrievers = []
+        # the files the answer depends on, None when unknown (e.g. web search)
+        selected_file_ids: Optional[list[str]] = None
 
         if command_state == WEB_SEARCH_COMMAND:
             # set retriever for web search
@@ -1025,6 +1029,7 @@ class ChatPage(BasePage):
             web_search = WebSearch()
             retrievers.append(web_search)
         else:
+            selected_file_ids = []
             for index in self._app.index_manager.indices:
                 index_selected = []
                 if isinstance(index.selector, int):
@@ -1037,6 +1042,18 @@ class ChatPage(BasePage):
                 )
                 retrievers += iretrievers
 
+                if answer_cache is None or not iretrievers:
+                    continue
+                if selected_file_ids is not None and hasattr(index, "get_selected_ids"):
+                    for file_id in index.get_selected_ids(index_selected) or []:
+                        # a group of files is selected as a JSON list of ids
+                        if file_id and file_id.startswith("["):
+                            selected_file_ids += json.loads(file_id)
+                        else:
+                            selected_file_ids.append(file_id)
+                else:
+                    selected_file_ids = None
+
         # prepare states
         reasoning_state = {
             "app": deepcopy(state["app"]),
@@ -1044,6 +1061,8 @@ class ChatPage(BasePage):
         }
 
         pipeline = reasoning_cls.get_pipeline(settings, reasoning_state, retrievers)
+        if answer_cache is not None and hasattr(pipeline, "answer_cache_files"):
+            pipeline.answer_cache_files = selected_file_ids
 
         return pipeline, reasoning_state
 
@@ -1092,6 +1111,7 @@ class ChatPage(BasePage):
         msg_placeholder = getattr(
             flowsettings, "KH_CHAT_MSG_PLACEHOLDER", "Thinking ..."
         )
+        stream_interval = getattr(flowsettings, "KH_CHAT_STREAM_INTERVAL", 0.1)
         print(msg_placeholder)
         yield (
             chat_history + [(chat_input, text or msg_placeholder)],
@@ -1101,6 +1121,20 @@ class ChatPage(BasePage):
             chat_state,
         )
 
+        # the outputs changed since the last yield, the unchanged ones are not sent
+        # again. Gradio only sends the appended part of the chat message.
+        chat_changed, refs_changed, plot_changed = False, False, False
+        last_yield = time.monotonic()
+
+        def render(message):
+            return (
+                chat_history + [(chat_input, message)],
+                refs if refs_changed else gr.update(),
+                plot_gr if plot_changed else gr.update(),
+                plot if plot_changed else gr.update(),
+                chat_state,
+            )
+
         for response in pipeline.stream(chat_input, conversation_id, chat_history):
 
             if not isinstance(response, Document):
@@ -1109,44 +1143,52 @@ class ChatPage(BasePage):
             if response.channel is None:
                 continue
 
+            # the evidence received so far is complete once another channel follows
+            info_done = refs_changed and response.channel != "info"
+
             if response.channel == "chat":
                 if response.content is None:
                     text = ""
                 else:
                     text += response.content
+                chat_changed = True
 
             if response.channel == "info":
                 if response.content is None:
                     refs = ""
                 else:
                     refs += response.content
+                refs_changed = True
 
             if response.channel == "plot":
                 plot = response.content
                 plot_gr = self._json_to_plot(plot)
+                plot_changed = True
 
             chat_state[pipeline.get_info()["id"]] = reasoning_state["pipeline"]
 
-            yield (
-                chat_history + [(chat_input, text or msg_placeholder)],
-                refs,
-                plot_gr,
-                plot,
-                chat_state,
-            )
+            # the chat tokens and the evidence are coalesced on a time window, and
+            # sent as soon as the answer or the evidence is complete
+            if plot_changed or (
+                (chat_changed or refs_changed)
+                and (
+                    info_done
+                    or response.channel == "chat_end"
+                    or time.monotonic() - last_yield >= stream_interval
+                )
+            ):
+                yield render(text or msg_placeholder)
+                chat_changed, refs_changed, plot_changed = False, False, False
+                last_yield = time.monotonic()
 
         if not text:
             empty_msg = getattr(
                 flowsettings, "KH_CHAT_EMPTY_MSG_PLACEHOLDER", "(Sorry, I don't know)"
             )
             print(f"Generate nothing: {empty_msg}")
-            yield (
-                chat_history + [(chat_input, text or empty_msg)],
-                refs,
-                plot_gr,
-                plot,
-                chat_state,
-            )
+            yield render(text or empty_msg)
+        elif chat_changed or refs_changed or plot_changed:
+            yield render(text)
 
     def check_and_suggest_name_conv(self, chat_history):
         suggest_pipeline = SuggestConvNamePipeline()
@@ -8,6 +8,8 @@ from ktem.llms.manager import llms
 from ktem.rerankings.manager import reranking_models_manager as rerankers
 from theflow.settings import settings as flowsettings
 
+from kotaemon.embeddings import CachedEmbeddings
+
 KH_DEMO_MODE = getattr(flowsettings, "KH_DEMO_MODE", False)
 KH_OLLAMA_URL = getattr(flowsettings, "KH_OLLAMA_URL", "http://localhost:11434/v1/")
 DEFAULT_OLLAMA_URL = KH_OLLAMA_URL.replace("v1", "api")
@@ -292,7 +294,7 @@ class SetupPage(BasePage):
 
             # download required models through ollama
             llm_model_name = llms.get("ollama").model  # type: ignore
-            emb_model_name = embeddings.get("ollama").model  # type: ignore
+            emb_model_name = embeddings.info()["ollama"]["spec"]["model"]
 
             try:
                 for model_name in [emb_model_name, llm_model_name]:
@@ -355,6 +357,9 @@ class SetupPage(BasePage):
 
             emb = embeddings.get(radio_model_value)
             assert emb, f"Embedding model {radio_model_value} not found."
+            # test the connection, not the cache
+            if isinstance(emb, CachedEmbeddings):
+                emb = emb.embedding
 
             log_content += "- Sending a message `Hi`<br>"
             yield log_content
@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+from theflow.settings import settings as flowsettings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase the question, collapse its whitespaces and strip its punctuation"""
+    question = re.sub(r"\s+", " ", question).strip().lower()
+    return question.strip(" ?!.")
+
+
+def hash_scope(*parts) -> str:
+    """Hash the JSON-serializable parts that an answer depends on, besides its
+    question"""
+    data = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+class AnswerCache:
+    """SQLite-backed cache of the streamed answers of the QA pipelines
+
+    An answer is stored with the hash of its scope (the selected files, the pipeline
+    settings, the recent history) and its question. It is found again by a question
+    of the same scope that is the same once normalized, or whose embedding is at
+    least `similarity` cosine-similar. The answers are dropped when one of their
+    files is re-indexed or deleted, after `ttl` seconds, or when there are more than
+    `max_entries` of them (the least recently used first).
+
+    Args:
+        path: path to the sqlite file, created if not exist
+        similarity: minimum cosine similarity of the question embeddings
+        ttl: lifetime of an answer, in seconds. Set to 0 to keep the answers until
+            they are invalidated.
+        max_entries: maximum number of answers. Set to 0 for unbounded cache.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        similarity: float = 0.95,
+        ttl: float = 24 * 3600,
+        max_entries: int = 10000,
+    ):
+        self.path = Path(path)
+        self.similarity = similarity
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # a forked child must not reuse the connection of its parent
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            str(self.path), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL, question TEXT NOT NULL, embedding BLOB,
+                stream TEXT NOT NULL, answer TEXT NOT NULL,
+                created REAL NOT NULL, last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers (scope);
+            CREATE INDEX IF NOT EXISTS idx_answers_last_access
+                ON answers (last_access);
+            CREATE TABLE IF NOT EXISTS answer_files (
+                answer_id INTEGER NOT NULL
+                    REFERENCES answers (id) ON DELETE CASCADE,
+                file_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_answer_files_file_id
+                ON answer_files (file_id);
+            CREATE INDEX IF NOT EXISTS idx_answer_files_answer_id
+                ON answer_files (answer_id);
+            """)
+        self._conn, self._pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def _unit(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float64)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(
+        self,
+        scope: str,
+        question: str,
+        embedding: Optional[Sequence[float]] = None,
+    ) -> Optional[tuple[list[tuple[Optional[str], Optional[str]]], dict]]:
+        """Find the answer of a similar question in the same scope
+
+        Returns:
+            the stream of (channel, content) and the answer as {"text", "metadata"},
+            or None if no answer is found
+        """
+        question = normalize_question(question)
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT id, question, embedding FROM answers "
+                "WHERE scope = ? AND created >= ?",
+                (scope, time.time() - self.ttl if self.ttl else 0),
+            ).fetchall()
+
+            best_id, best_similarity = None, self.similarity
+            query = self._unit(embedding) if embedding is not None else None
+            for answer_id, cached_question, blob in rows:
+                if cached_question == question:
+                    best_id = answer_id
+                    break
+                if query is None or blob is None:
+                    continue
+                cached = np.frombuffer(blob, dtype=np.float64)
+                if cached.shape != query.shape:
+                    continue
+                similarity = float(np.dot(query, cached))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = answer_id, similarity
+
+            if best_id is None:
+                return None
+
+            stream, answer = conn.execute(
+                "SELECT stream, answer FROM answers WHERE id = ?", (best_id,)
+            ).fetchone()
+            conn.execute(
+                "UPDATE answers SET last_access = ? WHERE id = ?",
+                (time.time(), best_id),
+            )
+
+        return [tuple(item) for item in json.loads(stream)], json.loads(answer)
+
+    def set(
+        self,
+        scope: str,
+        question: str,
+        embedding: Optional[Sequence[float]],
+        file_ids: list[str],
+        stream: list[tuple[Optional[str], Optional[str]]],
+        answer: dict,
+    ):
+        """Store the answer of the question, replacing the previous one if any
+
+        Args:
+            scope: hash of what the answer depends on, besides the question
+            question: the question
+            embedding: embedding of the normalized question, if available
+            file_ids: the answer is dropped when one of these files changes
+            stream: the streamed (channel, content)
+            answer: the answer as {"text", "metadata"}, JSON-serializable
+        """
+        question = normalize_question(question)
+        blob = (
+            array("d", self._unit(embedding).tolist()).tobytes()
+            if embedding is not None
+            else None
+        )
+        now = time.time()
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            try:
+                conn.execute(
+                    "DELETE FROM answers WHERE scope = ? AND question = ?",
+                    (scope, question),
+                )
+                answer_id = conn.execute(
+                    "INSERT INTO answers "
+                    "(scope, question, embedding, stream, answer, created, "
+                    "last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        scope,
+                        question,
+                        blob,
+                        json.dumps(stream),
+                        json.dumps(answer),
+                        now,
+                        now,
+                    ),
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO answer_files (answer_id, file_id) VALUES (?, ?)",
+                    [(answer_id, file_id) for file_id in dict.fromkeys(file_ids)],
+                )
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        if self.ttl:
+            conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+        if self.max_entries:
+            conn.execute(
+                "DELETE FROM answers WHERE id NOT IN "
+                "(SELECT id FROM answers ORDER BY last_access DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def invalidate(self, file_ids: list[str]) -> int:
+        """Drop the answers that depend on any of the files
+
+        Returns:
+            the number of dropped answers
+        """
+        if not file_ids:
+            return 0
+
+        with self._lock:
+            conn = self._connect()
+            return conn.execute(
+                "DELETE FROM answers WHERE id IN (SELECT answer_id FROM answer_files "
+                "WHERE file_id IN (SELECT value FROM json_each(?)))",
+                (json.dumps(list(file_ids)),),
+            ).rowcount
+
+    def clear(self):
+        """Drop all the answers"""
+        with self._lock:
+            self._connect().execute("DELETE FROM answers")
+
+
+if getattr(flowsettings, "KH_ANSWER_CACHE", False):
+    answer_cache: Optional[AnswerCache] = AnswerCache(
+        path=flowsettings.KH_ANSWER_CACHE_PATH,
+        similarity=getattr(flowsettings, "KH_ANSWER_CACHE_SIMILARITY", 0.95),
+        ttl=getattr(flowsettings, "KH_ANSWER_CACHE_TTL", 24 * 3600),
+    )
+else:
+    answer_cache = None
+
+
+def invalidate_answers(file_ids: list[str]):
+    """Drop the cached answers that depend on the files, if the cache is enabled"""
+    if answer_cache is None or not file_ids:
+        return
+    try:
+        dropped = answer_cache.invalidate(file_ids)
+    except Exception as e:
+        logger.exception(f"Failed to invalidate the cached answers: {e}")
+        return
+    if dropped:
+        logger.info(f"Dropped {dropped} cached answers of files {file_ids}")
@@ -1,6 +1,180 @@
-from typing import Optional
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Iterable, Iterator, Optional
 
-from kotaemon.base import BaseComponent
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import BaseComponent, RetrievedDocument
+
+logger = logging.getLogger(__name__)
+
+RETRIEVER_TIMEOUT = getattr(flowsettings, "KH_RETRIEVER_TIMEOUT", 60)
+# how often the retrievers waiting for a worker are checked, in seconds
+POLL_INTERVAL = 0.1
+
+
+def _check_deadlines(
+    pending: Iterable[int], started: dict[int, float], timeout: Optional[float]
+) -> tuple[list[int], Optional[float]]:
+    """Get the pending retrievers that ran for more than `timeout` seconds, and the
+    time to wait until the next one does"""
+    if timeout is None:
+        return [], None
+
+    now = time.monotonic()
+    expired, waits = [], []
+    for idx in pending:
+        if idx not in started:
+            # not started yet, check again soon
+            waits.append(POLL_INTERVAL)
+        elif started[idx] + timeout <= now:
+            expired.append(idx)
+        else:
+            waits.append(started[idx] + timeout - now)
+    return expired, min(waits, default=None)
+
+
+def _log_timeout(retriever: BaseComponent, idx: int, timeout: Optional[float]):
+    logger.warning(
+        f"Retriever {idx} ({retriever.__class__.__name__}) "
+        f"timed out after {timeout}s, its results are dropped"
+    )
+
+
+def run_retrievers(
+    retrievers: list[BaseComponent],
+    timeout: Optional[float] = RETRIEVER_TIMEOUT,
+    **kwargs,
+) -> Iterator[tuple[int, list[RetrievedDocument]]]:
+    """Run the retrievers concurrently, yielding their results as they finish
+
+    Args:
+        retrievers: the retrievers, each called with `**kwargs`
+        timeout: time given to each retriever from its start, in seconds. The
+            results of a retriever still running after it are dropped, as are the
+            results of a retriever that fails.
+
+    Yields:
+        the index of the retriever and its documents, in order of completion
+    """
+    if not retrievers:
+        return
+
+    started: dict[int, float] = {}
+
+    def call(idx: int, retriever: BaseComponent):
+        started[idx] = time.monotonic()
+        return retriever(**kwargs)
+
+    executor = ThreadPoolExecutor(
+        max_workers=len(retrievers), thread_name_prefix="retriever"
+    )
+    pending = {
+        executor.submit(call, idx, retriever): idx
+        for idx, retriever in enumerate(retrievers)
+    }
+    try:
+        while pending:
+            expired, remaining = _check_deadlines(pending.values(), started, timeout)
+            for future, idx in list(pending.items()):
+                if idx in expired:
+                    _log_timeout(retrievers[idx], idx, timeout)
+                    del pending[future]
+            if not pending:
+                break
+
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = pending.pop(future)
+                try:
+                    docs = future.result()
+                except Exception as e:
+                    logger.exception(
+                        f"Retriever {idx} ({retrievers[idx].__class__.__name__}) "
+                        f"failed, its results are dropped: {e}"
+                    )
+                    continue
+                yield idx, docs
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def arun_retrievers(
+    retrievers: list[BaseComponent],
+    timeout: Optional[float] = RETRIEVER_TIMEOUT,
+    **kwargs,
+) -> AsyncIterator[tuple[int, list[RetrievedDocument]]]:
+    """Run the retrievers concurrently as `run_retrievers` does, without blocking
+    the event loop
+
+    The retrievers are synchronous, so they run in the default executor of the loop,
+    shared by all the conversations, instead of in threads of their own. The time a
+    retriever waits for a worker does not count in its timeout.
+    """
+    if not retrievers:
+        return
+
+    started: dict[int, float] = {}
+
+    def call(idx: int, retriever: BaseComponent):
+        started[idx] = time.monotonic()
+        return retriever(**kwargs)
+
+    loop = asyncio.get_running_loop()
+    pending = {
+        asyncio.ensure_future(
+            loop.run_in_executor(None, functools.partial(call, idx, retriever))
+        ): idx
+        for idx, retriever in enumerate(retrievers)
+    }
+    try:
+        while pending:
+            expired, remaining = _check_deadlines(pending.values(), started, timeout)
+            for task, idx in list(pending.items()):
+                if idx in expired:
+                    _log_timeout(retrievers[idx], idx, timeout)
+                    task.cancel()
+                    del pending[task]
+            if not pending:
+                break
+
+            done, _ = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                idx = pending.pop(task)
+                try:
+                    docs = task.result()
+                except Exception as e:
+                    logger.exception(
+                        f"Retriever {idx} ({retrievers[idx].__class__.__name__}) "
+                        f"failed, its results are dropped: {e}"
+                    )
+                    continue
+                yield idx, docs
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def merge_retrieved_docs(
+    results: dict[int, list[RetrievedDocument]],
+) -> list[RetrievedDocument]:
+    """Merge the results of the retrievers, keyed by retriever index
+
+    The documents are ordered by retriever then by rank, whatever the order in which
+    the retrievers finished, and a document retrieved several times is kept once.
+    """
+    docs, doc_ids = [], set()
+    for idx in sorted(results):
+        for doc in results[idx]:
+            if doc.doc_id not in doc_ids:
+                docs.append(doc)
+                doc_ids.add(doc.doc_id)
+    return docs
 
 
 class BaseReasoning(BaseComponent):
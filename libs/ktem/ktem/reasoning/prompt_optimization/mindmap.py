@@ -37,16 +37,20 @@ Use the template like this:
     """  # noqa: E501
     prompt_template: str = MINDMAP_PROMPT_TEMPLATE
 
-    def run(self, question: str, context: str) -> Document:  # type: ignore
+    def prepare_messages(self, question: str, context: str) -> list:
         prompt_template = PromptTemplate(self.prompt_template)
         prompt = prompt_template.populate(
             question=question,
             context=context,
         )
 
-        messages = [
+        return [
             SystemMessage(content=self.SYSTEM_PROMPT),
             HumanMessage(content=prompt),
         ]
 
-        return self.llm(messages)
+    def run(self, question: str, context: str) -> Document:  # type: ignore
+        return self.llm(self.prepare_messages(question, context))
+
+    async def ainvoke(self, question: str, context: str) -> Document:  # type: ignore
+        return await self.llm.ainvoke(self.prepare_messages(question, context))
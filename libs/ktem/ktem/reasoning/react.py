@@ -3,10 +3,14 @@ import logging
 from typing import AnyStr, Optional, Type
 
 from ktem.llms.manager import llms
-from ktem.reasoning.base import BaseReasoning
+from ktem.reasoning.base import (
+    RETRIEVER_TIMEOUT,
+    BaseReasoning,
+    merge_retrieved_docs,
+    run_retrievers,
+)
 from ktem.utils.generator import Generator
 from ktem.utils.render import Render
-from langchain.text_splitter import CharacterTextSplitter
 from pydantic import BaseModel, Field
 
 from kotaemon.agents import (
@@ -17,6 +21,7 @@ from kotaemon.agents import (
     WikipediaTool,
 )
 from kotaemon.base import BaseComponent, Document, HumanMessage, Node, SystemMessage
+from kotaemon.indices.splitters import TokenTruncator
 from kotaemon.llms import ChatLLM, PromptTemplate
 
 from ..utils import SUPPORTED_LANGUAGE_MAP
@@ -41,17 +46,13 @@ class DocSearchTool(BaseTool):
     )
     args_schema: Optional[Type[BaseModel]] = DocSearchArgs
     retrievers: list[BaseComponent] = []
+    retriever_timeout: float = RETRIEVER_TIMEOUT
 
     def _run_tool(self, query: AnyStr) -> AnyStr:
-        docs = []
-        doc_ids = []
-        for retriever in self.retrievers:
-            for doc in retriever(text=query):
-                if doc.doc_id not in doc_ids:
-                    docs.append(doc)
-                    doc_ids.append(doc.doc_id)
-
-        return self.prepare_evidence(docs)
+        results = dict(
+            run_retrievers(self.retrievers, timeout=self.retriever_timeout, text=query)
+        )
+        return self.prepare_evidence(merge_retrieved_docs(results))
 
     def prepare_evidence(self, docs, trim_len: int = 4000):
         evidence = ""
@@ -104,14 +105,7 @@ class DocSearchTool(BaseTool):
 
         # trim context by trim_len
         if evidence:
-            text_splitter = CharacterTextSplitter.from_tiktoken_encoder(
-                chunk_size=trim_len,
-                chunk_overlap=0,
-                separator=" ",
-                model_name="gpt-3.5-turbo",
-            )
-            texts = text_splitter.split_text(evidence)
-            evidence = texts[0]
+            evidence = TokenTruncator(max_tokens=trim_len).truncate(evidence)
 
         return Document(content=evidence)
 
@@ -1,6 +1,8 @@
+import asyncio
+import json
 import logging
 import threading
-from typing import Generator
+from typing import AsyncGenerator, Generator, Optional
 
 from ktem.embeddings.manager import embedding_models_manager as embeddings
 from ktem.llms.manager import llms
@@ -8,6 +10,7 @@ from ktem.reasoning.prompt_optimization import (
     DecomposeQuestionPipeline,
     RewriteQuestionPipeline,
 )
+from ktem.utils.generator import Generator as GeneratorWrapper
 from ktem.utils.plantuml import PlantUML
 from ktem.utils.render import Render
 from ktem.utils.visualize_cited import CreateCitationVizPipeline
@@ -32,7 +35,14 @@ from kotaemon.indices.qa.format_context import PrepareEvidencePipeline
 from kotaemon.llms import ChatLLM
 
 from ..utils import SUPPORTED_LANGUAGE_MAP
-from .base import BaseReasoning
+from .answer_cache import answer_cache, hash_scope, normalize_question
+from .base import (
+    RETRIEVER_TIMEOUT,
+    BaseReasoning,
+    arun_retrievers,
+    merge_retrieved_docs,
+    run_retrievers,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -90,6 +100,7 @@ class FullQAPipeline(BaseReasoning):
     # configuration parameters
     trigger_context: int = 150
     use_rewrite: bool = False
+    retriever_timeout: float = RETRIEVER_TIMEOUT
 
     retrievers: list[BaseComponent]
 
@@ -103,10 +114,19 @@ class FullQAPipeline(BaseReasoning):
     )
     add_query_context: AddQueryContextPipeline = AddQueryContextPipeline.withx()
 
-    def retrieve(
+    # the answer cache is used when the selected files are known
+    answer_cache_files: Optional[list[str]] = None
+    answer_cache_settings: str = ""
+
+    def retrieve_stream(
         self, message: str, history: list
-    ) -> tuple[list[RetrievedDocument], list[Document]]:
-        """Retrieve the documents based on the message"""
+    ) -> Generator[Document, None, list[RetrievedDocument]]:
+        """Retrieve the documents based on the message
+
+        The retrievers run concurrently, and the documents of each retriever are
+        shown in the info panel as soon as it finishes. The returned documents are
+        merged in the order of the retrievers, whatever the order they finished in.
+        """
         # if len(message) < self.trigger_context:
         #     # prefer adding context for short user questions, avoid adding context for
         #     # long questions, as they are likely to contain enough information
@@ -122,44 +142,86 @@ class FullQAPipeline(BaseReasoning):
             # like "Hello", "I need help"...
             query = message
 
-        docs, doc_ids = [], []
-        plot_docs = []
-
-        for idx, retriever in enumerate(self.retrievers):
-            retriever_node = self._prepare_child(retriever, f"retriever_{idx}")
-            retriever_docs = retriever_node(text=query)
+        retriever_nodes = [
+            self._prepare_child(retriever, f"retriever_{idx}")
+            for idx, retriever in enumerate(self.retrievers)
+        ]
+        results: dict[int, list[RetrievedDocument]] = {}
+        shown_doc_ids = set()
+
+        for idx, retriever_docs in run_retrievers(
+            retriever_nodes, timeout=self.retriever_timeout, text=query
+        ):
+            yield from self.show_retrieved_docs(
+                idx, retriever_docs, results, shown_doc_ids
+            )
 
-            retriever_docs_text = []
-            retriever_docs_plot = []
+        return merge_retrieved_docs(results)
 
-            for doc in retriever_docs:
-                if doc.metadata.get("type", "") == "plot":
-                    retriever_docs_plot.append(doc)
-                else:
-                    retriever_docs_text.append(doc)
+    async def aretrieve_stream(
+        self, message: str, history: list, results: dict
+    ) -> AsyncGenerator[Document, None]:
+        """Retrieve the documents as `retrieve_stream` does, without blocking the
+        event loop
 
-            for doc in retriever_docs_text:
-                if doc.doc_id not in doc_ids:
-                    docs.append(doc)
-                    doc_ids.append(doc.doc_id)
+        As an async generator cannot return a value, the documents of each retriever
+        are stored in `results`, keyed by retriever index, to be merged with
+        `merge_retrieved_docs`.
+        """
+        retriever_nodes = [
+            self._prepare_child(retriever, f"retriever_{idx}")
+            for idx, retriever in enumerate(self.retrievers)
+        ]
+        shown_doc_ids: set[str] = set()
 
-            plot_docs.extend(retriever_docs_plot)
+        async for idx, retriever_docs in arun_retrievers(
+            retriever_nodes, timeout=self.retriever_timeout, text=message
+        ):
+            for doc in self.show_retrieved_docs(
+                idx, retriever_docs, results, shown_doc_ids
+            ):
+                yield doc
+
+    def show_retrieved_docs(
+        self,
+        idx: int,
+        retriever_docs: list[RetrievedDocument],
+        results: dict[int, list[RetrievedDocument]],
+        shown_doc_ids: set[str],
+    ) -> Generator[Document, None, None]:
+        """Keep the text documents of the retriever in `results` and show the ones
+        not shown yet, with the plots"""
+        retriever_docs_text = []
+        retriever_docs_plot = []
+
+        for doc in retriever_docs:
+            if doc.metadata.get("type", "") == "plot":
+                retriever_docs_plot.append(doc)
+            else:
+                retriever_docs_text.append(doc)
+
+        results[idx] = retriever_docs_text
+        for doc in retriever_docs_text:
+            if doc.doc_id not in shown_doc_ids:
+                shown_doc_ids.add(doc.doc_id)
+                yield Document(
+                    channel="info",
+                    content=Render.collapsible_with_header(doc, open_collapsible=True),
+                )
 
-        info = [
-            Document(
-                channel="info",
-                content=Render.collapsible_with_header(doc, open_collapsible=True),
-            )
-            for doc in docs
-        ] + [
-            Document(
+        for doc in retriever_docs_plot:
+            yield Document(
                 channel="plot",
                 content=doc.metadata.get("data", ""),
             )
-            for doc in plot_docs
-        ]
 
-        return docs, info
+    def retrieve(
+        self, message: str, history: list
+    ) -> tuple[list[RetrievedDocument], list[Document]]:
+        """Retrieve the documents based on the message"""
+        output = GeneratorWrapper(self.retrieve_stream(message, history))
+        info = list(output)
+        return output.value, info
 
     def prepare_mindmap(self, answer) -> Document | None:
         mindmap = answer.metadata["mindmap"]
@@ -272,10 +334,152 @@ class FullQAPipeline(BaseReasoning):
     async def ainvoke(  # type: ignore
         self, message: str, conv_id: str, history: list, **kwargs  # type: ignore
     ) -> Document:  # type: ignore
-        raise NotImplementedError
+        answer = None
+        async for response in self.astream(message, conv_id, history, **kwargs):
+            answer = response
+        return answer
+
+    async def astream(  # type: ignore
+        self, message: str, conv_id: str, history: list, **kwargs  # type: ignore
+    ) -> AsyncGenerator[Document, None]:
+        """Stream the answer as `answer_stream` does, without blocking the event loop
+
+        The LLM calls are awaited and the relevance scoring runs in a task alongside
+        the answer, so that a worker serves many conversations concurrently. As an
+        async generator cannot return a value, the answer is yielded last, on no
+        channel. The answer cache is not used.
+        """
+        if self.use_rewrite and self.rewrite_pipeline:
+            print("Chosen rewrite pipeline", self.rewrite_pipeline)
+            message = (
+                await asyncio.to_thread(self.rewrite_pipeline, question=message)
+            ).text
+            print("Rewrite result", message)
+
+        print(f"Retrievers {self.retrievers}")
+        results: dict[int, list[RetrievedDocument]] = {}
+        async for response in self.aretrieve_stream(message, history, results):
+            yield response
+        docs = merge_retrieved_docs(results)
+        print(f"Got {len(docs)} retrieved documents")
+
+        evidence_mode, evidence, images = self.evidence_pipeline(docs).content
+
+        # generate relevant score alongside the answer
+        scoring_task = None
+        if evidence and self.retrievers:
+            scoring_task = asyncio.create_task(
+                asyncio.to_thread(
+                    self.retrievers[0].generate_relevant_scores, message, docs
+                )
+            )
+
+        answer = None
+        try:
+            async for response in self.answering_pipeline.astream(
+                question=message,
+                history=history,
+                evidence=evidence,
+                evidence_mode=evidence_mode,
+                images=images,
+                conv_id=conv_id,
+                **kwargs,
+            ):
+                if response.channel is None:
+                    answer = response
+                else:
+                    yield response
+
+            if scoring_task:
+                docs = await scoring_task
+        finally:
+            if scoring_task:
+                scoring_task.cancel()
+
+        # the mindmap rendering and the citation plot call external services
+        addons = await asyncio.to_thread(
+            list, self.show_citations_and_addons(answer, docs, message)
+        )
+        for response in addons:
+            yield response
+
+        yield answer
+
+    def question_embedding(self, message: str) -> Optional[list[float]]:
+        """Embed the normalized question, to find the cached answers of similar ones"""
+        try:
+            return embeddings.get_default()(normalize_question(message))[0].embedding
+        except Exception as e:
+            logger.warning(f"Cannot embed the question for the answer cache: {e}")
+            return None
 
     def stream(  # type: ignore
         self, message: str, conv_id: str, history: list, **kwargs  # type: ignore
+    ) -> Generator[Document, None, Document]:
+        """Stream the answer, replaying the cached answer of a similar question on the
+        same files and settings when the answer cache is enabled"""
+        if answer_cache is None or self.answer_cache_files is None:
+            return (yield from self.answer_stream(message, conv_id, history, **kwargs))
+
+        scope = hash_scope(
+            self.answer_cache_settings,
+            sorted(self.answer_cache_files),
+            history[-self.answering_pipeline.n_last_interactions :],
+        )
+        embedding = self.question_embedding(message)
+
+        # when regenerating, a new answer is expected
+        cached = None
+        if not self.use_rewrite:
+            try:
+                cached = answer_cache.get(scope, message, embedding)
+            except Exception as e:
+                logger.exception(f"Failed to read the answer cache: {e}")
+
+        if cached is not None:
+            logger.debug("Answer cache hit")
+            cached_stream, cached_answer = cached
+            for channel, content in cached_stream:
+                yield Document(channel=channel, content=content)
+            return Document(
+                text=cached_answer["text"], metadata=cached_answer["metadata"]
+            )
+
+        recorded = []
+        output = GeneratorWrapper(
+            self.answer_stream(message, conv_id, history, **kwargs)
+        )
+        for response in output:
+            if isinstance(response, Document) and response.channel is not None:
+                recorded.append((response.channel, response.content))
+            yield response
+        answer = output.value
+
+        if answer is not None and answer.text:
+            metadata = {}
+            for key, value in answer.metadata.items():
+                try:
+                    json.dumps(value)
+                except (TypeError, ValueError):
+                    continue
+                metadata[key] = value
+
+            try:
+                answer_cache.set(
+                    scope,
+                    message,
+                    embedding,
+                    self.answer_cache_files,
+                    recorded,
+                    {"text": answer.text, "metadata": metadata},
+                )
+            except Exception as e:
+                logger.exception(f"Failed to store the answer in the cache: {e}")
+
+        return answer
+
+    def answer_stream(
+        self, message: str, conv_id: str, history: list, **kwargs
     ) -> Generator[Document, None, Document]:
         if self.use_rewrite and self.rewrite_pipeline:
             print("Chosen rewrite pipeline", self.rewrite_pipeline)
@@ -284,9 +488,8 @@ class FullQAPipeline(BaseReasoning):
 
         print(f"Retrievers {self.retrievers}")
         # should populate the context
-        docs, infos = self.retrieve(message, history)
+        docs = yield from self.retrieve_stream(message, history)
         print(f"Got {len(docs)} retrieved documents")
-        yield from infos
 
         evidence_mode, evidence, images = self.evidence_pipeline(docs).content
 
@@ -340,7 +543,21 @@ class FullQAPipeline(BaseReasoning):
 
         prefix = f"reasoning.options.{cls.get_info()['id']}"
         llm_name = settings.get(f"{prefix}.llm", None)
-        llm = llms.get(llm_name, llms.get_default())
+        if llm_name not in llms:
+            llm_name = llms.get_default_name()
+        llm = llms[llm_name]
+
+        # the cached answers are shared by the same model, answering and retrieval
+        # settings
+        answer_settings = {
+            key: value
+            for key, value in settings.items()
+            if (key.startswith((f"{prefix}.", "index.")) and key != f"{prefix}.llm")
+            or key in ("reasoning.lang", "reasoning.max_context_length")
+        }
+        pipeline.answer_cache_settings = hash_scope(
+            cls.get_info()["id"], llm_name, answer_settings
+        )
 
         # prepare evidence pipeline configuration
         evidence_pipeline = pipeline.evidence_pipeline
@@ -481,11 +698,9 @@ class FullDecomposeQAPipeline(FullQAPipeline):
                 f"<br>{message}<br><b>Answer</b><br>",
             )
             # should populate the context
-            docs, infos = self.retrieve(message, history)
+            docs = yield from self.retrieve_stream(message, history)
             print(f"Got {len(docs)} retrieved documents")
 
-            yield from infos
-
             evidence_mode, evidence, images = self.evidence_pipeline(docs).content
             answer = yield from self.answering_pipeline.stream(
                 question=message,
@@ -503,8 +718,18 @@ class FullDecomposeQAPipeline(FullQAPipeline):
 
         return output_str
 
-    def stream(  # type: ignore
+    async def astream(  # type: ignore
         self, message: str, conv_id: str, history: list, **kwargs  # type: ignore
+    ) -> AsyncGenerator[Document, None]:
+        """The async path of `FullQAPipeline` does not decompose the question, use
+        `stream` instead"""
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support astream, use stream"
+        )
+        yield  # make it an async generator, as in the parent class
+
+    def answer_stream(
+        self, message: str, conv_id: str, history: list, **kwargs
     ) -> Generator[Document, None, Document]:
         sub_question_answer_output = ""
         if self.rewrite_pipeline:
@@ -532,9 +757,8 @@ class FullDecomposeQAPipeline(FullQAPipeline):
         )
 
         # should populate the context
-        docs, infos = self.retrieve(message, history)
+        docs = yield from self.retrieve_stream(message, history)
         print(f"Got {len(docs)} retrieved documents")
-        yield from infos
 
         evidence_mode, evidence, images = self.evidence_pipeline(docs).content
         answer = yield from self.answering_pipeline.stream(
@@ -4,6 +4,7 @@ import markdown
 from fast_langdetect import detect
 
 from kotaemon.base import RetrievedDocument
+from kotaemon.storages.blobstore import get_blob_store, is_blob_uri
 
 BASE_PATH = os.environ.get("GRADIO_ROOT_PATH", "")
 
@@ -130,7 +131,14 @@ class Render:
 
     @staticmethod
     def image(url: str, text: str = "") -> str:
-        """Render an image"""
+        """Render an image
+
+        A blob uri is rendered as a link to the blob file, so that the browser only
+        loads the image when it is shown.
+        """
+        if is_blob_uri(url):
+            store = get_blob_store()
+            url = f"{BASE_PATH}/file={store.get_path(url)}" if store else ""
         img = f'<img src="{url}"><br>'
         if text:
             caption = f"<p>{text}</p>"
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+from kotaemon.base import LLMInterface
+from kotaemon.indices.qa.citation import CitationPipeline
+from kotaemon.indices.qa.citation_qa import AnswerWithContextPipeline
+from kotaemon.llms import ChatLLM
+
+CONTEXT = "Cinnamon AI is a company based in Tokyo. It builds document AI."
+CHUNKS = ["Cinnamon AI", " is based", " in Tokyo."]
+
+
+class StubLLM(ChatLLM):
+    """Stream the answer chunk by chunk, and cite the context when asked to"""
+
+    def invoke(self, messages, **kwargs) -> LLMInterface:
+        if "tools" in kwargs:
+            arguments = json.dumps({"evidences": ["based in Tokyo"]})
+            return LLMInterface(
+                content="",
+                additional_kwargs={
+                    "tool_calls": [{"function": {"arguments": arguments}}]
+                },
+            )
+        return LLMInterface(content="".join(CHUNKS))
+
+    async def ainvoke(self, messages, **kwargs) -> LLMInterface:
+        return self.invoke(messages, **kwargs)
+
+    async def astream(self, messages, **kwargs):
+        for chunk in CHUNKS:
+            await asyncio.sleep(0)
+            yield LLMInterface(content=chunk, logprobs=[-0.1])
+
+
+def test_answer_with_context_astream():
+    llm = StubLLM()
+    pipeline = AnswerWithContextPipeline(
+        llm=llm,
+        citation_pipeline=CitationPipeline(llm=llm),
+        enable_citation=True,
+    )
+
+    async def collect():
+        return [
+            response
+            async for response in pipeline.astream(
+                question="Where is Cinnamon AI?", evidence=CONTEXT
+            )
+        ]
+
+    responses = asyncio.run(collect())
+    *chunks, end, answer = responses
+
+    assert [chunk.channel for chunk in chunks] == ["chat"] * len(CHUNKS)
+    assert [chunk.content for chunk in chunks] == CHUNKS
+    # the end of the answer is marked before waiting for the citation
+    assert end.channel == "chat_end"
+    # the answer is yielded last, with the citation generated alongside
+    assert answer.channel is None
+    assert answer.text == "".join(CHUNKS)
+    assert answer.metadata["citation"].evidences == ["based in Tokyo"]
+    assert answer.metadata["mindmap"] is None
+    assert answer.metadata["qa_score"] is not None
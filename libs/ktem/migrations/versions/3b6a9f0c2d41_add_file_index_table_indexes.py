@@ -0,0 +1,61 @@
+"""add indexes to the file index tables
+
+Revision ID: 3b6a9f0c2d41
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+
+import re
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3b6a9f0c2d41"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the Index table of each file index, created dynamically by `FileIndex`
+INDEX_TABLE_PATTERN = re.compile(r"^index__(\d+)__index$")
+
+
+def _index_tables() -> list[tuple[str, str]]:
+    inspector = sa.inspect(op.get_bind())
+    tables = []
+    for table_name in inspector.get_table_names():
+        match = INDEX_TABLE_PATTERN.match(table_name)
+        if match:
+            tables.append((match.group(1), table_name))
+    return tables
+
+
+def _table_indexes(table_id: str) -> dict[str, list[str]]:
+    return {
+        f"ix_index__{table_id}__index_source_relation_target": [
+            "source_id",
+            "relation_type",
+            "target_id",
+        ],
+        f"ix_index__{table_id}__index_target": ["target_id"],
+    }
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table_id, table_name in _index_tables():
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+        for index_name, columns in _table_indexes(table_id).items():
+            if index_name not in existing:
+                op.create_index(index_name, table_name, columns)
+
+
+def downgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table_id, table_name in _index_tables():
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+        for index_name in _table_indexes(table_id):
+            if index_name in existing:
+                op.drop_index(index_name, table_name=table_name)
@@ -0,0 +1,92 @@
+"""Compare the citation matching of `find_text` with its difflib implementation
+
+Every quote of the answer is matched with every retrieved document, as done after
+each answer. The quotes are paraphrased excerpts of the documents.
+
+Usage:
+    python scripts/benchmark_citation_matching.py --docs 10 --words 750 --quotes 5
+"""
+
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+
+from kotaemon.indices.qa.utils import find_text
+
+WORDS = (
+    "the a of and to in revenue growth market cost report customer product quarter "
+    "team risk policy data model service price sales plan region energy contract"
+).split()
+
+
+def reference_find_text(search_span, context, min_length=5):
+    """`find_text` as implemented with `difflib.SequenceMatcher`"""
+    context = context.replace("\n", " ")
+    matches_span = []
+    if len(search_span) > min_length:
+        for sentence in search_span.split("\n"):
+            blocks = [
+                (start, start + length)
+                for _, start, length in SequenceMatcher(
+                    None, sentence, context, autojunk=False
+                ).get_matching_blocks()
+                if length > max(len(sentence) * 0.2, min_length)
+            ]
+            if blocks:
+                start = min(start for start, _ in blocks)
+                end = max(end for _, end in blocks)
+                if end - start > max(len(sentence) * 0.35, min_length):
+                    matches_span.append((start, end))
+    if matches_span:
+        matches_span = [
+            (min(s for s, _ in matches_span), max(e for _, e in matches_span))
+        ]
+    return matches_span
+
+
+def make_case(n_docs: int, n_words: int, n_quotes: int):
+    rng = random.Random(0)
+    docs = [" ".join(rng.choices(WORDS, k=n_words)) for _ in range(n_docs)]
+    quotes = []
+    for _ in range(n_quotes):
+        context = rng.choice(docs)
+        length = rng.randint(40, 300)
+        start = rng.randint(0, max(len(context) - length, 0))
+        words = context[start : start + length].split(" ")
+        for _ in range(len(words) // 8):
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+        quotes.append(" ".join(words))
+    return docs, quotes
+
+
+def timeit(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--words", type=int, default=750, help="words per doc")
+    parser.add_argument("--quotes", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    docs, quotes = make_case(args.docs, args.words, args.quotes)
+
+    def match_all(find):
+        return [find(quote, doc) for quote in quotes for doc in docs]
+
+    assert match_all(find_text) == match_all(reference_find_text)
+    print(f"{'difflib (ms)':>15} {'find_text (ms)':>15}")
+    print(
+        f"{timeit(lambda: match_all(reference_find_text), args.repeat):>15.1f} "
+        f"{timeit(lambda: match_all(find_text), args.repeat):>15.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
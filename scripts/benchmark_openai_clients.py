@@ -0,0 +1,143 @@
+"""Compare a fresh OpenAI client per request with the shared `openai_clients`
+
+A local stub server answers the chat completions, so that the measured latency is
+the cost of the client: its construction, the TCP connections and their pools. The
+fresh clients are closed after their request, otherwise their connections pile up
+until the stub server stops accepting new ones.
+
+Usage:
+    python scripts/benchmark_openai_clients.py --requests 200 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import AsyncOpenAI, OpenAI
+
+from kotaemon.llms.chats.openai import openai_clients
+
+COMPLETION = json.dumps(
+    {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "stub",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "Hello!"},
+            }
+        ],
+        "usage": {"completion_tokens": 2, "prompt_tokens": 5, "total_tokens": 7},
+    }
+).encode()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep the connections alive
+    timeout = 5  # drop the connections left open by the fresh clients
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+def chat(client):
+    return client.chat.completions.create(
+        model="stub", messages=[{"role": "user", "content": "Hi"}]
+    )
+
+
+def run_sync(get_client, n_requests: int, concurrency: int, close: bool) -> float:
+    def request(_):
+        start = time.perf_counter()
+        client = get_client()
+        chat(client)
+        if close:
+            client.close()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(request, range(n_requests)))
+    return sum(latencies) / len(latencies) * 1000
+
+
+def run_async(get_client, n_requests: int, concurrency: int, close: bool) -> float:
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request():
+            async with semaphore:
+                start = time.perf_counter()
+                client = get_client()
+                await chat(client)
+                if close:
+                    await client.close()
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*[request() for _ in range(n_requests)])
+
+    latencies = asyncio.run(main())
+    return sum(latencies) / len(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    params = {
+        "api_key": "dummy",
+        "base_url": f"http://127.0.0.1:{server.server_port}/v1",
+        "max_retries": 0,
+    }
+
+    print(f"{args.requests} requests, {args.concurrency} in flight")
+    print(f"{'path':<6} {'fresh client (ms)':>18} {'shared client (ms)':>19}")
+    fresh = run_sync(
+        lambda: OpenAI(**params), args.requests, args.concurrency, close=True
+    )
+    shared = run_sync(
+        lambda: openai_clients.get(OpenAI, **params),
+        args.requests,
+        args.concurrency,
+        close=False,
+    )
+    print(f"{'sync':<6} {fresh:>18.2f} {shared:>19.2f}")
+
+    fresh = run_async(
+        lambda: AsyncOpenAI(**params), args.requests, args.concurrency, close=True
+    )
+    shared = run_async(
+        lambda: openai_clients.get(AsyncOpenAI, async_version=True, **params),
+        args.requests,
+        args.concurrency,
+        close=False,
+    )
+    print(f"{'async':<6} {fresh:>18.2f} {shared:>19.2f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
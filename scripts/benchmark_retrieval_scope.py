@@ -0,0 +1,98 @@
+"""Compare the two ways of scoping the full-text search to the selected files
+
+- chunk_ids: the chunk ids of the selected files are listed and passed as `doc_ids`
+- file_id: the `file_id` metadata is filtered natively with `file_ids`
+
+Usage:
+    python scripts/benchmark_retrieval_scope.py --files 2000 --chunks 50 --selected 500
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+from kotaemon.base import Document
+from kotaemon.storages import (
+    InMemoryDocumentStore,
+    LanceDBDocumentStore,
+    SQLiteDocumentStore,
+)
+
+WORDS = (
+    "revenue growth market cost report customer product quarter team risk "
+    "policy data model service price sales plan region energy contract"
+).split()
+
+
+def make_docs(n_files: int, n_chunks: int) -> dict[str, list[Document]]:
+    rng = random.Random(0)
+    return {
+        f"file{file_idx}": [
+            Document(
+                text=" ".join(rng.choices(WORDS, k=60)),
+                id_=f"file{file_idx}-chunk{chunk_idx}",
+                metadata={"file_id": f"file{file_idx}"},
+            )
+            for chunk_idx in range(n_chunks)
+        ]
+        for file_idx in range(n_files)
+    }
+
+
+def timeit(fn, repeat: int) -> float:
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--chunks", type=int, default=50, help="chunks per file")
+    parser.add_argument("--selected", type=int, default=300, help="selected files")
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    files = make_docs(args.files, args.chunks)
+    selected = random.Random(1).sample(sorted(files), args.selected)
+    query = "revenue growth of the energy contract"
+
+    print(
+        f"{args.files} files x {args.chunks} chunks, {args.selected} files selected, "
+        f"top_k={args.top_k}"
+    )
+    print(f"{'store':<10} {'chunk_ids (ms)':>15} {'file_id (ms)':>13}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stores = {
+            "memory": InMemoryDocumentStore(),
+            "sqlite": SQLiteDocumentStore(path=tmp_dir),
+            "lancedb": LanceDBDocumentStore(path=f"{tmp_dir}/lancedb"),
+        }
+        for name, store in stores.items():
+            for docs in files.values():
+                store.add(docs)
+            store.flush()
+
+            def by_chunk_ids():
+                # the chunk ids would be read from the Index table
+                chunk_ids = [doc.doc_id for f in selected for doc in files[f]]
+                return store.query(query, top_k=args.top_k, doc_ids=chunk_ids)
+
+            def by_file_id():
+                return store.query(query, top_k=args.top_k, file_ids=selected)
+
+            assert {doc.doc_id for doc in by_chunk_ids()} == {
+                doc.doc_id for doc in by_file_id()
+            }
+            print(
+                f"{name:<10} {timeit(by_chunk_ids, args.repeat):>15.1f} "
+                f"{timeit(by_file_id, args.repeat):>13.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
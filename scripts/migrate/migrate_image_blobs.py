@@ -0,0 +1,61 @@
+"""Move the base64 images of the indexed documents to the blob store
+
+The documents indexed before the blob store keep their page thumbnails and
+figures inline in their metadata. Run this script from the root of the project,
+with the same settings as the app:
+
+    $ python scripts/migrate/migrate_image_blobs.py
+
+The blobs are not removed with the deleted files. With `--prune`, the blobs that
+no indexed document refers to anymore are removed, stop the app before running it:
+
+    $ python scripts/migrate/migrate_image_blobs.py --prune
+"""
+
+import argparse
+
+from ktem.components import get_docstore
+from ktem.db.engine import engine
+from ktem.index.models import Index
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from kotaemon.storages.blobstore import (
+    get_blob_store,
+    offload_docstore_images,
+    remove_unreferenced_blobs,
+)
+
+
+def main(prune: bool = False):
+    blob_store = get_blob_store()
+    if blob_store is None:
+        raise ValueError("Please set KH_BLOB_STORE_PATH in flowsettings.py")
+
+    with Session(engine) as session:
+        file_indices = [
+            index
+            for index in session.scalars(select(Index))
+            if index.index_type.startswith("ktem.index.file")
+        ]
+
+    doc_stores = []
+    for file_index in file_indices:
+        doc_store = get_docstore(f"index_{file_index.id}")
+        count = offload_docstore_images(doc_store, blob_store)
+        print(f"Index {file_index.id} ({file_index.name}): moved {count} images")
+        doc_stores.append(doc_store)
+
+    if prune:
+        count = remove_unreferenced_blobs(doc_stores, blob_store)
+        print(f"Removed {count} unreferenced blobs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="remove the blobs no indexed document refers to",
+    )
+    main(prune=parser.parse_args().prune)